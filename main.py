@@ -13,8 +13,16 @@ from src.scraping.download_fonts import get_font_links
 from src.scraping.download_images import download_db_illustrations
 from src.text_dataset_format_changer import convert_jesc_to_dataframe
 from src.extract_and_verify_fonts import verify_font_files
-from src.convert_images import convert_images_to_bw
+from src.convert_images import convert_images_to_bw, downscale_assets
+from src.asset_index import build_asset_index
+from src.benchmarks import run_benchmarks, print_benchmarks
+from src.layout_engine.tracing import (
+    print_trace_report,
+    start_trace_run,
+    get_last_trace_run
+)
 from src.layout_engine.page_renderer import render_pages
+from src.layout_engine.page_generator import generate_pages
 from src.layout_engine.page_metadata_creator import (
     create_metadata,
     create_page_metadata
@@ -50,12 +58,35 @@ def parse_args():
                         action="store_true",
                         help="Convert downloaded images to black and white")
 
+    parser.add_argument("--downscale_assets", "-da",
+                        action="store_true",
+                        help="Scale backgrounds and foregrounds down to "
+                        "the largest size pages show them at")
+
+    parser.add_argument("--build_asset_index", "-ai",
+                        action="store_true",
+                        help="Index the sizes of the image assets")
+
     parser.add_argument("--create_page_metadata", "-pm", nargs=1, type=int)
     parser.add_argument("--render_pages", "-rp", action="store_true")
     parser.add_argument("--create_annotations", "-ca", action="store_true")
     parser.add_argument("--generate_pages", "-gp", nargs=1, type=int)
+    parser.add_argument("--keep_metadata", "-km", action="store_true",
+                        help="Also write the metadata of the generated pages")
     parser.add_argument("--dry", action="store_true", default=False)
     parser.add_argument("--run_tests", action="store_true")
+    parser.add_argument("--trace", action="store_true",
+                        help="Record how long each stage and asset takes")
+    parser.add_argument("--trace_report", nargs="?", const=20, type=int,
+                        help="Report the slowest stages and assets of "
+                        "the traces, optionally how many assets")
+    parser.add_argument("--run_benchmarks", "-rb", nargs="?", const=5,
+                        type=int,
+                        help="Time the page generation stages on synthetic "
+                        "assets, optionally how many times")
+    parser.add_argument("--benchmark_font", default=None,
+                        help="Font to benchmark with instead of one "
+                        "installed on this machine")
 
     return parser.parse_args()
 
@@ -83,6 +114,11 @@ def _create_annotations(annotations_path):
 def main(args):
     os.makedirs(cfg.OUTPUT_DIR, exist_ok=True)
 
+    # Each traced run writes its trace files to a folder of its
+    # own, which the workers are given when they start
+    if args.trace or cfg.trace_spans:
+        start_trace_run(cfg.TRACE_DIR)
+
     # Wrangling with the text dataset
     if args.download_jesc:
         download_and_extract_jesc()
@@ -125,6 +161,14 @@ def main(args):
     if args.convert_images:
         convert_images_to_bw()
 
+    # Sizes change, so the asset index is built after
+    if args.downscale_assets:
+        downscale_assets()
+
+    if args.build_asset_index or (args.downscale_assets and
+                                  os.path.isfile(cfg.asset_index_path)):
+        build_asset_index()
+
     coco_annotations_path = os.path.join(cfg.OUTPUT_DIR, "labels.json")
 
     if not os.path.isdir(cfg.IMAGES_DIR):
@@ -143,13 +187,21 @@ def main(args):
     if args.create_annotations:
         _create_annotations(coco_annotations_path)
 
-    # Combines the above in case of small size
+    # Combines the above, each page is created, rendered
+    # and annotated by the same worker
     if args.generate_pages is not None:
         if not os.path.isdir(cfg.METADATA_DIR):
             os.mkdir(cfg.METADATA_DIR)
-        _create_metadata(args.generate_pages[0], args.dry)
-        _render_pages(args.dry)
-        _create_annotations(coco_annotations_path)
+        generate_pages(args.generate_pages[0], coco_annotations_path,
+                       args.dry, args.keep_metadata)
+
+    if args.trace_report is not None:
+        print_trace_report(get_last_trace_run(cfg.TRACE_DIR),
+                           args.trace_report)
+
+    if args.run_benchmarks is not None:
+        print_benchmarks(run_benchmarks(repeat=args.run_benchmarks,
+                                        font_path=args.benchmark_font))
 
     if args.run_tests:
         pytest.main([
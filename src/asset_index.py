@@ -0,0 +1,168 @@
+import os
+import hashlib
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from PIL import Image
+from tqdm import tqdm
+
+from . import config_file as cfg
+
+
+def describe_image(image_path):
+    """
+    Read the header and pixels of an image asset to get the
+    information kept in the asset index
+
+    :param image_path: Path to the image
+
+    :type image_path: str
+
+    :return: The image's path, size, mode, bounding box of
+    its non-transparent area, empty if it's fully transparent,
+    and a hash of the file's contents
+
+    :rtype: dict
+    """
+    with open(image_path, "rb") as image_file:
+        content_hash = hashlib.blake2b(image_file.read(),
+                                       digest_size=16).hexdigest()
+
+    with Image.open(image_path) as img:
+        width, height = img.size
+        mode = img.mode
+        # Images without transparency are opaque everywhere, and
+        # a fully transparent image has an empty bounding box
+        alpha_bbox = (0, 0, width, height)
+        if "A" in img.getbands():
+            alpha_bbox = img.getchannel("A").getbbox() or (0, 0, 0, 0)
+
+    return dict(
+        path=image_path,
+        width=width,
+        height=height,
+        mode=mode,
+        alpha_x1=alpha_bbox[0],
+        alpha_y1=alpha_bbox[1],
+        alpha_x2=alpha_bbox[2],
+        alpha_y2=alpha_bbox[3],
+        content_hash=content_hash,
+    )
+
+
+def get_asset_paths():
+    """
+    List the backgrounds, foregrounds and speech bubble templates
+    with the same paths the page metadata uses for them
+
+    :return: A list of image paths
+    :rtype: list
+    """
+    paths = [os.path.join(cfg.backgrounds_dir_path, filename)
+             for filename in os.listdir(cfg.backgrounds_dir_path)]
+    paths += [os.path.join(cfg.foregrounds_dir_path, filename)
+              for filename in os.listdir(cfg.foregrounds_dir_path)]
+
+    speech_bubble_tags = pd.read_csv(cfg.speech_bubble_tags_path)
+    paths += list(speech_bubble_tags["imagename"].dropna().unique())
+
+    return paths
+
+
+def build_asset_index():
+    """
+    Scan all the image assets once, concurrently and in parallel,
+    and store what the layout engine needs to know about them in
+    a Parquet table
+    """
+    paths = get_asset_paths()
+
+    print("Indexing image assets")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=cfg.CONCURRENT_MAX_WORKERS) as executor:
+        records = list(tqdm(executor.map(describe_image, paths,
+                                         chunksize=64),
+                            total=len(paths)))
+
+    pd.DataFrame(records).to_parquet(cfg.asset_index_path, index=False)
+
+
+class AssetIndex(object):
+    """
+    Lookup table of image asset sizes so that the layout engine
+    doesn't need to open an image to know its dimensions. Assets
+    missing from the index are opened and remembered.
+
+    :param paths: Paths of the indexed assets
+
+    :type paths: list, optional
+
+    :param sizes: An array of (width, height) of each asset
+
+    :type sizes: numpy.ndarray, optional
+    """
+
+    def __init__(self, paths=None, sizes=None):
+        """
+        Constructor method
+        """
+        if paths is None:
+            paths = []
+            sizes = np.zeros((0, 2), dtype=np.int32)
+
+        self.rows = {os.path.normpath(path): row
+                     for row, path in enumerate(paths)}
+        self.sizes = sizes
+
+        # Sizes of assets that weren't indexed
+        self.missing = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get_size(self, image_path):
+        """
+        Get the size of an image asset
+
+        :param image_path: Path to the image
+
+        :type image_path: str
+
+        :return: width and height of the image
+        :rtype: tuple
+        """
+        row = self.rows.get(os.path.normpath(image_path))
+
+        if row is not None:
+            width, height = self.sizes[row]
+            return int(width), int(height)
+
+        if image_path not in self.missing:
+            with Image.open(image_path) as img:
+                self.missing[image_path] = img.size
+
+        return self.missing[image_path]
+
+    @classmethod
+    def load(cls, index_path):
+        """
+        Load the asset index, or an empty one if it
+        hasn't been built
+
+        :param index_path: Path to the Parquet table of the index
+
+        :type index_path: str
+
+        :return: The asset index
+        :rtype: AssetIndex
+        """
+        if not os.path.isfile(index_path):
+            return cls()
+
+        table = pq.read_table(index_path, columns=["path", "width", "height"])
+        sizes = np.stack([
+            table.column("width").to_numpy(),
+            table.column("height").to_numpy()
+        ], axis=1).astype(np.int32)
+
+        return cls(table.column("path").to_pylist(), sizes)
@@ -0,0 +1,368 @@
+import os
+import sys
+import copy
+import json
+import glob
+import time
+import tempfile
+import platform
+import contextlib
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageDraw
+
+from . import config_file as cfg
+from .asset_index import AssetIndex
+from .layout_engine.page_objects import Page
+from .layout_engine.generation_context import GenerationContext
+from .layout_engine.page_metadata_creator import (
+    populate_panels,
+    create_page_metadata
+)
+from .layout_engine.page_metadata_draw import get_base_panels
+from .layout_engine.page_metadata_transforms import (
+    add_transforms,
+    shrink_panels
+)
+
+
+# Where to look for a font for the speech bubble text
+SYSTEM_FONT_DIRS = [
+    "/usr/share/fonts/",
+    "/usr/local/share/fonts/",
+    "/Library/Fonts/",
+    "/System/Library/Fonts/",
+    "C:\\Windows\\Fonts\\",
+]
+
+BENCHMARKS = [
+    "get_base_panels",
+    "add_transforms",
+    "shrink_panels",
+    "populate_panels",
+    "Page.render",
+    "SpeechBubble.render",
+    "Character.render",
+    "Page.create_coco_annotations",
+]
+
+
+def find_system_font():
+    """
+    Find a TrueType font installed on this machine
+
+    :return: Path of the font
+    :rtype: str
+    """
+    for font_dir in SYSTEM_FONT_DIRS:
+        fonts = sorted(glob.glob(os.path.join(font_dir, "**", "*.ttf"),
+                                 recursive=True))
+        if len(fonts) > 0:
+            return fonts[0]
+
+    raise FileNotFoundError("Could not find a TrueType font, "
+                            "please pass the path of one")
+
+
+def create_synthetic_assets(assets_dir, font_path, seed=0):
+    """
+    Create small fake backgrounds, foregrounds, speech bubble
+    templates, textures and texts to benchmark with, so that
+    the datasets don't have to be downloaded
+
+    :param assets_dir: Folder to create the assets in
+
+    :type assets_dir: str
+
+    :param font_path: Font for the speech bubble text
+
+    :type font_path: str
+
+    :param seed: Seed of the assets, defaults to 0
+
+    :type seed: int, optional
+
+    :return: The folders and files of the assets
+    :rtype: dict
+    """
+    rng = np.random.default_rng(seed)
+    backgrounds_dir_path = os.path.join(assets_dir, "backgrounds/")
+    foregrounds_dir_path = os.path.join(assets_dir, "foregrounds/")
+    speech_bubbles_dir_path = os.path.join(assets_dir, "speech_bubbles/")
+    textures_dir_path = os.path.join(assets_dir, "textures/")
+
+    for path in [backgrounds_dir_path, foregrounds_dir_path,
+                 speech_bubbles_dir_path, textures_dir_path]:
+        os.makedirs(path, exist_ok=True)
+
+    for i in range(4):
+        background = rng.integers(0, 256, (1200 + i*100, 1700, 3),
+                                  dtype=np.uint8)
+        Image.fromarray(background).save(
+            os.path.join(backgrounds_dir_path, f"background_{i}.jpg"))
+
+    # Foregrounds are cut out characters with transparent borders
+    for i in range(4):
+        foreground = Image.new("RGBA", (400 + i*40, 600), (0, 0, 0, 0))
+        ImageDraw.Draw(foreground).ellipse(
+            (20, 20, 380 + i*40, 580),
+            fill=tuple(rng.integers(0, 256, 3).tolist()) + (255,))
+        foreground.save(os.path.join(foregrounds_dir_path,
+                                     f"foreground_{i}.png"))
+
+    tags = []
+    for i, orientation in enumerate([None, None, None, "tl", "tr", "bl", "br"]):
+        bubble = Image.new("L", (500, 380), 0)
+        ImageDraw.Draw(bubble).ellipse((5, 5, 495, 375), fill=255,
+                                       outline=0, width=8)
+        bubble_path = os.path.join(speech_bubbles_dir_path,
+                                   f"speech_bubble_{i}.png")
+        bubble.save(bubble_path)
+
+        writing_areas = [{
+            "x": 20, "y": 20, "width": 60, "height": 60, "rotation": 0,
+            "rectanglelabels": ["text"],
+            "original_width": 500, "original_height": 380,
+        }]
+        tags.append({"imagename": bubble_path,
+                     "label": json.dumps(writing_areas),
+                     "orientation": orientation})
+
+    for i in range(2):
+        texture = rng.integers(0, 256, (600, 600, 3), dtype=np.uint8)
+        Image.fromarray(texture).save(
+            os.path.join(textures_dir_path, f"texture_{i}.png"))
+
+    text_dataset = pd.DataFrame({
+        "English": [" ".join(["lorem ipsum dolor"] * (1 + i % 4))
+                    for i in range(256)],
+        "Japanese": [f"テキスト{i}" for i in range(256)],
+    })
+
+    return dict(
+        backgrounds_dir_path=backgrounds_dir_path,
+        foregrounds_dir_path=foregrounds_dir_path,
+        texture_images=sorted(glob.glob(textures_dir_path + "*")),
+        font_files=[font_path],
+        text_dataset=text_dataset,
+        speech_bubble_tags=pd.DataFrame(tags),
+    )
+
+
+@contextlib.contextmanager
+def use_assets(assets):
+    """
+    Point the config to the synthetic assets while benchmarking
+
+    :param assets: The synthetic assets
+
+    :type assets: dict
+    """
+    keys = ["backgrounds_dir_path", "foregrounds_dir_path", "texture_images"]
+    config = {key: getattr(cfg, key) for key in keys}
+    for key in keys:
+        setattr(cfg, key, assets[key])
+
+    try:
+        yield
+    finally:
+        for key, value in config.items():
+            setattr(cfg, key, value)
+
+
+def time_function(setup, function, repeat):
+    """
+    Time a function, setting up its arguments again before
+    each call since most of them change what they're given
+
+    :param setup: Function returning the arguments of a call
+
+    :type setup: callable
+
+    :param function: Function to time
+
+    :type function: callable
+
+    :param repeat: Number of calls
+
+    :type repeat: int
+
+    :return: Seconds each call took
+    :rtype: list
+    """
+    times = []
+    for i in range(repeat):
+        args = setup(i)
+        start_time = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start_time)
+
+    return times
+
+
+def get_benchmarks(context, seed):
+    """
+    Set up the benchmarked functions. Every call of a function
+    gets the same input and random numbers from the seed.
+
+    :param context: Generation context of the synthetic assets
+
+    :type context: GenerationContext
+
+    :param seed: Seed of the inputs
+
+    :type seed: int
+
+    :return: The setup and timed function of each benchmark
+    :rtype: dict
+    """
+    def get_rng():
+        return np.random.default_rng(seed)
+
+    def get_base_page():
+        return get_base_panels(6, "vh", rng=get_rng())
+
+    page = create_page_metadata(context, get_rng())
+    page.seed = seed
+    page_data = page.get_data()
+
+    def load_page(i):
+        loaded_page = Page()
+        loaded_page.load_dict(copy.deepcopy(page_data), leaves_only=True)
+        return (loaded_page,)
+
+    # Objects are created in a panel the way populate_panels does
+    panel = shrink_panels(get_base_page(), rng=get_rng()).leaf_children[0]
+    panel.refresh_size()
+    panel.refresh_drawable_area()
+
+    def create_speech_bubble(i):
+        rng = get_rng()
+        speech_bubble = context.speech_bubble_factory.create(0, panel, rng)
+        speech_bubble.place_randomly(panel,
+                                     cfg.bubble_to_panel_area_min_ratio,
+                                     cfg.bubble_to_panel_area_max_ratio,
+                                     rng)
+        return (speech_bubble,)
+
+    def create_character(i):
+        rng = get_rng()
+        character = context.character_factory.create(panel, rng)
+        character.place_randomly(panel, rng)
+        return (character,)
+
+    return {
+        "get_base_panels": (
+            lambda i: (6, "vh"),
+            lambda num_panels, layout_type: get_base_panels(
+                num_panels, layout_type, rng=get_rng())),
+        "add_transforms": (
+            lambda i: (get_base_page(),),
+            lambda base_page: add_transforms(base_page, rng=get_rng())),
+        "shrink_panels": (
+            lambda i: (get_base_page(),),
+            lambda base_page: shrink_panels(base_page, rng=get_rng())),
+        "populate_panels": (
+            lambda i: (shrink_panels(get_base_page(), rng=get_rng()),),
+            lambda base_page: populate_panels(base_page, context,
+                                              rng=get_rng())),
+        "Page.render": (
+            load_page,
+            lambda loaded_page: loaded_page.render()),
+        "SpeechBubble.render": (
+            create_speech_bubble,
+            lambda speech_bubble: speech_bubble.render()),
+        "Character.render": (
+            create_character,
+            lambda character: character.render()),
+        "Page.create_coco_annotations": (
+            load_page,
+            lambda loaded_page: loaded_page.create_coco_annotations(1)),
+    }
+
+
+def run_benchmarks(repeat=5, seed=0, names=None, font_path=None):
+    """
+    Time the stages of creating, rendering and annotating pages
+    on synthetic assets
+
+    :param repeat: Number of times to run each benchmark,
+    defaults to 5
+
+    :type repeat: int, optional
+
+    :param seed: Seed of the assets and inputs, defaults to 0
+
+    :type seed: int, optional
+
+    :param names: Benchmarks to run, defaults to all of them
+
+    :type names: list, optional
+
+    :param font_path: Font for the speech bubble text, defaults
+    to one installed on this machine
+
+    :type font_path: str, optional
+
+    :return: The name and timings of each benchmark in seconds
+    :rtype: list
+    """
+    if names is None:
+        names = BENCHMARKS
+    if font_path is None:
+        font_path = find_system_font()
+
+    results = []
+    with tempfile.TemporaryDirectory() as assets_dir:
+        assets = create_synthetic_assets(assets_dir, font_path, seed)
+
+        with use_assets(assets):
+            context = GenerationContext(
+                sorted(os.listdir(cfg.backgrounds_dir_path)),
+                sorted(os.listdir(cfg.foregrounds_dir_path)),
+                assets["font_files"],
+                assets["text_dataset"],
+                assets["speech_bubble_tags"],
+                AssetIndex())
+            benchmarks = get_benchmarks(context, seed)
+
+            for name in names:
+                setup, function = benchmarks[name]
+                times = time_function(setup, function, repeat)
+                results.append(dict(
+                    name=name,
+                    repeat=repeat,
+                    seed=seed,
+                    min=min(times),
+                    median=float(np.median(times)),
+                    mean=float(np.mean(times)),
+                    max=max(times),
+                ))
+
+    return results
+
+
+def print_benchmarks(results, file=sys.stdout):
+    """
+    Print benchmark results as JSON lines, with the
+    versions they were measured with on the first line
+
+    :param results: Benchmark results
+
+    :type results: list
+
+    :param file: Where to print them, defaults to stdout
+
+    :type file: file, optional
+    """
+    environment = dict(
+        python=platform.python_version(),
+        numpy=np.__version__,
+        pillow=Image.__version__,
+        machine=platform.machine(),
+        cpus=os.cpu_count(),
+    )
+    print(json.dumps(dict(environment=environment)), file=file)
+
+    for result in results:
+        print(json.dumps(result), file=file)
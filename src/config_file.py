@@ -10,15 +10,58 @@ fg_data = "datasets/bn_danbooru_fg.csv"
 
 # Concurrent
 CONCURRENT_MAX_WORKERS = 8
+# Maximum number of tasks submitted to the workers at once
+MAX_IN_FLIGHT_TASKS = CONCURRENT_MAX_WORKERS * 2
+# Number of pages each metadata creation task creates
+METADATA_BATCH_SIZE = 16
+# Maximum number of pages in a metadata shard
+METADATA_SHARD_SIZE = 4096
+# zlib level the metadata of each page is compressed with
+METADATA_COMPRESSION_LEVEL = 6
 
 # Paths
 texture_images = glob.glob("datasets/textures/*")
-backgrounds_dir_path = "datasets/backgrounds/"
-foregrounds_dir_path = "datasets/foregrounds/"
+backgrounds_source_dir_path = "datasets/backgrounds/"
+foregrounds_source_dir_path = "datasets/foregrounds/"
+# Where --downscale_assets writes copies of the backgrounds and
+# foregrounds scaled down to the page. Once they're there, they're
+# used instead of the downloaded images, which are left as they are.
+downscaled_assets_dir_path = "datasets/downscaled_assets/"
+backgrounds_dir_path = backgrounds_source_dir_path
+foregrounds_dir_path = foregrounds_source_dir_path
+if os.path.isdir(downscaled_assets_dir_path):
+    backgrounds_dir_path = os.path.join(downscaled_assets_dir_path,
+                                        "backgrounds/")
+    foregrounds_dir_path = os.path.join(downscaled_assets_dir_path,
+                                        "foregrounds/")
 OUTPUT_DIR = "acmd_v3"
 METADATA_DIR = os.path.join(OUTPUT_DIR, "metadata/")
 IMAGES_DIR = os.path.join(OUTPUT_DIR, "data/")
 ANNOTATIONS_DIR = os.path.join(OUTPUT_DIR, "annotations/")
+# Which pages each stage has processed, so runs can resume
+MANIFEST_PATH = os.path.join(OUTPUT_DIR, "manifest.sqlite")
+# Each process writes the timing spans of its stages here
+TRACE_DIR = os.path.join(OUTPUT_DIR, "traces/")
+
+# Text dataset
+text_dataset_path = "datasets/text_dataset/jesc_dialogues"
+# Uncompressed copy of the text dataset that workers memory-map
+text_dataset_arrow_path = "datasets/text_dataset/jesc_dialogues.arrow"
+text_dataset_columns = ["English", "Japanese"]
+# Number of rows of text sampled from the corpus at once for the
+# speech bubbles of a page. Most pages need fewer than this.
+text_sample_batch_size = 64
+
+# Speech bubbles
+speech_bubble_tags_path = "datasets/speech_bubbles_dataset/writing_area_labels.csv"
+
+# Sizes and other properties of the image assets
+asset_index_path = "datasets/asset_index.parquet"
+
+# Memory budget in bytes of the decoded images each worker keeps,
+# and an optional folder to also keep cropped backgrounds in
+image_cache_max_bytes = 512 * 1024 * 1024
+image_cache_dir = None
 
 # **Page rendering**
 page_width = 800
@@ -28,6 +71,17 @@ page_size = (page_width, page_height)
 
 output_format = ".png"
 
+# How the layers of a page are put together: "pil" pastes them
+# with Pillow and "numpy" blends them into buffers each worker
+# keeps from page to page. Both give the same pages. "numpy"
+# allocates less memory for each page but is slower.
+page_compositor = "pil"
+
+# Whether to record how long each stage of creating and rendering
+# a page takes, and how many spans to keep before writing them
+trace_spans = False
+trace_buffer_size = 1024
+
 boundary_width_min = 2
 boundary_width_max = 9
 boundary_color = "black"
@@ -91,6 +145,14 @@ bubble_mask_x_increase = 15
 bubble_mask_y_increase = 15
 min_font_size = 24
 max_font_size = 72
+# How many fonts, by file and size, each worker keeps loaded
+font_cache_size = 128
+
+# **Placement**
+# How many positions to try for a character or bubble before dropping it
+placement_max_attempts = 10
+# Cell size of the spatial index used to find overlapping objects
+placement_grid_cell_size = 64
 
 # **Characters**
 overlap_offset = 24
@@ -125,6 +187,14 @@ full_page_movement_proportion_limit = 25
 # Other
 texture_probability = 0.5
 
+# Whether to take the page noise from a bank of noise tiles each
+# worker generates once instead of drawing it for every page, and
+# the size, number per noise level and seed of the tiles
+noise_tile_bank = False
+noise_tile_size = 256
+noise_tiles_per_sigma = 8
+noise_tile_seed = 0
+
 # Annotation
 min_object_area = 16
 min_subobject_area = 16
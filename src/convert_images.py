@@ -1,9 +1,15 @@
 import os
+import uuid
+import shutil
+import numpy as np
 from tqdm import tqdm
 from PIL import Image
 import concurrent.futures
 import time
 
+from . import config_file as cfg
+from .layout_engine.helpers import crop_image_only_outside
+
 image_dataset_dir = "datasets/image_dataset/tagged-anime-illustrations/"\
                     "danbooru-images/danbooru-images/"
 
@@ -40,3 +46,140 @@ def convert_images_to_bw():
             # Since image processing is CPU and IO intensive
             with concurrent.futures.ProcessPoolExecutor() as executor:
                 results = executor.map(convert_single_image, image_paths)
+
+
+def get_capped_size(size, cover):
+    """
+    Get the largest size an image is ever shown at on a page
+
+    :param size: Width and height of the image
+
+    :type size: tuple
+
+    :param cover: Whether the image is scaled to cover a
+    panel, like backgrounds, or to an area of the page at
+    most, like foregrounds
+
+    :type cover: bool
+
+    :return: The image's size if it's not larger than that,
+    otherwise the size it can be scaled down to
+    :rtype: tuple
+    """
+    w, h = size
+    page_w, page_h = cfg.page_size
+
+    if cover:
+        scale = max(page_w / w, page_h / h)
+    else:
+        scale = np.sqrt(page_w * page_h / (w * h))
+
+    if scale >= 1:
+        return size
+
+    return max(round(w * scale), 1), max(round(h * scale), 1)
+
+
+def fit_to_page(img, cover):
+    """
+    Scale an image down to the largest size it's shown at,
+    cropping the black outside of backgrounds first
+
+    :param img: The image
+
+    :type img: PIL.Image
+
+    :param cover: Whether it's scaled to cover a panel
+
+    :type cover: bool
+
+    :return: The image, or the same one if it already fits
+    :rtype: PIL.Image
+    """
+    if cover:
+        cropped = Image.fromarray(crop_image_only_outside(img))
+        if cropped.size != img.size:
+            img = cropped
+
+    size = get_capped_size(img.size, cover)
+    if size != img.size:
+        img = img.resize(size, Image.LANCZOS)
+
+    return img
+
+
+def downscale_single_image(data):
+    """
+    Write a copy of an image scaled down to the largest size
+    it's shown at, or the image as it is if it's not larger
+
+    :param data: A tuple of the image path, the path of the
+    copy and whether it's scaled to cover a panel
+
+    :type data: tuple
+
+    :return: Whether the image was scaled down
+    :rtype: bool
+    """
+    image_path, output_path, cover = data
+    img = Image.open(image_path)
+    image_format = img.format
+    fitted = fit_to_page(img, cover)
+
+    # Images which already fit are copied without encoding them again
+    if fitted is img:
+        shutil.copyfile(image_path, output_path)
+        return False
+
+    if image_format == "JPEG":
+        fitted.save(output_path, image_format, quality=95)
+    else:
+        fitted.save(output_path, image_format)
+
+    return True
+
+
+def downscale_assets():
+    """
+    Concurrently and in parallel write copies of the downloaded
+    backgrounds and foregrounds scaled down to the largest size
+    the page can show them at, so that they aren't decoded at a
+    resolution which is thrown away when rendering. The copies
+    are always made from the downloaded images, so running it
+    again after changing the page size doesn't lose quality. It
+    should run before creating page metadata since foreground
+    sizes go in it.
+    """
+    # The copies are written to a folder of their own which replaces
+    # the last one when they're done, so that an interrupted run
+    # doesn't leave some of the images out
+    output_dir = os.path.normpath(cfg.downscaled_assets_dir_path)
+    tmp_dir = f"{output_dir}.{uuid.uuid4().hex}.tmp"
+    backgrounds_dir = os.path.join(tmp_dir, "backgrounds")
+    foregrounds_dir = os.path.join(tmp_dir, "foregrounds")
+    os.makedirs(backgrounds_dir)
+    os.makedirs(foregrounds_dir)
+
+    images = [(os.path.join(cfg.backgrounds_source_dir_path, filename),
+               os.path.join(backgrounds_dir, filename), True)
+              for filename in os.listdir(cfg.backgrounds_source_dir_path)]
+    images += [(os.path.join(cfg.foregrounds_source_dir_path, filename),
+                os.path.join(foregrounds_dir, filename), False)
+               for filename in os.listdir(cfg.foregrounds_source_dir_path)]
+
+    print("Scaling down backgrounds and foregrounds")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=cfg.CONCURRENT_MAX_WORKERS) as executor:
+        scaled = sum(tqdm(executor.map(downscale_single_image, images,
+                                       chunksize=64),
+                          total=len(images)))
+
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    os.replace(tmp_dir, output_dir)
+
+    # The config only picks the copies up when it's imported
+    cfg.backgrounds_dir_path = os.path.join(output_dir, "backgrounds/")
+    cfg.foregrounds_dir_path = os.path.join(output_dir, "foregrounds/")
+
+    print(f"Scaled down {scaled} out of {len(images)} images "
+          f"into {output_dir}")
@@ -0,0 +1,101 @@
+import os
+import pandas as pd
+
+import src.config_file as cfg
+from src.asset_index import AssetIndex
+from src.layout_engine.page_objects.character_factory import CharacterFactory
+from src.layout_engine.page_objects.speech_bubble_factory import SpeechBubbleFactory
+from src.layout_engine.text_corpus import TextCorpus, as_text_corpus
+
+
+class GenerationContext(object):
+    """
+    The assets and object factories used to create page metadata.
+    It's built once per worker process and shared by every page
+    that worker creates.
+
+    :param backgrounds_dir: List of background image filenames
+
+    :type backgrounds_dir: list
+
+    :param foregrounds_dir: List of foreground image filenames
+
+    :type foregrounds_dir: list
+
+    :param font_files: list of font files for speech bubble
+    text
+
+    :type font_files: list
+
+    :param text_dataset: A corpus of text to pick to render
+    within speech bubbles
+
+    :type text_dataset: TextCorpus or pandas.DataFrame
+
+    :param speech_bubble_tags: Speech bubble writing area tags
+    by filename
+
+    :type speech_bubble_tags: pandas.DataFrame
+
+    :param asset_index: Sizes of the image assets, defaults to
+    an empty index
+
+    :type asset_index: AssetIndex, optional
+    """
+
+    def __init__(self,
+                 backgrounds_dir,
+                 foregrounds_dir,
+                 font_files,
+                 text_dataset,
+                 speech_bubble_tags,
+                 asset_index=None):
+        """
+        Constructor method
+        """
+        if asset_index is None:
+            asset_index = AssetIndex()
+
+        self.backgrounds_dir = backgrounds_dir
+        self.foregrounds_dir = foregrounds_dir
+        self.font_files = font_files
+        self.text_dataset = as_text_corpus(text_dataset)
+
+        self.speech_bubble_factory = SpeechBubbleFactory(
+            speech_bubble_tags, font_files, self.text_dataset, asset_index)
+        self.character_factory = CharacterFactory(
+            foregrounds_dir, cfg.foregrounds_dir_path, asset_index)
+
+    @classmethod
+    def from_datasets(cls):
+        """
+        Load the assets from the datasets folder
+
+        :return: A context with all the assets loaded
+        :rtype: GenerationContext
+        """
+        backgrounds_dir = os.listdir(cfg.backgrounds_dir_path)
+        foregrounds_dir = os.listdir(cfg.foregrounds_dir_path)
+
+        text_dataset = TextCorpus.from_parquet(cfg.text_dataset_path,
+                                               cfg.text_dataset_arrow_path)
+
+        speech_bubble_tags = pd.read_csv(cfg.speech_bubble_tags_path)
+        font_files_path = "datasets/font_dataset/"
+        viable_font_files = []
+
+        with open(font_files_path+"viable_fonts.csv") as viable_fonts:
+            for line in viable_fonts.readlines():
+                path, viable = line.split(",")
+                viable = viable.replace("\n", "")
+                if viable == "True":
+                    viable_font_files.append(path)
+
+        asset_index = AssetIndex.load(cfg.asset_index_path)
+
+        return cls(backgrounds_dir,
+                   foregrounds_dir,
+                   viable_font_files,
+                   text_dataset,
+                   speech_bubble_tags,
+                   asset_index)
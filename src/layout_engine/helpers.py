@@ -1,3 +1,4 @@
+import functools
 import numpy as np
 import cv2
 from typing import List, Tuple
@@ -5,6 +6,46 @@ from typing import List, Tuple
 import src.config_file as cfg
 
 
+def get_rng(rng=None) -> np.random.Generator:
+    """
+    Get the random number generator to draw from
+
+    :param rng: A generator, defaults to None for
+    a new unseeded one
+
+    :type rng: numpy.random.Generator, optional
+
+    :return: The generator
+    :rtype: numpy.random.Generator
+    """
+    if rng is None:
+        return np.random.default_rng()
+
+    return rng
+
+
+def to_builtin(value):
+    """
+    Convert NumPy values to Python ones so they can be
+    dumped to JSON, meant as json.dump's default
+
+    :param value: A value json can't serialize
+
+    :type value: any
+
+    :return: The value as a Python object
+    :rtype: any
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+
+    raise TypeError(f"Object of type {type(value).__name__} "
+                    "is not JSON serializable")
+
+
 def crop_image_only_outside(img, tol: int = 0) -> np.ndarray:
     """
     Crop the outside of the image where
@@ -62,7 +103,7 @@ def invert_for_next(current):
         return "h"
 
 
-def choose(parent):
+def choose(parent, rng=None):
     """
     Choose one panel from a parent
     panel's children
@@ -72,17 +113,23 @@ def choose(parent):
 
     :type parent: Panel
 
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
+
     :return: Index of chosen child panel
 
     :rtype: int
     """
+    rng = get_rng(rng)
 
-    choice_idx = np.random.randint(0, len(parent.children))
+    choice_idx = rng.integers(0, len(parent.children))
 
     return choice_idx
 
 
-def choose_and_return_other(parent):
+def choose_and_return_other(parent, rng=None):
     """
     Choose a particular panel to return
     randomly and also return panels
@@ -93,14 +140,20 @@ def choose_and_return_other(parent):
 
     :type parent: Panel
 
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
+
     :return: A tuple of a chosen child panel index
     and a list the indices of those that weren't
 
     :rtype: tuple
     """
+    rng = get_rng(rng)
 
     choices = list(range(0, len(parent.children)))
-    choice_idx = np.random.choice(choices)
+    choice_idx = rng.choice(choices)
 
     choices.remove(choice_idx)
 
@@ -415,25 +468,29 @@ def move_children_to_line(parent, line, change, orientation, direction):
                     child.refresh_vars()
 
 
-def blank_image(width=1024, height=1024, background=250):
+def boxes_overlap(box, other) -> bool:
     """
-    It creates a blank image of the given background color
-    """
-    img = np.full((height, width, 1), background, np.uint8)
-    return img
+    Whether two boxes of page objects overlap by more than
+    the allowed overlap offset on both axes
 
+    :param box: x1, y1, x2, y2 of the first box
 
-def add_noise(img, sigma=2):
-    """
-    Adds noise to the existing image
+    :type box: tuple
+
+    :param other: x1, y1, x2, y2 of the second box
+
+    :type other: tuple
+
+    :return: If the boxes overlap
+    :rtype: bool
     """
-    width, height, ch = img.shape
-    n = noise(width, height, sigma=sigma)
-    img = img + n
-    return img.clip(0, 255)
+    x_inter = max(0, min(box[2], other[2]) - max(box[0], other[0]))
+    y_inter = max(0, min(box[3], other[3]) - max(box[1], other[1]))
+
+    return x_inter > cfg.overlap_offset and y_inter > cfg.overlap_offset
 
 
-def noise(width, height, ratio=1, sigma=2):
+def noise(width, height, ratio=1, sigma=2, rng=None):
     """
     The function generates an image, filled with gaussian nose. If ratio parameter is specified,
     noise will be generated for a lesser image and then it will be upscaled to the original size.
@@ -442,7 +499,13 @@ def noise(width, height, ratio=1, sigma=2):
 
     :param ratio: the size of generated noise "pixels"
     :param sigma: defines bounds of noise fluctuations
+
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
     """
+    rng = get_rng(rng)
     mean = 0
     assert width % ratio == 0, "Can't scale image with of size {} and ratio {}".format(width, ratio)
     assert height % ratio == 0, "Can't scale image with of size {} and ratio {}".format(height, ratio)
@@ -450,12 +513,99 @@ def noise(width, height, ratio=1, sigma=2):
     h = int(height / ratio)
     w = int(width / ratio)
 
-    result = np.random.normal(mean, sigma, (w, h, 1))
+    # Single precision is plenty for noise of a few gray levels
+    result = rng.standard_normal((w, h, 1), dtype=np.float32)
+    result *= sigma
+    result += mean
     if ratio > 1:
         result = cv2.resize(result, dsize=(width, height), interpolation=cv2.INTER_LINEAR)
     return result.reshape((width, height, 1))
 
 
+def draw_noise_levels(width, height, sigma=2, rng=None):
+    """
+    Draw the gray levels of a blank image with gaussian
+    noise added, rounded to the nearest level
+
+    :return: The gray levels, of shape (height, width)
+    :rtype: numpy.ndarray
+    """
+    # A blank page is gray level 250, and 0.5 rounds the levels.
+    # noise() takes the lengths of the axes of the array it returns.
+    levels = noise(height, width, sigma=sigma, rng=rng)[:, :, 0]
+    levels += 250.5
+    np.clip(levels, 0, 255, out=levels)
+
+    return levels.astype(np.uint8)
+
+
+@functools.lru_cache(maxsize=None)
+def get_noise_tiles(sigma):
+    """
+    Generate the tiles of the noise tile bank for a noise
+    level. They're the same in every worker.
+
+    :param sigma: Standard deviation of the noise
+
+    :type sigma: int
+
+    :return: The gray levels of noisy blank tiles, of shape
+    (noise_tiles_per_sigma, noise_tile_size, noise_tile_size)
+    :rtype: numpy.ndarray
+    """
+    rng = np.random.default_rng([cfg.noise_tile_seed, int(sigma)])
+    size = cfg.noise_tile_size
+    tiles = draw_noise_levels(size, size*cfg.noise_tiles_per_sigma,
+                              sigma=sigma, rng=rng)
+
+    return tiles.reshape(cfg.noise_tiles_per_sigma, size, size)
+
+
+def noise_levels(width, height, sigma=2, rng=None):
+    """
+    Gray levels of a blank image with gaussian noise added, which
+    the page is multiplied by. With noise_tile_bank on, they're
+    put together from random tiles of the bank at a random offset
+    instead of being drawn pixel by pixel.
+
+    :param width: Width of the image
+
+    :type width: int
+
+    :param height: Height of the image
+
+    :type height: int
+
+    :param sigma: Standard deviation of the noise, defaults to 2
+
+    :type sigma: int, optional
+
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
+
+    :return: The gray levels, of shape (height, width)
+    :rtype: numpy.ndarray
+    """
+    rng = get_rng(rng)
+
+    if not cfg.noise_tile_bank:
+        return draw_noise_levels(width, height, sigma=sigma, rng=rng)
+
+    tiles = get_noise_tiles(sigma)
+    n_tiles, size, _ = tiles.shape
+    dy, dx = rng.integers(0, size, 2)
+    rows = -(-(height + dy) // size)
+    cols = -(-(width + dx) // size)
+
+    # A grid of random tiles, cropped at the offset
+    grid = tiles[rng.integers(0, n_tiles, (rows, cols))]
+    levels = grid.transpose(0, 2, 1, 3).reshape(rows*size, cols*size)
+
+    return levels[dy:dy+height, dx:dx+width]
+
+
 def get_segmentation(img) -> Tuple[List, Tuple, float]:
     np_mask = np.array(img).astype(np.uint8)
     bb = cv2.boundingRect(np_mask)
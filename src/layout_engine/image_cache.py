@@ -0,0 +1,232 @@
+import os
+import uuid
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from PIL import Image
+
+import src.config_file as cfg
+from src.layout_engine.helpers import crop_image_only_outside
+
+
+class ImageCache(object):
+    """
+    Keeps the most recently used images decoded in memory, up
+    to a budget of bytes, so that popular backgrounds and
+    foregrounds are decoded and cropped once per worker.
+    Optionally, cropped images are also kept on disk as arrays
+    so that other workers and later runs skip the cropping too.
+
+    The images are shared by everyone who gets them from the
+    cache, so they must not be changed in place.
+
+    :param max_bytes: Memory budget of the cache
+
+    :type max_bytes: int
+
+    :param cache_dir: Folder of the on-disk cache, defaults
+    to None for no on-disk cache
+
+    :type cache_dir: str, optional
+    """
+
+    def __init__(self, max_bytes, cache_dir=None):
+        """
+        Constructor method
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.images = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, mode="RGB", crop=False, draft_size=None,
+            size=None, transpose=()):
+        """
+        Get an image decoded to a mode, with its black
+        borders cropped, resized and flipped if needed
+
+        :param path: Path of the image
+
+        :type path: str
+
+        :param mode: Pillow mode to convert the image to,
+        defaults to "RGB"
+
+        :type mode: str, optional
+
+        :param crop: Whether to crop the black outside of
+        the image, defaults to False
+
+        :type crop: bool, optional
+
+        :param draft_size: Size the image will be shown at at
+        most. JPEG images are decoded at a reduced resolution
+        which still covers it. Defaults to None for the full
+        resolution.
+
+        :type draft_size: tuple, optional
+
+        :param size: Size to resize the image to, defaults to
+        None to keep its size
+
+        :type size: tuple, optional
+
+        :param transpose: Pillow transpose methods, such as
+        Image.FLIP_LEFT_RIGHT, to apply to the image one after
+        another once it's resized, defaults to none
+
+        :type transpose: tuple, optional
+
+        :return: The image
+        :rtype: PIL.Image
+        """
+        key = (path, mode, crop, draft_size, size, transpose)
+        image = self.images.get(key)
+
+        if image is not None:
+            self.images.move_to_end(key)
+            self.hits += 1
+            return image
+
+        self.misses += 1
+        # Only the resized or flipped image is kept, since it's
+        # the one which is used
+        image = self.load(path, mode, crop, draft_size)
+        if size is not None and image.size != tuple(size):
+            image = image.resize(size)
+        for method in transpose:
+            image = image.transpose(method)
+        image_size = get_image_bytes(image)
+
+        if image_size <= self.max_bytes:
+            self.images[key] = image
+            self.size += image_size
+
+            while self.size > self.max_bytes:
+                _, evicted = self.images.popitem(last=False)
+                self.size -= get_image_bytes(evicted)
+
+        return image
+
+    def load(self, path, mode, crop, draft_size=None):
+        """
+        Decode and crop an image, going through the
+        on-disk cache if there's one
+
+        :return: The image
+        :rtype: PIL.Image
+        """
+        cache_path = None
+        if self.cache_dir is not None and crop:
+            cache_path = self.get_cache_path(path, mode, draft_size)
+            if os.path.isfile(cache_path):
+                return Image.fromarray(np.load(cache_path))
+
+        image = Image.open(path)
+        if draft_size is not None:
+            # Only JPEG decoders can scale down while decoding,
+            # it does nothing for other formats
+            image.draft(mode, draft_size)
+        image = image.convert(mode)
+
+        if crop:
+            # Image.fromarray copies the cropped part, so
+            # the rest of the decoded image can be freed
+            crop_array = crop_image_only_outside(image)
+            image = Image.fromarray(crop_array)
+
+            if cache_path is not None:
+                # Workers may write the same image, so each
+                # writes its own file and moves it in place
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+                with open(tmp_path, "wb") as cache_file:
+                    np.save(cache_file, crop_array)
+                os.replace(tmp_path, cache_path)
+
+        return image
+
+    def get_cache_path(self, path, mode, draft_size=None):
+        """
+        :return: Where the on-disk cache keeps the cropped image.
+        It changes whenever the image file does.
+        :rtype: str
+        """
+        stat = os.stat(path)
+        key = (f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}:"
+               f"{mode}:{draft_size}")
+        return os.path.join(self.cache_dir,
+                            hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npy")
+
+    def clear(self):
+        self.images.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.images)
+
+
+def get_image_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+# The image cache of this worker process, created on first use
+_image_cache = None
+
+
+def get_image_cache():
+    """
+    :return: The image cache of this process
+    :rtype: ImageCache
+    """
+    global _image_cache
+
+    if _image_cache is None:
+        _image_cache = ImageCache(cfg.image_cache_max_bytes,
+                                  cfg.image_cache_dir)
+
+    return _image_cache
+
+
+def load_image(path, mode="RGB", crop=False, draft_size=None,
+               size=None, transpose=()):
+    """
+    Get an image from the image cache of this process. It
+    must not be changed in place.
+
+    :param path: Path of the image
+
+    :type path: str
+
+    :param mode: Pillow mode to convert the image to,
+    defaults to "RGB"
+
+    :type mode: str, optional
+
+    :param crop: Whether to crop the black outside of
+    the image, defaults to False
+
+    :type crop: bool, optional
+
+    :param draft_size: Size the image will be shown at at most,
+    defaults to None for the full resolution
+
+    :type draft_size: tuple, optional
+
+    :param size: Size to resize the image to, defaults to
+    None to keep its size
+
+    :type size: tuple, optional
+
+    :param transpose: Pillow transpose methods to apply to
+    the image one after another, defaults to none
+
+    :type transpose: tuple, optional
+
+    :return: The image
+    :rtype: PIL.Image
+    """
+    return get_image_cache().get(path, mode, crop, draft_size, size,
+                                 transpose)
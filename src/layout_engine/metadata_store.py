@@ -0,0 +1,238 @@
+import os
+import json
+import zlib
+import uuid
+
+import src.config_file as cfg
+from src.layout_engine.helpers import to_builtin
+
+
+SHARD_EXTENSION = ".shard"
+INDEX_EXTENSION = ".idx"
+
+
+class MetadataShardWriter(object):
+    """
+    Appends the metadata of pages to a shard. Every page is stored
+    as a zlib compressed JSON record in the shard file and its name,
+    offset and length are appended to the shard's index file.
+    Both files are flushed after each page so that a shard stays
+    readable if its writer dies.
+
+    :param path: Path of the shard without its extension
+
+    :type path: str
+    """
+
+    def __init__(self, path):
+        """
+        Constructor method
+        """
+        self.path = path
+        self.records = 0
+        self.data_file = open(path + SHARD_EXTENSION, "ab")
+        self.index_file = open(path + INDEX_EXTENSION, "a")
+        self.offset = self.data_file.tell()
+
+    def write(self, name, data):
+        """
+        Append the metadata of a page
+
+        :param name: Name of the page
+
+        :type name: str
+
+        :param data: The page's metadata
+
+        :type data: dict
+
+        :return: The offset and length of the record
+        :rtype: tuple
+        """
+        record = zlib.compress(json.dumps(data, default=to_builtin).encode("utf-8"),
+                               cfg.METADATA_COMPRESSION_LEVEL)
+        self.data_file.write(record)
+        self.data_file.flush()
+
+        # The index entry goes after the record so that it never
+        # points to data which wasn't written
+        self.index_file.write(f"{name}\t{self.offset}\t{len(record)}\n")
+        self.index_file.flush()
+
+        offset = self.offset
+        self.offset += len(record)
+        self.records += 1
+
+        return offset, len(record)
+
+    def close(self):
+        self.data_file.close()
+        self.index_file.close()
+
+
+class MetadataStore(object):
+    """
+    The metadata of the pages of a dataset kept in a folder of
+    shards, so that millions of pages don't mean millions of files.
+    Pages can be read by name or streamed shard by shard.
+
+    :param metadata_dir: Folder with the shards
+
+    :type metadata_dir: str
+    """
+
+    def __init__(self, metadata_dir):
+        """
+        Constructor method
+        """
+        self.metadata_dir = metadata_dir
+        self.writer = None
+        self.shard = None
+        self.pages = None
+
+    def write(self, name, data):
+        """
+        Add the metadata of a page to the shard this process is
+        writing, starting a new one when it's full. Each process
+        writes its own shards.
+
+        :param name: Name of the page
+
+        :type name: str
+
+        :param data: The page's metadata
+
+        :type data: dict
+
+        :return: The name of the shard and the offset and length
+        of the page's record in it
+        :rtype: tuple
+        """
+        if (self.writer is None or
+                self.writer.records >= cfg.METADATA_SHARD_SIZE):
+            if self.writer is not None:
+                self.writer.close()
+
+            self.shard = f"{os.getpid()}-{uuid.uuid4().hex}"
+            self.writer = MetadataShardWriter(self.get_shard_path(self.shard))
+
+        offset, length = self.writer.write(name, data)
+        return self.shard, offset, length
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def get_shard_path(self, shard):
+        """
+        :param shard: Name of a shard
+
+        :type shard: str
+
+        :return: Path of the shard without its extension
+        :rtype: str
+        """
+        return os.path.join(self.metadata_dir, shard)
+
+    def get_shards(self):
+        """
+        :return: Paths of the shards without their extension
+        :rtype: list
+        """
+        if not os.path.isdir(self.metadata_dir):
+            return []
+
+        return [os.path.join(self.metadata_dir, filename[:-len(INDEX_EXTENSION)])
+                for filename in sorted(os.listdir(self.metadata_dir))
+                if filename.endswith(INDEX_EXTENSION)]
+
+    def read_index(self, shard):
+        """
+        Read the index of a shard
+
+        :param shard: Path of the shard without its extension
+
+        :type shard: str
+
+        :return: The name, offset and length of every page in
+        the shard
+        :rtype: list
+        """
+        entries = []
+        with open(shard + INDEX_EXTENSION, "r") as index_file:
+            for line in index_file:
+                # A line without its newline was cut short when
+                # its writer died
+                if not line.endswith("\n"):
+                    break
+
+                name, offset, length = line.rstrip("\n").split("\t")
+                entries.append((name, int(offset), int(length)))
+
+        return entries
+
+    def read_records(self, shard, entries):
+        """
+        Read the metadata of some pages of a shard
+
+        :param shard: Path of the shard without its extension
+
+        :type shard: str
+
+        :param entries: Index entries of the pages
+
+        :type entries: list
+
+        :return: The metadata of each page
+        :rtype: generator
+        """
+        with open(shard + SHARD_EXTENSION, "rb") as data_file:
+            for _, offset, length in entries:
+                data_file.seek(offset)
+                record = data_file.read(length)
+                yield json.loads(zlib.decompress(record))
+
+    def iter_batches(self, batch_size):
+        """
+        Stream the index shard by shard in batches of pages
+
+        :param batch_size: Maximum number of pages in a batch
+
+        :type batch_size: int
+
+        :return: A shard and the index entries of a batch of its pages
+        :rtype: generator
+        """
+        for shard in self.get_shards():
+            entries = self.read_index(shard)
+            for start in range(0, len(entries), batch_size):
+                yield shard, entries[start:start+batch_size]
+
+    def __iter__(self):
+        for shard in self.get_shards():
+            yield from self.read_records(shard, self.read_index(shard))
+
+    def __len__(self):
+        return sum(len(self.read_index(shard)) for shard in self.get_shards())
+
+    def get(self, name):
+        """
+        Read the metadata of a page by its name. The indexes of
+        all the shards are read the first time.
+
+        :param name: Name of the page
+
+        :type name: str
+
+        :return: The page's metadata
+        :rtype: dict
+        """
+        if self.pages is None:
+            self.pages = {}
+            for shard in self.get_shards():
+                for entry in self.read_index(shard):
+                    self.pages[entry[0]] = (shard, entry)
+
+        shard, entry = self.pages[name]
+        return next(self.read_records(shard, [entry]))
@@ -1,4 +1,3 @@
-import os
 import json
 import concurrent
 from datetime import datetime
@@ -6,19 +5,71 @@ from tqdm import tqdm
 
 from src import config_file as cfg
 from src.layout_engine.page_objects.page import Page
+from src.layout_engine.helpers import to_builtin
+from src.layout_engine.metadata_store import MetadataStore
+from src.layout_engine.run_manifest import RunManifest
+from src.layout_engine.task_scheduler import run_in_window
+from src.layout_engine.tracing import (
+    span,
+    flush_traces,
+    init_tracing,
+    get_trace_dir
+)
 
 
 def create_single_page_coco_annotations(data):
         id = data[0]
-        filename = data[1]
-        metadata = os.path.join(cfg.METADATA_DIR, filename)
+        metadata = data[1]
         page = Page()
-        page.load_data(metadata)
-        page_image, page_annotations = page.create_coco_annotations(id)
+        page.load_dict(metadata, leaves_only=True)
+        with span("Page.create_coco_annotations"):
+            page_image, page_annotations = page.create_coco_annotations(id)
         return page_image, page_annotations
 
 
-def create_coco_annotations(coco_annotations_path):
+def create_page_batch_coco_annotations(data):
+    """
+    Create the COCO annotations of a batch of pages of a
+    metadata shard
+
+    :param data: a tuple of the shard and the manifest entries
+    of the pages
+
+    :type data: tuple
+
+    :return: The page index, image and annotations of each page
+    :rtype: list
+    """
+    shard, entries = data
+    store = MetadataStore(cfg.METADATA_DIR)
+    results = []
+
+    records = store.read_records(store.get_shard_path(shard),
+                                 [entry[1:] for entry in entries])
+    for entry, metadata in zip(entries, records):
+        # The image id of a page is its index in the dataset
+        # so that it doesn't change between runs
+        page_index = entry[0]
+        results.append((page_index,) + create_single_page_coco_annotations(
+            (page_index + 1, metadata)))
+
+    flush_traces()
+
+    return results
+
+
+def write_coco_annotations(coco_annotations_path, results):
+    """
+    Write the COCO annotations file of a dataset
+
+    :param coco_annotations_path: Where to write the annotations
+
+    :type coco_annotations_path: str
+
+    :param results: The image and annotations of each page
+
+    :type results: list
+    """
     now = datetime.now()
     now_formatted = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -49,20 +100,8 @@ def create_coco_annotations(coco_annotations_path):
         }
     ]
 
-    filenames = [(id + 1, filename)
-                 for id, filename in enumerate(os.listdir(cfg.METADATA_DIR))
-                 if filename.endswith(".json")]
-
-    with concurrent.futures.ProcessPoolExecutor(max_workers=cfg.CONCURRENT_MAX_WORKERS) as executor:
-        results = list(tqdm(executor.map(create_single_page_coco_annotations, filenames),
-                            total=len(filenames)))
-                            
-    # images, annotations = [], []
-
-    # for id, filename in tqdm(filenames):
-    #     i, a = create_single_page_coco_annotations((id, filename))
-    #     images.append(i)
-    #     annotations.append(a)
+    # Pages are finished in any order
+    results = sorted(results, key=lambda result: result[0]["id"])
 
     images, annotations = zip(*results)
     annotations = [ann for anns in annotations for ann in anns]
@@ -79,4 +118,37 @@ def create_coco_annotations(coco_annotations_path):
     }
 
     with open(coco_annotations_path, "w") as f:
-        json.dump(coco_dict, f)
\ No newline at end of file
+        json.dump(coco_dict, f, default=to_builtin)
+
+
+def create_coco_annotations(coco_annotations_path):
+    """
+    Annotate the pages of the metadata store which the run
+    manifest doesn't have the annotations of, and write the
+    COCO annotations of all the pages from the manifest
+
+    :param coco_annotations_path: Where to write the annotations
+
+    :type coco_annotations_path: str
+    """
+    manifest = RunManifest(cfg.MANIFEST_PATH)
+    manifest.import_json_pages(cfg.METADATA_DIR)
+    n_pages = manifest.count_pending("annotated")
+    batches = manifest.iter_pending("annotated", cfg.METADATA_BATCH_SIZE)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=cfg.CONCURRENT_MAX_WORKERS,
+                                                initializer=init_tracing,
+                                                initargs=(get_trace_dir(),)) as executor:
+        with tqdm(total=n_pages) as pbar:
+            for batch_results in run_in_window(executor,
+                                               create_page_batch_coco_annotations,
+                                               batches,
+                                               cfg.MAX_IN_FLIGHT_TASKS):
+                manifest.set_annotated(batch_results)
+                pbar.update(len(batch_results))
+
+    results = manifest.get_annotations()
+    manifest.close()
+
+    if len(results) > 0:
+        write_coco_annotations(coco_annotations_path, results)
@@ -0,0 +1,341 @@
+import math
+import numpy as np
+from PIL import Image, ImageChops
+
+import src.config_file as cfg
+
+
+COMPOSITORS = ("pil", "numpy")
+
+
+def div255(total, part):
+    """
+    Divide the sum of two uint16 arrays by 255, rounding like
+    Pillow does when blending. Both arrays are overwritten.
+
+    :return: The quotients, in the first array
+    :rtype: numpy.ndarray
+    """
+    total += part
+    total += 128
+    np.right_shift(total, 8, out=part)
+    total += part
+    total >>= 8
+
+    return total
+
+
+class PillowCompositor(object):
+    """
+    Builds a page by pasting its layers with Pillow, which
+    creates a new image for most of the steps
+    """
+
+    def new_page(self, width, height):
+        """
+        Start a transparent RGBA page
+
+        :param width: Width of the page
+
+        :type width: int
+
+        :param height: Height of the page
+
+        :type height: int
+        """
+        self.image = Image.new(size=(width, height), mode="RGBA")
+
+    @property
+    def size(self):
+        return self.image.size
+
+    @property
+    def mode(self):
+        return self.image.mode
+
+    def paste(self, image, location, mask):
+        """
+        Blend a layer into the page where its mask is opaque
+
+        :param image: The layer
+
+        :type image: PIL.Image
+
+        :param location: Where the top left corner of the
+        layer goes on the page
+
+        :type location: tuple
+
+        :param mask: Opacity of the layer, or an image whose
+        alpha channel is
+
+        :type mask: PIL.Image
+        """
+        self.image.paste(image, location, mask)
+
+    def rotate(self, angle):
+        """
+        Rotate the page, growing it to fit
+
+        :param angle: Angle in degrees counter clockwise
+
+        :type angle: float
+        """
+        self.image = self.image.rotate(angle, expand=True)
+
+    def put_on_background(self, background):
+        """
+        Put the page over an RGB background, which makes
+        the page RGB
+
+        :param background: An image of the size of the page,
+        or a color to fill the background with
+
+        :type background: PIL.Image or tuple
+        """
+        if not isinstance(background, Image.Image):
+            background = Image.new("RGB", self.image.size,
+                                   tuple(int(c) for c in background))
+        background.paste(self.image, (0, 0), self.image)
+        self.image = background
+
+    def multiply(self, levels):
+        """
+        Multiply every channel of the page by gray levels
+
+        :param levels: Gray levels of the size of the page
+
+        :type levels: numpy.ndarray
+        """
+        levels = Image.fromarray(levels)
+        levels = Image.merge(self.image.mode,
+                             [levels] * len(self.image.getbands()))
+        self.image = ImageChops.multiply(self.image, levels)
+
+    def blend(self, image, weight):
+        """
+        Blend an image of the size and mode of the
+        page with the whole page
+
+        :param image: The image
+
+        :type image: PIL.Image
+
+        :param weight: How much of the page shows through,
+        from 0 to 255
+
+        :type weight: int
+        """
+        # Pasting with a constant mask blends in place
+        mask = Image.new(mode="L", size=self.image.size, color=255 - weight)
+        self.image.paste(image, (0, 0), mask)
+
+    def get_image(self):
+        return self.image
+
+
+class NumpyCompositor(object):
+    """
+    Builds a page in uint8 buffers which the worker keeps from
+    page to page, alpha-blending each layer only into the part of
+    the page it covers. Pages come out the same as with Pillow,
+    since blending rounds like Image.paste does.
+
+    Like Pillow, it keeps four bytes per pixel for RGB pages too,
+    so that pixels can be copied as 32 bit words. The buffers grow
+    to the largest page, so that once they have, building a page
+    only allocates to get the pixels of its layers and background
+    in and out of Pillow, to blend the soft edges of the layers and
+    to rotate it. It's slower than pasting with Pillow, which
+    blends in a single pass, but its memory use stays the same
+    from page to page.
+    """
+
+    def __init__(self):
+        """
+        Constructor method
+        """
+        self.buffers = {}
+        self.page = None
+        self.channels = 4
+
+    def get_buffer(self, name, shape, dtype=np.uint8):
+        """
+        Get a buffer of a shape, reusing the memory of the
+        last buffer of that name
+
+        :return: The buffer, whose contents are undefined
+        :rtype: numpy.ndarray
+        """
+        length = math.prod(shape)
+        buffer = self.buffers.get(name)
+
+        if buffer is None or buffer.size < length or buffer.dtype != dtype:
+            buffer = np.empty(length, dtype)
+            self.buffers[name] = buffer
+
+        return buffer[:length].reshape(shape)
+
+    def new_page(self, width, height):
+        self.page = self.get_buffer("layers", (height, width, 4))
+        self.page.fill(0)
+        self.channels = 4
+
+    @property
+    def size(self):
+        return self.page.shape[1], self.page.shape[0]
+
+    @property
+    def mode(self):
+        return "RGBA" if self.channels == 4 else "RGB"
+
+    def blend_into(self, out, image, mask):
+        """
+        Blend an image into an array in place like Image.paste,
+        computing (out*(255 - mask) + image*mask)/255 rounded
+
+        :param out: Part of the page to blend into
+
+        :type out: numpy.ndarray
+
+        :param image: Pixels of the same shape
+
+        :type image: numpy.ndarray
+
+        :param mask: Opacity of the pixels, or a single opacity
+
+        :type mask: numpy.ndarray or int
+        """
+        if not isinstance(mask, np.ndarray):
+            total = self.get_buffer("total", out.shape, np.uint16)
+            part = self.get_buffer("part", out.shape, np.uint16)
+            np.multiply(image, mask, out=total, dtype=np.uint16)
+            np.multiply(out, 255 - mask, out=part, dtype=np.uint16)
+            np.copyto(out, div255(total, part), casting="unsafe")
+            return
+
+        # Layers are mostly either opaque or clear, so opaque
+        # pixels are copied whole and only the few pixels at the
+        # soft edges of the layer are picked out and blended
+        height, width = mask.shape
+        opaque = self.get_buffer("opaque", (height, width), bool)
+        np.equal(mask, 255, out=opaque)
+        np.copyto(out.view(np.uint32)[:, :, 0],
+                  image.view(np.uint32)[:, :, 0], where=opaque)
+
+        soft = self.get_buffer("soft", (height, width), bool)
+        levels = self.get_buffer("levels", (height, width))
+        np.subtract(mask, 1, out=levels)
+        np.less(levels, 254, out=soft)
+        rows, cols = np.nonzero(soft)
+        if len(rows) == 0:
+            return
+
+        # out*(255 - mask) is out*255 - out*mask, which may wrap
+        # around in between but not in the end
+        soft_mask = mask[rows, cols][:, None]
+        out_pixels = out[rows, cols]
+        total = np.multiply(image[rows, cols], soft_mask, dtype=np.uint16)
+        part = np.multiply(out_pixels, soft_mask, dtype=np.uint16)
+        total -= part
+        np.multiply(out_pixels, 255, out=part, dtype=np.uint16)
+        out[rows, cols] = div255(total, part)
+
+    def paste(self, image, location, mask):
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+        if mask.mode in ("RGBA", "LA"):
+            mask = mask.getchannel("A")
+        elif mask.mode != "L":
+            mask = mask.convert("L")
+
+        # Only the part of the layer on the page is blended
+        width, height = self.size
+        x, y = int(location[0]), int(location[1])
+        x1, y1 = max(x, 0), max(y, 0)
+        x2 = min(x + image.width, width)
+        y2 = min(y + image.height, height)
+        if x1 >= x2 or y1 >= y2:
+            return
+
+        image_crop = (x1 - x, y1 - y, x2 - x, y2 - y)
+        self.blend_into(self.page[y1:y2, x1:x2],
+                        np.asarray(image.crop(image_crop)),
+                        np.asarray(mask.crop(image_crop)))
+
+    def rotate(self, angle):
+        # Rotating makes a new image, so the page isn't copied first
+        image = Image.fromarray(self.page).rotate(angle, expand=True)
+        self.page = self.get_buffer("layers",
+                                    (image.height, image.width, 4))
+        self.page[:] = np.asarray(image)
+
+    def put_on_background(self, background):
+        width, height = self.size
+        layers = self.page
+        self.page = self.get_buffer("page", (height, width, 4))
+        self.channels = 3
+
+        # Whole pixels are copied, and the fourth byte of
+        # each is left over
+        if isinstance(background, Image.Image):
+            self.page[:] = np.asarray(background.convert("RGBA"))
+        else:
+            color = np.array([*background, 255], np.uint8)
+            self.page.view(np.uint32).fill(color.view(np.uint32)[0])
+
+        self.blend_into(self.page, layers, layers[:, :, 3])
+
+    def multiply(self, levels):
+        total = self.get_buffer("total", self.page.shape, np.uint16)
+        part = self.get_buffer("part", self.page.shape, np.uint16)
+        np.multiply(self.page, levels[:, :, None], out=total,
+                    dtype=np.uint16)
+
+        # Division by 255 rounding down, like ImageChops.multiply
+        np.right_shift(total, 8, out=part)
+        total += part
+        total += 1
+        total >>= 8
+
+        np.copyto(self.page, total, casting="unsafe")
+
+    def blend(self, image, weight):
+        # Blending whole pixels is faster than skipping the fourth bytes
+        self.blend_into(self.page, np.asarray(image.convert("RGBA")),
+                        255 - weight)
+
+    def get_image(self):
+        """
+        :return: A copy of the page, so that the buffers
+        can be reused for the next one
+        :rtype: PIL.Image
+        """
+        # Image.fromarray shares the memory of the buffer, and
+        # converting the fourth bytes away copies RGB pages
+        if self.channels == 4:
+            return Image.fromarray(self.page).copy()
+
+        return Image.fromarray(self.page, "RGBX").convert("RGB")
+
+
+# The buffers of this worker process, created on first use
+_numpy_compositor = None
+
+
+def get_page_compositor():
+    """
+    :return: The compositor of the backend set in page_compositor
+    :rtype: PillowCompositor or NumpyCompositor
+    """
+    global _numpy_compositor
+
+    assert cfg.page_compositor in COMPOSITORS
+
+    if cfg.page_compositor == "pil":
+        return PillowCompositor()
+
+    if _numpy_compositor is None:
+        _numpy_compositor = NumpyCompositor()
+
+    return _numpy_compositor
@@ -0,0 +1,203 @@
+import os
+import time
+import concurrent
+import numpy as np
+from tqdm import tqdm
+
+import src.config_file as cfg
+from src.layout_engine import page_metadata_creator
+from src.layout_engine.text_corpus import TextCorpus
+from src.layout_engine.run_manifest import RunManifest
+from src.layout_engine.task_scheduler import batch_range, run_in_window
+from src.layout_engine.tracing import span, flush_traces, get_trace_dir
+from src.layout_engine.page_metadata_creator import (
+    create_page_metadata,
+    init_worker_context,
+    get_page_seed
+)
+from src.layout_engine.page_annotations_creator import write_coco_annotations
+
+
+def generate_page(data):
+    """
+    Create the metadata of a page, render it and create its COCO
+    annotations in one go, without reading the metadata back.
+    The workers are set up by init_worker_context.
+
+    :param data: A tuple of the page's index, its seed, whether
+    it's a dry run and whether to write the metadata to the store
+
+    :type data: tuple
+
+    :return: A status record of the page with its name, where its
+    metadata was written, whether it was rendered, its COCO image
+    and annotations, how long creating it took and how long
+    rendering and annotating it took. The name is None if the
+    page couldn't be generated.
+    :rtype: dict
+    """
+    page_index, seed, dry, keep_metadata = data
+    status = dict(
+        index=page_index,
+        name=None,
+        metadata=None,
+        rendered=False,
+        image=None,
+        annotations=None,
+        create_time=0.0,
+        render_time=0.0,
+    )
+
+    rng = np.random.default_rng(seed)
+
+    try:
+        start_time = time.perf_counter()
+        page = create_page_metadata(page_metadata_creator._worker_context,
+                                    rng)
+        page.seed = seed
+
+        entry = None
+        if keep_metadata and not dry:
+            entry = page_metadata_creator._worker_store.write(
+                page.name, page.get_data())
+
+        create_time = time.perf_counter()
+
+        # The page is rendered from the objects it was created with,
+        # and the annotations come from the same renders of its
+        # characters and bubbles
+        if dry:
+            with span("Page.create_coco_annotations"):
+                image, annotations = page.create_coco_annotations(
+                    page_index + 1)
+        else:
+            image_filename = os.path.join(cfg.IMAGES_DIR,
+                                          page.name + cfg.output_format)
+            with span("Page.render"):
+                img, image, annotations = page.render(
+                    image_id=page_index + 1)
+            with span("Page.save"):
+                img.save(image_filename)
+        end_time = time.perf_counter()
+    except KeyboardInterrupt:
+        raise KeyboardInterrupt()
+    except Exception:
+        print(f"ERROR: Could not generate page {page_index}. Continuing...")
+        return status
+
+    status["name"] = page.name
+    status["metadata"] = entry
+    status["rendered"] = not dry
+    status["image"] = image
+    status["annotations"] = annotations
+    status["create_time"] = create_time - start_time
+    status["render_time"] = end_time - create_time
+
+    return status
+
+
+def generate_page_batch(data):
+    """
+    Generate a batch of pages
+
+    :param data: A tuple of the indices of the pages, how many
+    times creating each failed before, the seed of the run,
+    whether it's a dry run and whether to write the metadata
+    to the store
+
+    :type data: tuple
+
+    :return: The status records of the pages
+    :rtype: list
+    """
+    page_indices, attempts, base_seed, dry, keep_metadata = data
+    statuses = [generate_page((i, get_page_seed(base_seed, i, attempt), dry,
+                               keep_metadata))
+                for i, attempt in zip(page_indices, attempts)]
+    flush_traces()
+
+    return statuses
+
+
+def generate_pages(n_pages: int, coco_annotations_path: str,
+                   dry: bool = False, keep_metadata: bool = False):
+    """
+    Create, render and annotate pages with each worker taking
+    pages all the way through instead of running the metadata
+    creation, rendering and annotation stages one after another.
+    Only the pages the run manifest doesn't have are generated.
+
+    :param n_pages: Number of pages the dataset should have
+
+    :type n_pages: int
+
+    :param coco_annotations_path: Where to write the COCO annotations
+
+    :type coco_annotations_path: str
+
+    :param dry: Whether to skip saving the rendered pages,
+    defaults to False
+
+    :type dry: bool, optional
+
+    :param keep_metadata: Whether to also write the metadata of
+    the pages to the metadata store, defaults to False
+
+    :type keep_metadata: bool, optional
+    """
+    print("Loading files")
+    # Make sure the memory-mapped text corpus exists before the
+    # workers open it
+    TextCorpus.from_parquet(cfg.text_dataset_path,
+                            cfg.text_dataset_arrow_path)
+
+    manifest = RunManifest(cfg.MANIFEST_PATH)
+    base_seed = manifest.get_base_seed()
+    page_indices = manifest.get_missing_pages(n_pages)
+    attempts = manifest.get_attempts(page_indices)
+    n_pages = len(page_indices)
+
+    print("Generating pages")
+
+    batches = ((page_indices[start:stop], attempts[start:stop], base_seed,
+                dry, keep_metadata)
+               for start, stop
+               in batch_range(n_pages, cfg.METADATA_BATCH_SIZE))
+    results = []
+    failed = 0
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=cfg.CONCURRENT_MAX_WORKERS,
+                                                initializer=init_worker_context,
+                                                initargs=(get_trace_dir(),)) as executor:
+        with tqdm(total=n_pages) as pbar:
+            for statuses in run_in_window(executor,
+                                          generate_page_batch,
+                                          batches,
+                                          cfg.MAX_IN_FLIGHT_TASKS):
+                generated = []
+                failed_pages = []
+                for status in statuses:
+                    if status["name"] is None:
+                        failed_pages.append(status["index"])
+                        continue
+
+                    generated.append(status)
+                    results.append((status["image"], status["annotations"]))
+
+                if not dry:
+                    manifest.add_pages(generated)
+                    manifest.add_failed_pages(failed_pages)
+                failed += len(failed_pages)
+                pbar.update(len(statuses))
+
+    if failed > 0:
+        print(f"Could not generate {failed} out of {n_pages} pages, "
+              f"run it again to try them with other seeds")
+
+    # The annotations file covers the pages of earlier runs too
+    if not dry:
+        results = manifest.get_annotations()
+    manifest.close()
+
+    if len(results) > 0:
+        write_coco_annotations(coco_annotations_path, results)
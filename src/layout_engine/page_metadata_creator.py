@@ -2,19 +2,29 @@ import os
 import time
 import concurrent
 import numpy as np
-import pandas as pd
 from tqdm import tqdm
 from PIL import Image
 
 import src.config_file as cfg
-from src.layout_engine.page_objects.character_factory import CharacterFactory
-from src.layout_engine.page_objects.speech_bubble_factory import SpeechBubbleFactory
 from src.layout_engine.page_objects import Panel, Page, Character
+from src.layout_engine.generation_context import GenerationContext
+from src.layout_engine.text_corpus import TextCorpus, TextSampler
+from src.layout_engine.metadata_store import MetadataStore
+from src.layout_engine.run_manifest import RunManifest
+from src.layout_engine.task_scheduler import batch_range, run_in_window
+from src.layout_engine.placement import PlacementEngine
+from src.layout_engine.helpers import get_rng
+from src.layout_engine.tracing import (
+    span,
+    flush_traces,
+    init_tracing,
+    get_trace_dir
+)
 from src.layout_engine.page_metadata_transforms import *
 from src.layout_engine.page_metadata_draw import *
 
 
-def add_background(page, image_dir, image_dir_path):
+def add_background(page, image_dir, image_dir_path, rng=None):
     """
     Add a background color or image to the page
 
@@ -31,16 +41,22 @@ def add_background(page, image_dir, image_dir_path):
 
     :type image_dir_path: str
 
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
+
     :return: Page with background
 
     :rtype: Page
     """
+    rng = get_rng(rng)
 
-    if np.random.random() < cfg.solid_background_probability:
+    if rng.random() < cfg.solid_background_probability:
         page.background = "#color"
     else:
         image_dir_len = len(image_dir)
-        idx = np.random.randint(0, image_dir_len)
+        idx = rng.integers(0, image_dir_len)
         page.background = image_dir_path + image_dir[idx]
 
     return page
@@ -48,13 +64,11 @@ def add_background(page, image_dir, image_dir_path):
 
 # Page creators
 def create_single_panel_metadata(panel: Panel,
-                                 backgrounds_dir: list,
-                                 foregrounds_dir: list,
-                                 font_files: list,
-                                 text_dataset: pd.DataFrame,
-                                 speech_bubble_tags: pd.DataFrame,
+                                 context: GenerationContext,
                                  minimum_speech_bubbles: int = 0,
-                                 no_characters: bool = False
+                                 no_characters: bool = False,
+                                 rng: np.random.Generator = None,
+                                 text_sampler: TextSampler = None
                                  ):
     """
     This is a helper function that populates a single panel with
@@ -64,50 +78,42 @@ def create_single_panel_metadata(panel: Panel,
 
     :type panel: Panel
 
-    :param image_dir: List of images to pick from
-
-    :type image_dir: list
-
-    :param image_dir_path: Path of images dir to add to
-    panels
+    :param context: The assets and factories used to populate
+    the panel
 
-    :type image_dir_path: str
+    :type context: GenerationContext
 
-    :param font_files: list of font files for speech bubble
-    text
-
-    :type font_files: list
-
-    :param text_dataset: A dask dataframe of text to
-    pick to render within speech bubble
+    :param minimum_speech_bubbles: Set whether panels
+    have a minimum number of speech bubbles, defaults to 0
 
-    :type text_dataset: pandas.dataframe
+    :type  minimum_speech_bubbles: int
 
-    :param speech_bubble_files: list of base speech bubble
-    template files
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
 
-    :type speech_bubble_files: list
+    :type rng: numpy.random.Generator, optional
 
-    :param speech_bubble_tags: a list of speech bubble
-    writing area tags by filename
+    :param text_sampler: Sampler of the texts of the page's
+    speech bubbles, defaults to None to look the texts of each
+    bubble up on their own
 
-    :type speech_bubble_tags: list
+    :type text_sampler: TextSampler, optional
 
-    :param minimum_speech_bubbles: Set whether panels
-    have a minimum number of speech bubbles, defaults to 0
+    :return: Number of objects requested, placed and of
+    positions tried to place them
 
-    :type  minimum_speech_bubbles: int
+    :rtype: dict
     """
-    speech_bubble_factory = SpeechBubbleFactory(
-        speech_bubble_tags, font_files, text_dataset)
-    character_factory = CharacterFactory(
-        foregrounds_dir, cfg.foregrounds_dir_path)
+    rng = get_rng(rng)
+    speech_bubble_factory = context.speech_bubble_factory
+    character_factory = context.character_factory
+    backgrounds_dir = context.backgrounds_dir
 
     # Image to be used inside panel
     image_dir_len = len(backgrounds_dir)
-    background_idx = np.random.randint(0, image_dir_len)
+    background_idx = rng.integers(0, image_dir_len)
 
-    if np.random.random() < cfg.panel_background_add_chance:
+    if rng.random() < cfg.panel_background_add_chance:
         background_image = backgrounds_dir[background_idx]
         panel.image = os.path.join(cfg.backgrounds_dir_path, background_image)
 
@@ -115,68 +121,60 @@ def create_single_panel_metadata(panel: Panel,
     if no_characters:
         num_characters = 0
     else:
-        num_characters = np.random.randint(0,
-                                        cfg.max_characters_per_panel + 1)
+        num_characters = rng.integers(0,
+                                      cfg.max_characters_per_panel + 1)
 
     if panel.image is None:
         num_characters = min(1, num_characters)
 
+    # Characters and bubbles are placed through a spatial index
+    # and retried at other positions and sizes if they collide
+    placement = PlacementEngine()
+
     for _ in range(num_characters):
-        character = character_factory.create(panel)
-        character.place_randomly(panel)
+        character = character_factory.create(panel, rng)
 
-        if np.random.random() < cfg.character_bubble_speech_freq:
+        if rng.random() < cfg.character_bubble_speech_freq:
             speech_bubble = speech_bubble_factory.create_with_orientation(
-                character)
+                character, rng, text_sampler)
             speech_bubble.place_randomly(
-                character, cfg.bubble_to_character_area_min_ratio, cfg.bubble_to_character_area_max_ratio)
+                character, cfg.bubble_to_character_area_min_ratio, cfg.bubble_to_character_area_max_ratio,
+                rng)
             character.add_speech_bubble(speech_bubble)
 
-        overlaps = False
-        
-        for other_character in panel.characters:
-            overlaps = overlaps or character.overlaps(other_character)
-
-        hr, wr = character.get_resized()
-
-        if not overlaps and hr >= cfg.min_character_size and wr >= cfg.min_character_size:
+        if placement.place(character,
+                           lambda: character.place_randomly(panel, rng),
+                           cfg.min_character_size):
             panel.characters.append(character)
 
     # Speech bubbles
-    num_speech_bubbles = np.random.randint(minimum_speech_bubbles,
-                                           cfg.max_speech_bubbles_per_panel + 1)
+    num_speech_bubbles = rng.integers(minimum_speech_bubbles,
+                                      cfg.max_speech_bubbles_per_panel + 1)
     if panel.image is None:
         num_speech_bubbles = min(1, num_speech_bubbles)
 
     # Associated speech bubbles
-    for speech_bubble in range(num_speech_bubbles):
-        speech_bubble = speech_bubble_factory.create_with_no_orientation(panel)
-
-        overlaps = False
-        speech_bubble.place_randomly(panel, cfg.bubble_to_panel_area_min_ratio, cfg.bubble_to_panel_area_max_ratio)
-
-        for other_speech_bubble in panel.speech_bubbles:
-            overlaps = overlaps or speech_bubble.overlaps(other_speech_bubble)
-
-        for other_character in panel.characters:
-            overlaps = overlaps or speech_bubble.overlaps(other_character)
-
-        # If width or height are greater than panel's, don't add it
-        hr, wr = speech_bubble.get_resized()
-
-        # and hr < panel.height and wr < panel.width:
-        if not overlaps and hr >= cfg.min_bubble_size and wr >= cfg.min_bubble_size:
+    for _ in range(num_speech_bubbles):
+        speech_bubble = speech_bubble_factory.create_with_no_orientation(
+            panel, rng, text_sampler)
+
+        if placement.place(speech_bubble,
+                           lambda: speech_bubble.place_randomly(
+                               panel,
+                               cfg.bubble_to_panel_area_min_ratio,
+                               cfg.bubble_to_panel_area_max_ratio,
+                               rng),
+                           cfg.min_bubble_size):
             panel.speech_bubbles.append(speech_bubble)
 
+    return placement.get_stats()
+
 
 def populate_panels(page: Page,
-                    backgrounds_dir: list,
-                    foregrounds_dir: list,
-                    font_files: list,
-                    text_dataset: pd.DataFrame,
-                    speech_bubble_tags: pd.DataFrame,
+                    context: GenerationContext,
                     minimum_speech_bubbles: int = 0,
-                    no_characters: bool = False
+                    no_characters: bool = False,
+                    rng: np.random.Generator = None
                     ):
     """
     This function takes all the panels and adds backgorund images
@@ -186,100 +184,77 @@ def populate_panels(page: Page,
 
     :type page: Page
 
-    :param image_dir: List of images to pick from
-
-    :type image_dir: list
-
-    :param font_files: list of font files for speech bubble
-    text
-
-    :type font_files: list
-
-    :param text_dataset: A dask dataframe of text to
-    pick to render within speech bubble
+    :param context: The assets and factories used to populate
+    the panels
 
-    :type text_dataset: pandas.dataframe
-
-    :param speech_bubble_files: list of base speech bubble
-    template files
-
-    :type speech_bubble_files: list
-
-    :param speech_bubble_tags: a list of speech bubble
-    writing area tags by filename
-
-    :type speech_bubble_tags: list
+    :type context: GenerationContext
 
     :param minimum_speech_bubbles: Set whether panels
     have a minimum number of speech bubbles, defaults to 0
 
     :type  minimum_speech_bubbles: int
 
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
+
     :return: Page with populated panels
 
     :rtype: Page
     """
+    rng = get_rng(rng)
+
     for child in page.leaf_children:
         child.refresh_size()
         child.refresh_drawable_area()
 
+    # The texts of all the speech bubbles of the page are
+    # drawn and looked up in batches
+    text_sampler = context.speech_bubble_factory.create_text_sampler(rng)
+
     for child in page.leaf_children:
-        create_single_panel_metadata(child,
-                                     backgrounds_dir,
-                                     foregrounds_dir,
-                                     font_files,
-                                     text_dataset,
-                                     speech_bubble_tags,
-                                     minimum_speech_bubbles,
-                                     no_characters
-                                     )
+        stats = create_single_panel_metadata(child,
+                                             context,
+                                             minimum_speech_bubbles,
+                                             no_characters,
+                                             rng,
+                                             text_sampler
+                                             )
+        for key, value in stats.items():
+            page.placement_stats[key] += value
 
     return page
 
 
-def create_page_metadata(backgrounds_dir,
-                         foregrounds_dir,
-                         font_files,
-                         text_dataset,
-                         speech_bubble_tags):
+def create_page_metadata(context: GenerationContext,
+                         rng: np.random.Generator = None):
     """
     This function creates page metadata for a single page. It includes
     transforms, background addition, random panel removal,
     panel shrinking, and the populating of panels with
     images and speech bubbles.
 
-    :param image_dir: List of images to pick from
-
-    :type image_dir: list
-
-    :param font_files: list of font files for speech bubble
-    text
+    :param context: The assets and factories used to populate
+    the page
 
-    :type font_files: list
+    :type context: GenerationContext
 
-    :param text_dataset: A dask dataframe of text to
-    pick to render within speech bubble
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
 
-    :type text_dataset: pandas.dataframe
-
-    :param speech_bubble_files: list of base speech bubble
-    template files
-
-    :type speech_bubble_files: list
-
-    :param speech_bubble_tags: a list of speech bubble
-    writing area tags by filename
-
-    :type speech_bubble_tags: list
+    :type rng: numpy.random.Generator, optional
 
     :return: Created Page with all the bells and whistles
 
     :rtype: Page
     """
+    rng = get_rng(rng)
+
     # Select number of panels on the page
     # between 1 and 8
 
-    number_of_panels = np.random.choice(
+    number_of_panels = rng.choice(
         list(cfg.num_pages_ratios.keys()),
         p=list(cfg.num_pages_ratios.values())
     )
@@ -288,110 +263,241 @@ def create_page_metadata(backgrounds_dir,
     if number_of_panels > 8:
         page_type = "vh"
     else:
-        page_type = np.random.choice(
+        page_type = rng.choice(
             list(cfg.vertical_horizontal_ratios.keys()),
             p=list(cfg.vertical_horizontal_ratios.values())
         )
 
-    page = get_base_panels(number_of_panels, page_type)
+    with span("get_base_panels"):
+        page = get_base_panels(number_of_panels, page_type, rng=rng)
 
-    if np.random.random() < cfg.panel_transform_chance:
-        page = add_transforms(page)
+    if rng.random() < cfg.panel_transform_chance:
+        with span("add_transforms"):
+            page = add_transforms(page, rng=rng)
 
-    page = shrink_panels(page)
-    page = populate_panels(page,
-                           backgrounds_dir,
-                           foregrounds_dir,
-                           font_files,
-                           text_dataset,
-                           speech_bubble_tags
-                           )
+    with span("shrink_panels"):
+        page = shrink_panels(page, rng=rng)
+    with span("populate_panels"):
+        page = populate_panels(page, context, rng=rng)
 
-    if np.random.random() < cfg.panel_removal_chance:
-        page = remove_panel(page)
+    if rng.random() < cfg.panel_removal_chance:
+        with span("remove_panel"):
+            page = remove_panel(page, rng=rng)
 
-    page = add_background(page, backgrounds_dir, cfg.backgrounds_dir_path)
+    with span("add_background"):
+        page = add_background(page, context.backgrounds_dir,
+                              cfg.backgrounds_dir_path, rng)
 
     return page
 
 
+# The generation context of this worker process and the store it
+# writes pages to. They're set up once by init_worker_context when
+# the worker starts.
+_worker_context = None
+_worker_store = None
+
+
+def init_worker_context(trace_dir=None):
+    """
+    Process pool initializer which loads the assets, builds
+    the object factories that every task of this worker reuses
+    and opens the metadata store
+
+    :param trace_dir: Folder of the trace files of the run,
+    defaults to None if it isn't traced
+
+    :type trace_dir: str, optional
+    """
+    global _worker_context, _worker_store
+    init_tracing(trace_dir)
+    _worker_context = GenerationContext.from_datasets()
+    _worker_store = MetadataStore(cfg.METADATA_DIR)
+
+
+def get_page_seed(base_seed: int, page_index: int, attempt: int = 0) -> int:
+    """
+    Get the seed of a page of a metadata creation run
+
+    :param base_seed: Seed of the whole run
+
+    :type base_seed: int
+
+    :param page_index: Index of the page within the run
+
+    :type page_index: int
+
+    :param attempt: How many times creating the page failed
+    before, defaults to 0
+
+    :type attempt: int, optional
+
+    :return: The page's seed
+    :rtype: int
+    """
+    if attempt == 0:
+        return (base_seed + page_index) % 2**32
+
+    # Pages which failed are tried again with another seed,
+    # as the same one would fail the same way
+    seed = np.random.SeedSequence((base_seed, page_index, attempt))
+    return int(seed.generate_state(1)[0])
+
+
 def try_create_page_metadata(data):
-    page = None
-    backgrounds_dir = data[0]
-    foregrounds_dir = data[1]
-    viable_font_files = data[2]
-    text_dataset = data[3]
-    speech_bubble_tags = data[4]
+    """
+    Create the metadata of a page and write it to the
+    worker's shard of the metadata store
+
+    :param data: A tuple of the page's index, its seed and
+    whether it's a dry run
 
-    seed = (os.getpid() * int(time.time())) % 4242424242
-    random.seed(seed)
-    np.random.seed(seed)
+    :type data: tuple
+
+    :return: A status record of the page with its name, where it
+    was written in the store, number of panels, how many objects
+    were placed on it and how long creating and writing it took.
+    The name is None if the page couldn't be created.
+
+    :rtype: dict
+    """
+    page_index, seed, dry = data
+    status = dict(
+        index=page_index,
+        name=None,
+        metadata=None,
+        num_panels=0,
+        placement=None,
+        create_time=0.0,
+        dump_time=0.0,
+    )
+
+    # Each page draws from its own generator, so it can be
+    # recreated and rendered the same way from its seed
+    rng = np.random.default_rng(seed)
 
     try:
-        page = create_page_metadata(backgrounds_dir,
-                                    foregrounds_dir,
-                                    viable_font_files,
-                                    text_dataset,
-                                    speech_bubble_tags
-                                    )
+        start_time = time.perf_counter()
+        page = create_page_metadata(_worker_context, rng)
+        page.seed = seed
+        dump_time = time.perf_counter()
+        with span("Page.dump_data"):
+            entry = page.dump_data(cfg.METADATA_DIR, dry=dry,
+                                   store=_worker_store)
+        end_time = time.perf_counter()
     except KeyboardInterrupt:
         raise KeyboardInterrupt()
     except Exception:
-        print(f"ERROR: Could not create page. Continuing...")
+        print(f"ERROR: Could not create page {page_index}. Continuing...")
+        return status
 
-    return page
+    status["name"] = page.name
+    if not dry:
+        status["metadata"] = entry
+    status["num_panels"] = int(page.num_panels)
+    status["placement"] = page.placement_stats
+    status["create_time"] = dump_time - start_time
+    status["dump_time"] = end_time - dump_time
 
+    return status
 
-def create_metadata(n_pages: int, dry: bool):
-    print("Loading files")
-    backgrounds_dir = os.listdir(cfg.backgrounds_dir_path)
-    foregrounds_dir = os.listdir(cfg.foregrounds_dir_path)
 
-    text_dataset = pd.read_parquet("datasets/text_dataset/jesc_dialogues")
+def try_create_page_metadata_batch(data):
+    """
+    Create the metadata of a batch of pages
 
-    speech_bubbles_path = "datasets/speech_bubbles_dataset/"
+    :param data: A tuple of the indices of the pages, how many
+    times creating each failed before, the seed of the run and
+    whether it's a dry run
 
-    speech_bubble_tags = pd.read_csv(speech_bubbles_path +
-                                     "writing_area_labels.csv")
-    font_files_path = "datasets/font_dataset/"
-    viable_font_files = []
+    :type data: tuple
 
-    with open(font_files_path+"viable_fonts.csv") as viable_fonts:
-        for line in viable_fonts.readlines():
-            path, viable = line.split(",")
-            viable = viable.replace("\n", "")
-            if viable == "True":
-                viable_font_files.append(path)
+    :return: The status records of the pages
+    :rtype: list
+    """
+    page_indices, attempts, base_seed, dry = data
+    statuses = [try_create_page_metadata((i, get_page_seed(base_seed, i,
+                                                           attempt), dry))
+                for i, attempt in zip(page_indices, attempts)]
+    flush_traces()
 
-    print("Running creation of metadata")
+    return statuses
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=cfg.CONCURRENT_MAX_WORKERS) as executor:
-        jobs = {}
 
-        pages_iter = range(n_pages)
-        pages_left = n_pages
+def create_metadata(n_pages: int, dry: bool):
+    """
+    Create the metadata of the pages of the dataset which
+    the run manifest doesn't have yet, so that an interrupted
+    run picks up where it stopped and a later one with more
+    pages only adds the new ones
+
+    :param n_pages: Number of pages the dataset should have
+
+    :type n_pages: int
+
+    :param dry: Whether to skip writing the metadata
+
+    :type dry: bool
+    """
+    print("Loading files")
+    # Make sure the memory-mapped text corpus exists before the
+    # workers open it
+    TextCorpus.from_parquet(cfg.text_dataset_path,
+                            cfg.text_dataset_arrow_path)
+
+    # Every page gets its own seed so that workers never share one.
+    # The seeds come from the manifest so that resumed runs create
+    # the same pages.
+    manifest = RunManifest(cfg.MANIFEST_PATH)
+    if not dry:
+        manifest.import_json_pages(cfg.METADATA_DIR)
+    base_seed = manifest.get_base_seed()
+    page_indices = manifest.get_missing_pages(n_pages)
+    attempts = manifest.get_attempts(page_indices)
+    n_pages = len(page_indices)
+
+    print("Running creation of metadata")
 
+    batches = ((page_indices[start:stop], attempts[start:stop], base_seed,
+                dry) for start, stop
+               in batch_range(n_pages, cfg.METADATA_BATCH_SIZE))
+    failed = 0
+    placement = dict(requested=0, placed=0, attempts=0)
+
+    # Workers write the metadata themselves and only send back
+    # a status record of each page
+    with concurrent.futures.ProcessPoolExecutor(max_workers=cfg.CONCURRENT_MAX_WORKERS,
+                                                initializer=init_worker_context,
+                                                initargs=(get_trace_dir(),)) as executor:
         with tqdm(total=n_pages) as pbar:
-            while pages_left:
-                for i in pages_iter:
-                    job = executor.submit(try_create_page_metadata, (backgrounds_dir,
-                                                                     foregrounds_dir,
-                                                                     viable_font_files,
-                                                                     text_dataset,
-                                                                     speech_bubble_tags
-                                                                     ))
-                    jobs[job] = i
-
-                    if len(jobs) > cfg.CONCURRENT_MAX_WORKERS:
-                        break
-
-                for job in concurrent.futures.as_completed(jobs):
-                    pages_left -= 1
-                    pbar.update(1)
-                    page = job.result()
-                    del jobs[job]
-
-                    if page is not None:
-                        page.dump_data(cfg.METADATA_DIR, dry=dry)
-
-                    break
+            for statuses in run_in_window(executor,
+                                          try_create_page_metadata_batch,
+                                          batches,
+                                          cfg.MAX_IN_FLIGHT_TASKS):
+                created = []
+                failed_pages = []
+                for status in statuses:
+                    if status["name"] is None:
+                        failed_pages.append(status["index"])
+                        continue
+
+                    created.append(status)
+                    for key, value in status["placement"].items():
+                        placement[key] += value
+
+                if not dry:
+                    manifest.add_pages(created)
+                    manifest.add_failed_pages(failed_pages)
+                failed += len(failed_pages)
+                pbar.update(len(statuses))
+
+    manifest.close()
+
+    if failed > 0:
+        print(f"Could not create {failed} out of {n_pages} pages, "
+              f"run it again to try them with other seeds")
+
+    if placement["attempts"] > 0:
+        print(f"Placed {placement['placed']} of {placement['requested']} "
+              f"characters and speech bubbles, acceptance rate "
+              f"{placement['placed'] / placement['attempts']:.2%}")
@@ -1,8 +1,6 @@
-import numpy as np
-
 import src.config_file as cfg
 from src.layout_engine.helpers import (
-    invert_for_next, choose, choose_and_return_other,
+    invert_for_next, choose, choose_and_return_other, get_rng,
 )
 from src.layout_engine.page_objects import Panel
 from src.layout_engine.page_metadata_transforms import *
@@ -13,7 +11,7 @@ from src.layout_engine.page_metadata_draw import *
 def get_base_panels(num_panels=0,
                     layout_type=None,
                     type_choice=None,
-                    page_name=None):
+                    page_name=None, rng=None):
     """
     This function creates the base panels for one page
     it specifies how a page should be layed out and
@@ -38,10 +36,16 @@ def get_base_panels(num_panels=0,
 
     :type page_name: str, optional
 
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
+
     :return: A Page object with the panels initalized
 
     :rtype: Page
     """
+    rng = get_rng(rng)
 
     # TODO: Skew panel number distribution
 
@@ -58,35 +62,35 @@ def get_base_panels(num_panels=0,
     ]
 
     if layout_type is None:
-        layout_type = np.random.choice(["v", "h", "vh"])
+        layout_type = rng.choice(["v", "h", "vh"])
 
     # Panels encapsulated and returned within page
     if page_name is None:
-        page = Page(coords, layout_type, num_panels)
+        page = Page(coords, layout_type, num_panels, rng=rng)
     else:
-        page = Page(coords, layout_type, num_panels, name=page_name)
+        page = Page(coords, layout_type, num_panels, name=page_name, rng=rng)
 
     # If you want only vertical panels
     if layout_type == "v":
         max_num_panels = 4
         if num_panels < 1:
-            num_panels = np.random.choice([3, 4])
+            num_panels = rng.choice([3, 4])
             page.num_panels = num_panels
         else:
             page.num_panels = num_panels
         
-        draw_n_shifted(num_panels, page, "v")
+        draw_n_shifted(num_panels, page, "v", rng=rng)
 
     # If you want only horizontal panels
     elif layout_type == "h":
         max_num_panels = 5
         if num_panels < 1:
-            num_panels = np.random.randint(3, max_num_panels+1)
+            num_panels = rng.integers(3, max_num_panels+1)
             page.num_panels = num_panels
         else:
             page.num_panels = num_panels
 
-        draw_n_shifted(num_panels, page, "h")
+        draw_n_shifted(num_panels, page, "h", rng=rng)
 
     # If you want both horizontal and vertical panels
     elif layout_type == "vh":
@@ -94,7 +98,7 @@ def get_base_panels(num_panels=0,
         max_num_panels = 8
 
         if num_panels < 1:
-            num_panels = np.random.randint(2, max_num_panels+1)
+            num_panels = rng.integers(2, max_num_panels+1)
             page.num_panels = num_panels
         else:
             page.num_panels = num_panels
@@ -102,124 +106,124 @@ def get_base_panels(num_panels=0,
         if num_panels <= 2:
             # Draw 2 rectangles
             # vertically or horizontally
-            horizontal_vertical = np.random.choice(["h", "v"])
-            draw_n_shifted(num_panels, page, horizontal_vertical)
+            horizontal_vertical = rng.choice(["h", "v"])
+            draw_n_shifted(num_panels, page, horizontal_vertical, rng=rng)
 
         elif num_panels == 3:
             # Draw 2 rectangles
             # Vertically or Horizontally
 
-            horizontal_vertical = np.random.choice(["h", "v"])
-            draw_two_shifted(page, horizontal_vertical)
+            horizontal_vertical = rng.choice(["h", "v"])
+            draw_two_shifted(page, horizontal_vertical, rng=rng)
 
             next_div = invert_for_next(horizontal_vertical)
 
             # Pick one and divide it into 2 rectangles
-            choice_idx = choose(page)
+            choice_idx = choose(page, rng=rng)
             choice = page.get_child(choice_idx)
 
-            draw_two_shifted(choice, next_div)
+            draw_two_shifted(choice, next_div, rng=rng)
 
         elif num_panels == 4:
-            horizontal_vertical = np.random.choice(["h", "v"])
+            horizontal_vertical = rng.choice(["h", "v"])
 
             # Possible layouts with 4 panels
             if type_choice is None:
-                type_choice = np.random.choice(["eq", "uneq", "div",
+                type_choice = rng.choice(["eq", "uneq", "div",
                                                 "trip", "twoonethree"])
 
             # Draw two rectangles
             if type_choice == "eq":
-                draw_two_shifted(page, horizontal_vertical, shift=0.5)
+                draw_two_shifted(page, horizontal_vertical, shift=0.5, rng=rng)
                 next_div = invert_for_next(horizontal_vertical)
 
                 # Divide each into 2 rectangles equally
                 shift_min = 25
                 shift_max = 75
-                shift = np.random.randint(shift_min, shift_max)
+                shift = rng.integers(shift_min, shift_max)
                 shift = shift/100
 
-                draw_two_shifted(page.get_child(0), next_div, shift)
-                draw_two_shifted(page.get_child(1), next_div, shift)
+                draw_two_shifted(page.get_child(0), next_div, shift, rng=rng)
+                draw_two_shifted(page.get_child(1), next_div, shift, rng=rng)
 
             # Draw two rectangles
             elif type_choice == "uneq":
-                draw_two_shifted(page, horizontal_vertical, shift=0.5)
+                draw_two_shifted(page, horizontal_vertical, shift=0.5, rng=rng)
                 next_div = invert_for_next(horizontal_vertical)
 
                 # Divide each into 2 rectangles unequally
-                draw_two_shifted(page.get_child(0), next_div)
-                draw_two_shifted(page.get_child(1), next_div)
+                draw_two_shifted(page.get_child(0), next_div, rng=rng)
+                draw_two_shifted(page.get_child(1), next_div, rng=rng)
 
             elif type_choice == "div":
-                draw_two_shifted(page, horizontal_vertical, shift=0.5)
+                draw_two_shifted(page, horizontal_vertical, shift=0.5, rng=rng)
                 next_div = invert_for_next(horizontal_vertical)
 
                 # Pick one and divide into 2 rectangles
-                choice1_idx = choose(page)
+                choice1_idx = choose(page, rng=rng)
                 choice1 = page.get_child(choice1_idx)
 
-                draw_two_shifted(choice1, next_div)
+                draw_two_shifted(choice1, next_div, rng=rng)
 
                 # Pick one of these two and divide that into 2 rectangles
-                choice2_idx = choose(choice1)
+                choice2_idx = choose(choice1, rng=rng)
                 choice2 = choice1.get_child(choice2_idx)
 
                 next_div = invert_for_next(next_div)
-                draw_two_shifted(choice2, next_div)
+                draw_two_shifted(choice2, next_div, rng=rng)
 
             # Draw three rectangles
             elif type_choice == "trip":
                 draw_n(3, page, horizontal_vertical)
 
                 # Pick one and divide it into two
-                choice_idx = choose(page)
+                choice_idx = choose(page, rng=rng)
                 choice = page.get_child(choice_idx)
 
                 next_div = invert_for_next(horizontal_vertical)
 
-                draw_two_shifted(choice, next_div)
+                draw_two_shifted(choice, next_div, rng=rng)
 
             # Draw two rectangles
             elif type_choice == "twoonethree":
 
-                draw_two_shifted(page, horizontal_vertical)
+                draw_two_shifted(page, horizontal_vertical, rng=rng)
 
                 # Pick one and divide it into 3 rectangles
-                choice_idx = choose(page)
+                choice_idx = choose(page, rng=rng)
                 choice = page.get_child(choice_idx)
 
                 next_div = invert_for_next(horizontal_vertical)
 
-                draw_n_shifted(3, choice, next_div)
+                draw_n_shifted(3, choice, next_div, rng=rng)
 
         elif num_panels == 5:
 
             # Draw two rectangles
-            horizontal_vertical = np.random.choice(["h", "v"])
+            horizontal_vertical = rng.choice(["h", "v"])
 
             # Possible layouts with 5 panels
             if type_choice is None:
-                type_choice = np.random.choice(["eq", "uneq", "div",
+                type_choice = rng.choice(["eq", "uneq", "div",
                                                 "twotwothree", "threetwotwo",
                                                 "fourtwoone"])
 
             if type_choice == "eq" or type_choice == "uneq":
 
-                draw_two_shifted(page, horizontal_vertical, shift=0.5)
+                draw_two_shifted(page, horizontal_vertical, shift=0.5, rng=rng)
                 next_div = invert_for_next(horizontal_vertical)
 
                 # Pick one and divide it into two then
-                choice_idx = choose(page)
+                choice_idx = choose(page, rng=rng)
                 choice = page.get_child(choice_idx)
 
-                draw_two_shifted(choice, next_div)
+                draw_two_shifted(choice, next_div, rng=rng)
 
                 # Divide each into 2 rectangles equally
                 if type_choice == "eq":
                     shift_min = 25
                     shift_max = 75
-                    shift = np.random.randint(shift_min, shift_max)
+                    shift = rng.integers(shift_min, shift_max)
                     set_shift = shift/100
                 else:
                     # Divide each into 2 rectangles unequally
@@ -228,25 +232,25 @@ def get_base_panels(num_panels=0,
                 next_div = invert_for_next(next_div)
                 draw_two_shifted(choice.get_child(0),
                                  next_div,
-                                 shift=set_shift)
+                                 shift=set_shift, rng=rng)
 
                 draw_two_shifted(choice.get_child(1),
                                  next_div,
-                                 shift=set_shift)
+                                 shift=set_shift, rng=rng)
 
             # Draw two rectangles
             elif type_choice == "div":
-                draw_two_shifted(page, horizontal_vertical, shift=0.5)
+                draw_two_shifted(page, horizontal_vertical, shift=0.5, rng=rng)
                 next_div = invert_for_next(horizontal_vertical)
 
                 # Divide both equally
-                draw_two_shifted(page.get_child(0), next_div)
-                draw_two_shifted(page.get_child(1), next_div)
+                draw_two_shifted(page.get_child(0), next_div, rng=rng)
+                draw_two_shifted(page.get_child(1), next_div, rng=rng)
 
                 # Pick one of all of them and divide into two
-                page_child_chosen = np.random.choice(page.children)
+                page_child_chosen = rng.choice(page.children)
                 choice_idx, left_choices = choose_and_return_other(
-                    page_child_chosen
+                    page_child_chosen, rng=rng
                 )
 
                 choice = page_child_chosen.get_child(choice_idx)
@@ -254,23 +258,23 @@ def get_base_panels(num_panels=0,
                 next_div = invert_for_next(next_div)
                 draw_two_shifted(choice,
                                  horizontal_vertical=next_div,
-                                 shift=0.5
+                                 shift=0.5, rng=rng
                                  )
 
             # Draw two rectangles
             elif type_choice == "twotwothree":
 
-                draw_two_shifted(page, horizontal_vertical, shift=0.5)
+                draw_two_shifted(page, horizontal_vertical, shift=0.5, rng=rng)
                 next_div = invert_for_next(horizontal_vertical)
 
                 # Pick which one gets 2 and which gets 3
-                choice_idx, left_choices = choose_and_return_other(page)
+                choice_idx, left_choices = choose_and_return_other(page, rng=rng)
                 choice = page.get_child(choice_idx)
                 other = page.get_child(left_choices[0])
 
                 # Divide one into 2
                 next_div = invert_for_next(horizontal_vertical)
-                draw_two_shifted(choice, next_div)
+                draw_two_shifted(choice, next_div, rng=rng)
 
                 # Divide other into 3
                 draw_n(3, other, next_div)
@@ -281,42 +285,42 @@ def get_base_panels(num_panels=0,
                 draw_n(3, page, horizontal_vertical)
                 next_div = invert_for_next(horizontal_vertical)
 
-                choice1_idx, left_choices = choose_and_return_other(page)
-                choice2_idx = np.random.choice(left_choices)
+                choice1_idx, left_choices = choose_and_return_other(page, rng=rng)
+                choice2_idx = rng.choice(left_choices)
                 choice1 = page.get_child(choice1_idx)
                 choice2 = page.get_child(choice2_idx)
 
                 # Pick two and divide each into two
-                draw_two_shifted(choice1, next_div)
-                draw_two_shifted(choice2, next_div)
+                draw_two_shifted(choice1, next_div, rng=rng)
+                draw_two_shifted(choice2, next_div, rng=rng)
 
             # Draw 4 rectangles vertically
             elif type_choice == "fourtwoone":
                 draw_n(4, page, horizontal_vertical)
 
                 # Pick one and divide into two
-                choice_idx = choose(page)
+                choice_idx = choose(page, rng=rng)
                 choice = page.get_child(choice_idx)
 
                 next_div = invert_for_next(horizontal_vertical)
-                draw_two_shifted(choice, next_div)
+                draw_two_shifted(choice, next_div, rng=rng)
 
         elif num_panels == 6:
 
             # Possible layouts with 6 panels
             if type_choice is None:
-                type_choice = np.random.choice(["tripeq", "tripuneq",
+                type_choice = rng.choice(["tripeq", "tripuneq",
                                                 "twofourtwo", "twothreethree",
                                                 "fourtwotwo"])
 
-            horizontal_vertical = np.random.choice(["v", "h"])
+            horizontal_vertical = rng.choice(["v", "h"])
 
             # Draw 3 rectangles (V OR H)
             if type_choice == "tripeq" or type_choice == "tripuneq":
-                draw_n_shifted(3, page, horizontal_vertical)
+                draw_n_shifted(3, page, horizontal_vertical, rng=rng)
                 # Split each equally
                 if type_choice == "tripeq":
-                    shift = np.random.randint(25, 75)
+                    shift = rng.integers(25, 75)
                     shift = shift/100
                 # Split each unequally
                 else:
@@ -324,20 +328,20 @@ def get_base_panels(num_panels=0,
 
                 next_div = invert_for_next(horizontal_vertical)
                 for panel in page.children:
-                    draw_two_shifted(panel, next_div, shift=shift)
+                    draw_two_shifted(panel, next_div, shift=shift, rng=rng)
 
             # Draw 2 rectangles
             elif type_choice == "twofourtwo":
-                draw_two_shifted(page, horizontal_vertical)
+                draw_two_shifted(page, horizontal_vertical, rng=rng)
                 # Split into 4 one half 2 in another
                 next_div = invert_for_next(horizontal_vertical)
-                draw_n_shifted(4, page.get_child(0), next_div)
-                draw_two_shifted(page.get_child(1), next_div)
+                draw_n_shifted(4, page.get_child(0), next_div, rng=rng)
+                draw_two_shifted(page.get_child(1), next_div, rng=rng)
 
             # Draw 2 rectangles
             elif type_choice == "twothreethree":
                 # Split 3 in each
-                draw_two_shifted(page, horizontal_vertical)
+                draw_two_shifted(page, horizontal_vertical, rng=rng)
                 next_div = invert_for_next(horizontal_vertical)
 
                 for panel in page.children:
@@ -347,7 +351,7 @@ def get_base_panels(num_panels=0,
                     choice_max = round((100/n)*1.5)
                     choice_min = round((100/n)*0.5)
                     for i in range(0, n):
-                        shift_choice = np.random.randint(
+                        shift_choice = rng.integers(
                             choice_min,
                             choice_max
                         )
@@ -365,22 +369,22 @@ def get_base_panels(num_panels=0,
                     draw_n_shifted(3,
                                    panel,
                                    next_div,
-                                   shifts=normalized_shifts
+                                   shifts=normalized_shifts, rng=rng
                                    )
 
             # Draw 4 rectangles
             elif type_choice == "fourtwotwo":
-                draw_n_shifted(4, page, horizontal_vertical)
+                draw_n_shifted(4, page, horizontal_vertical, rng=rng)
 
                 # Split two of them
-                choice1_idx, left_choices = choose_and_return_other(page)
-                choice2_idx = np.random.choice(left_choices)
+                choice1_idx, left_choices = choose_and_return_other(page, rng=rng)
+                choice2_idx = rng.choice(left_choices)
                 choice1 = page.get_child(choice1_idx)
                 choice2 = page.get_child(choice2_idx)
 
                 next_div = invert_for_next(horizontal_vertical)
-                draw_two_shifted(choice1, next_div)
-                draw_two_shifted(choice2, next_div)
+                draw_two_shifted(choice1, next_div, rng=rng)
+                draw_two_shifted(choice2, next_div, rng=rng)
 
         elif num_panels == 7:
 
@@ -389,23 +393,23 @@ def get_base_panels(num_panels=0,
                      "threethreextwoone", "fourthreextwo"]
 
             if type_choice is None:
-                type_choice = np.random.choice(types)
+                type_choice = rng.choice(types)
 
             # Draw two split 3-4 - HV
             # Draw two rectangles
             if type_choice == "twothreefour":
-                horizontal_vertical = np.random.choice(["h", "v"])
+                horizontal_vertical = rng.choice(["h", "v"])
 
-                draw_two_shifted(page, horizontal_vertical, shift=0.5)
+                draw_two_shifted(page, horizontal_vertical, shift=0.5, rng=rng)
 
                 # Pick one and split one into 4 rectangles
-                choice_idx, left_choices = choose_and_return_other(page)
+                choice_idx, left_choices = choose_and_return_other(page, rng=rng)
                 choice = page.get_child(choice_idx)
                 other = page.get_child(left_choices[0])
 
                 next_div = invert_for_next(horizontal_vertical)
 
-                draw_n_shifted(4, choice, next_div)
+                draw_n_shifted(4, choice, next_div, rng=rng)
 
                 # Some issue with the function calls and seeding
                 n = 3
@@ -413,7 +417,7 @@ def get_base_panels(num_panels=0,
                 choice_max = round((100/n)*1.5)
                 choice_min = round((100/n)*0.5)
                 for i in range(0, n):
-                    shift_choice = np.random.randint(choice_min, choice_max)
+                    shift_choice = rng.integers(choice_min, choice_max)
                     choice_max = choice_max + ((100/n) - shift_choice)
                     shifts.append(shift_choice)
 
@@ -425,37 +429,37 @@ def get_base_panels(num_panels=0,
                     normalized_shifts.append(new_shift/100)
 
                 # Pick another and split into 3 rectangles
-                draw_n_shifted(3, other, next_div, shifts=normalized_shifts)
+                draw_n_shifted(3, other, next_div, shifts=normalized_shifts, rng=rng)
 
             # Draw three rectangles
             elif type_choice == "threethreetwotwo":
                 draw_n(3, page, "h")
 
                 # Pick one and split it into 3 rectangles
-                choice_idx, left_choices = choose_and_return_other(page)
+                choice_idx, left_choices = choose_and_return_other(page, rng=rng)
                 choice = page.get_child(choice_idx)
 
-                draw_n_shifted(3, choice, "v")
+                draw_n_shifted(3, choice, "v", rng=rng)
 
                 # Split the other two into 2 rectangles
-                draw_two_shifted(page.get_child(left_choices[0]), "v")
-                draw_two_shifted(page.get_child(left_choices[1]), "v")
+                draw_two_shifted(page.get_child(left_choices[0]), "v", rng=rng)
+                draw_two_shifted(page.get_child(left_choices[1]), "v", rng=rng)
 
             # Draw 3 rectangles
             elif type_choice == "threefourtwoone":
                 draw_n(3, page, "h")
 
                 # Pick two of three rectangles and let one be
-                choice_idx, left_choices = choose_and_return_other(page)
+                choice_idx, left_choices = choose_and_return_other(page, rng=rng)
                 choice = page.get_child(choice_idx)
-                other_idx = np.random.choice(left_choices)
+                other_idx = rng.choice(left_choices)
                 other = page.get_child(other_idx)
 
                 # Of the picked split one into 4 rectangles
-                draw_n_shifted(4, choice, "v")
+                draw_n_shifted(4, choice, "v", rng=rng)
 
                 # Split the other into 2 rectangles
-                draw_two_shifted(other, "v")
+                draw_two_shifted(other, "v", rng=rng)
 
             # Draw 3 rectangles
             elif type_choice == "threethreextwoone":
@@ -463,12 +467,12 @@ def get_base_panels(num_panels=0,
                 draw_n(3, page, "h")
 
                 # Pick two and leave one
-                choice_idx, left_choices = choose_and_return_other(page)
+                choice_idx, left_choices = choose_and_return_other(page, rng=rng)
                 choice = page.get_child(choice_idx)
                 other = page.get_child(left_choices[0])
 
                 # Of the picked split one into 3
-                draw_n_shifted(3, choice, "v")
+                draw_n_shifted(3, choice, "v", rng=rng)
 
                 # Some issue with the function calls and seeding
                 n = 3
@@ -476,7 +480,7 @@ def get_base_panels(num_panels=0,
                 choice_max = round((100/n)*1.5)
                 choice_min = round((100/n)*0.5)
                 for i in range(0, n):
-                    shift_choice = np.random.randint(choice_min, choice_max)
+                    shift_choice = rng.integers(choice_min, choice_max)
                     choice_max = choice_max + ((100/n) - shift_choice)
                     shifts.append(shift_choice)
 
@@ -488,22 +492,22 @@ def get_base_panels(num_panels=0,
                     normalized_shifts.append(new_shift/100)
 
                 # Split the other into 3 as well
-                draw_n_shifted(3, other, "v", shifts=normalized_shifts)
+                draw_n_shifted(3, other, "v", shifts=normalized_shifts, rng=rng)
 
             # Draw 4 split 3x2 - HV
 
             # Draw 4 rectangles
             elif type_choice == "fourthreextwo":
-                horizontal_vertical = np.random.choice(["h", "v"])
+                horizontal_vertical = rng.choice(["h", "v"])
                 draw_n(4, page, horizontal_vertical)
 
                 # Choose one and leave as is
-                choice_idx, left_choices = choose_and_return_other(page)
+                choice_idx, left_choices = choose_and_return_other(page, rng=rng)
 
                 # Divide the rest into two
                 next_div = invert_for_next(horizontal_vertical)
                 for panel in left_choices:
-                    draw_two_shifted(page.get_child(panel), next_div)
+                    draw_two_shifted(page.get_child(panel), next_div, rng=rng)
 
         elif num_panels == 8:
 
@@ -513,7 +517,7 @@ def get_base_panels(num_panels=0,
                      "threethreefourone"]
 
             if type_choice is None:
-                type_choice = np.random.choice(types)
+                type_choice = rng.choice(types)
 
             # Draw 4 rectangles
             # equal or uneqal 4-4x2
@@ -524,7 +528,7 @@ def get_base_panels(num_panels=0,
                 if type_choice == "fourfourxtwoeq":
                     shift_min = 25
                     shift_max = 75
-                    shift = np.random.randint(shift_min, shift_max)
+                    shift = rng.integers(shift_min, shift_max)
                     set_shift = shift/100
                 # Unequal
                 else:
@@ -533,7 +537,7 @@ def get_base_panels(num_panels=0,
                 # Drivide each into two
                 for panel in page.children:
 
-                    draw_two_shifted(panel, "v", shift=set_shift)
+                    draw_two_shifted(panel, "v", shift=set_shift, rng=rng)
 
             # Where three rectangles need to be drawn
             if type_choice in types[2:]:
@@ -543,9 +547,9 @@ def get_base_panels(num_panels=0,
                 if type_choice == "threethreethreetwo":
 
                     # Choose one and divide it into two
-                    choice_idx, left_choices = choose_and_return_other(page)
+                    choice_idx, left_choices = choose_and_return_other(page, rng=rng)
                     choice = page.get_child(choice_idx)
-                    draw_two_shifted(choice, "v")
+                    draw_two_shifted(choice, "v", rng=rng)
 
                     # Divide the rest into 3
                     for panel in left_choices:
@@ -555,7 +559,7 @@ def get_base_panels(num_panels=0,
                         choice_max = round((100/n)*1.5)
                         choice_min = round((100/n)*0.5)
                         for i in range(0, n):
-                            shift_choice = np.random.randint(
+                            shift_choice = rng.integers(
                                 choice_min,
                                 choice_max
                             )
@@ -573,20 +577,20 @@ def get_base_panels(num_panels=0,
                         draw_n_shifted(3,
                                        page.get_child(panel),
                                        "v",
-                                       shifts=normalized_shifts
+                                       shifts=normalized_shifts, rng=rng
                                        )
 
                 # Draw 3 rectangles then
                 elif type_choice == "threefourtwotwo":
 
                     # Choosen one and divide it into 4
-                    choice_idx, left_choices = choose_and_return_other(page)
+                    choice_idx, left_choices = choose_and_return_other(page, rng=rng)
                     choice = page.get_child(choice_idx)
 
-                    draw_n_shifted(4, choice, "v")
+                    draw_n_shifted(4, choice, "v", rng=rng)
 
                     for panel in left_choices:
-                        draw_two_shifted(page.get_child(panel), "v")
+                        draw_two_shifted(page.get_child(panel), "v", rng=rng)
 
                 # Draw 3 3-4-1 - H
 
@@ -594,13 +598,13 @@ def get_base_panels(num_panels=0,
                 elif type_choice == "threethreefourone":
 
                     # Choose two and leave one as is
-                    choice_idx, left_choices = choose_and_return_other(page)
+                    choice_idx, left_choices = choose_and_return_other(page, rng=rng)
                     choice = page.get_child(choice_idx)
-                    other_idx = np.random.choice(left_choices)
+                    other_idx = rng.choice(left_choices)
                     other = page.get_child(other_idx)
 
                     # Divide one into 3 rectangles
-                    draw_n_shifted(3, choice, "v")
+                    draw_n_shifted(3, choice, "v", rng=rng)
 
                     # Some issue with the function calls and seeding
                     n = 4
@@ -608,7 +612,7 @@ def get_base_panels(num_panels=0,
                     choice_max = round((100/n)*1.5)
                     choice_min = round((100/n)*0.5)
                     for i in range(0, n):
-                        shift_choice = np.random.randint(
+                        shift_choice = rng.integers(
                             choice_min,
                             choice_max
                         )
@@ -624,30 +628,30 @@ def get_base_panels(num_panels=0,
                         normalized_shifts.append(new_shift/100)
 
                     # Divide the other into 4 rectangles
-                    draw_n_shifted(4, other, "v", shifts=normalized_shifts)
+                    draw_n_shifted(4, other, "v", shifts=normalized_shifts, rng=rng)
         else:
-            horizontal_n = np.random.randint(2, num_panels // 2)
+            horizontal_n = rng.integers(2, num_panels // 2)
             draw_n(horizontal_n, page, "h")
 
             # vertical_n = num_panels
             vertical_ns = []
 
             for _ in range(horizontal_n):
-                # n = np.random.randint(1, vertical_n - horizontal_n + 1)
-                n = np.random.randint(1, num_panels // 2)
+                # n = rng.integers(1, vertical_n - horizontal_n + 1)
+                n = rng.integers(1, num_panels // 2)
                 # horizontal_n -= 1
                 # vertical_n -= n
                 vertical_ns.append(n)
 
             # Drivide each into two
             for i, panel in enumerate(page.children):
-                draw_n_shifted(vertical_ns[i], panel, "v")
+                draw_n_shifted(vertical_ns[i], panel, "v", rng=rng)
 
     return page
 
 
 # Creation helpers
-def draw_n_shifted(n, parent, horizontal_vertical, shifts=[]):
+def draw_n_shifted(n, parent, horizontal_vertical, shifts=[], rng=None):
     """
     A function to take a parent Panel and divide it into n
     sub-panel's vertically or horizontally with each panels having
@@ -671,7 +675,13 @@ def draw_n_shifted(n, parent, horizontal_vertical, shifts=[]):
     :param shifts: Ratios to divide the panel into sub-panels
 
     :type shifts: list
+
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
     """
+    rng = get_rng(rng)
 
     # Specify parent panel dimensions
     topleft = parent.x1y1
@@ -705,7 +715,7 @@ def draw_n_shifted(n, parent, horizontal_vertical, shifts=[]):
         shifts = []
         for i in range(0, n):
             # Randomly select a size for the new panel's side
-            shift_choice = np.random.randint(choice_min, choice_max)
+            shift_choice = rng.integers(choice_min, choice_max)
             # Change the maximum range acoording to available length
             # of the parent panel's size
             choice_max = choice_max + ((100/n) - shift_choice)
@@ -986,7 +996,7 @@ def draw_n(n, parent, horizontal_vertical):
             parent.add_child(poly)
 
 
-def draw_two_shifted(parent, horizontal_vertical, shift=None):
+def draw_two_shifted(parent, horizontal_vertical, shift=None, rng=None):
     """
     Draw two subpanels of a parent panel
 
@@ -1002,7 +1012,13 @@ def draw_two_shifted(parent, horizontal_vertical, shift=None):
     :param shift: by what ratio should the 2 panels be split, defaults to None
 
     :type shift: float, optional
+
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
     """
+    rng = get_rng(rng)
 
     # Specify parent panel dimensions
     topleft = parent.x1y1
@@ -1014,7 +1030,7 @@ def draw_two_shifted(parent, horizontal_vertical, shift=None):
     if shift is None:
         shift_min = 25
         shift_max = 75
-        shift = np.random.randint(shift_min, shift_max)
+        shift = rng.integers(shift_min, shift_max)
         shift = shift/100
 
     # If panel is horizontal
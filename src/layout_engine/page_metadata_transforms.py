@@ -1,6 +1,4 @@
-import numpy as np
 import math
-import random
 import pyclipper
 
 import src.config_file as cfg
@@ -9,7 +7,8 @@ from src.layout_engine.helpers import (
     get_leaf_panels,
     get_min_area_panels,
     find_parent_with_multiple_children,
-    move_children_to_line
+    move_children_to_line,
+    get_rng
 )
 from src.layout_engine.page_metadata_draw import *
 
@@ -19,7 +18,8 @@ def single_slice_panels(page: Page,
                         horizontal_vertical=None,
                         type_choice=None,
                         skew_side=None,
-                        number_to_slice=0
+                        number_to_slice=0,
+                        rng=None
                         ):
     """Slices a panel once at an angle into two new panels
 
@@ -46,10 +46,16 @@ def single_slice_panels(page: Page,
 
     :type number_to_slice: int
 
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
+
     :return: page with sliced panels
 
     :rtype: Page
     """
+    rng = get_rng(rng)
 
     # Remove panels which are too small
     relevant_panels = []
@@ -62,11 +68,11 @@ def single_slice_panels(page: Page,
         relevant_panels = [page]
 
     # Shuffle panels for randomness
-    random.shuffle(relevant_panels)
+    rng.shuffle(relevant_panels)
 
     # single slice close
     if type_choice is None:
-        type_choice_prob = np.random.random()
+        type_choice_prob = rng.random()
         if type_choice_prob < cfg.center_side_ratio:
             type_choice = "center"
         else:
@@ -81,7 +87,7 @@ def single_slice_panels(page: Page,
 
         if number_to_slice == 0:
             if len(relevant_panels) > 1:
-                number_to_slice = np.random.randint(1, len(relevant_panels))
+                number_to_slice = rng.integers(1, len(relevant_panels))
             else:
                 number_to_slice = 1
 
@@ -91,10 +97,10 @@ def single_slice_panels(page: Page,
 
             # Decide which direction to cut in
             if horizontal_vertical is None:
-                horizontal_vertical = np.random.choice(["h", "v"])
+                horizontal_vertical = rng.choice(["h", "v"])
 
             # Skew it by a percentage
-            skew_amount = np.random.randint(25, 100)/100
+            skew_amount = rng.integers(25, 100)/100
 
             # Get center line
             # Vertical slice
@@ -106,7 +112,7 @@ def single_slice_panels(page: Page,
 
                 # Skew it left or right
                 if skew_side is None:
-                    skew_side = np.random.choice(["left", "right", "center"])
+                    skew_side = rng.choice(["left", "right", "center"])
 
                 skew_amount = skew_amount*panel_chosen_coord_length
 
@@ -145,7 +151,7 @@ def single_slice_panels(page: Page,
 
                 elif skew_side == "center":
                     skew_amount = skew_amount // 2
-                    num_vertex = np.random.randint(3, 10)
+                    num_vertex = rng.integers(3, 10)
                     height = p1.x3y3[1] - p1.x2y2[1]
                     height_n = height // (num_vertex - 1)
                     p1_coords = []
@@ -198,7 +204,7 @@ def single_slice_panels(page: Page,
 
                 # Skew it left or right
                 if skew_side is None:
-                    skew_side = np.random.choice(["down", "up", "center"])
+                    skew_side = rng.choice(["down", "up", "center"])
 
                 skew_amount = skew_amount*panel_chosen_coord_length
 
@@ -235,7 +241,7 @@ def single_slice_panels(page: Page,
                 
                 elif skew_side == "center":
                     skew_amount = skew_amount // 2
-                    num_vertex = np.random.randint(3, 10)
+                    num_vertex = rng.integers(3, 10)
                     width = p1.x3y3[0] - p1.x4y4[0]
                     width_n = width // (num_vertex - 1)
                     p1_coords = []
@@ -286,14 +292,14 @@ def single_slice_panels(page: Page,
 
         if number_to_slice == 0:
             if len(relevant_panels) > 1:
-                number_to_slice = np.random.choice([1, 3])
+                number_to_slice = rng.choice([1, 3])
             else:
                 number_to_slice = 1
 
         for panel in relevant_panels[0:number_to_slice]:
 
             if skew_side is None:
-                skew_side = np.random.choice(["tr", "tl", "br", "bl"])
+                skew_side = rng.choice(["tr", "tl", "br", "bl"])
 
             draw_n(2, panel, "h")
             num_panels_added += 1
@@ -308,8 +314,8 @@ def single_slice_panels(page: Page,
             p1.sliced = True
             p2.sliced = True
 
-            cut_y_proportion = np.random.randint(25, 75)/100
-            cut_x_proportion = np.random.randint(25, 75)/100
+            cut_y_proportion = rng.integers(25, 75)/100
+            cut_x_proportion = rng.integers(25, 75)/100
 
             cut_y_length = (panel.x4y4[1] - panel.x1y1[1])*cut_y_proportion
             cut_x_length = (panel.x3y3[0] - panel.x4y4[0])*cut_x_proportion
@@ -369,7 +375,7 @@ def single_slice_panels(page: Page,
     return page
 
 
-def box_transform_panels(page: Page, type_choice=None, pattern=None):
+def box_transform_panels(page: Page, type_choice=None, pattern=None, rng=None):
     """
     This function move panel boundaries to transform them
     into trapezoids and rhombuses
@@ -389,13 +395,19 @@ def box_transform_panels(page: Page, type_choice=None, pattern=None):
 
     :type pattern: str, optional
 
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
+
     :return: Transformed Page
 
     :rtype: Page
     """
+    rng = get_rng(rng)
 
     if type_choice is None:
-        type_choice_prob = np.random.random()
+        type_choice_prob = rng.random()
         if type_choice_prob < cfg.panel_box_trapezoid_ratio:
             type_choice = "trapezoid"
         else:
@@ -410,7 +422,7 @@ def box_transform_panels(page: Page, type_choice=None, pattern=None):
 
         if len(relevant_panels) > 0:
             if len(relevant_panels) > 1:
-                num_panels = np.random.randint(1, len(relevant_panels)+1)
+                num_panels = rng.integers(1, len(relevant_panels)+1)
             else:
                 num_panels = 1
 
@@ -443,11 +455,11 @@ def box_transform_panels(page: Page, type_choice=None, pattern=None):
 
                 # Choose trapezoid pattern
                 if pattern is None:
-                    trapezoid_pattern = np.random.choice(["A", "V"])
+                    trapezoid_pattern = rng.choice(["A", "V"])
                 else:
                     trapezoid_pattern = pattern
 
-                movement_proportion = np.random.randint(
+                movement_proportion = rng.integers(
                     10,
                     cfg.trapezoid_movement_limit)
 
@@ -620,7 +632,7 @@ def box_transform_panels(page: Page, type_choice=None, pattern=None):
         if len(relevant_panels) > 0:
 
             if len(relevant_panels) > 1:
-                num_panels = np.random.randint(1, len(relevant_panels))
+                num_panels = rng.integers(1, len(relevant_panels))
             else:
                 num_panels = 1
 
@@ -651,11 +663,11 @@ def box_transform_panels(page: Page, type_choice=None, pattern=None):
                         min_height = child.height
 
                 if pattern is None:
-                    rhombus_pattern = np.random.choice(["left", "right"])
+                    rhombus_pattern = rng.choice(["left", "right"])
                 else:
                     rhombus_pattern = pattern
 
-                movement_proportion = np.random.randint(
+                movement_proportion = rng.integers(
                     10,
                     cfg.rhombus_movement_limit
                 )
@@ -800,7 +812,7 @@ def box_transform_panels(page: Page, type_choice=None, pattern=None):
     return page
 
 
-def box_transform_page(page: Page, direction_list=[]):
+def box_transform_page(page: Page, direction_list=[], rng=None):
     """
     This function takes all the first child panels of a page
     and moves them to form a zigzag or a rhombus pattern
@@ -812,10 +824,16 @@ def box_transform_page(page: Page, direction_list=[]):
     :param direction_list: A list of directions the page
     should move it's child panel's corner's to
 
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
+
     :return: Transformed page
 
     :rtype: Page
     """
+    rng = get_rng(rng)
 
     if len(page.children) > 1:
 
@@ -829,7 +847,7 @@ def box_transform_page(page: Page, direction_list=[]):
             p1.non_rect = True
             p2.non_rect = True
 
-            change_proportion = np.random.randint(
+            change_proportion = rng.integers(
                 10,
                 cfg.full_page_movement_proportion_limit
             )
@@ -838,7 +856,7 @@ def box_transform_page(page: Page, direction_list=[]):
 
             # Randomly move the line between them up or down one side
             if len(direction_list) < 1:
-                direction = np.random.choice(["rup", "lup"])
+                direction = rng.choice(["rup", "lup"])
             else:
                 direction = direction_list[idx]
 
@@ -935,17 +953,19 @@ def box_transform_page(page: Page, direction_list=[]):
     return page
 
 
-def circular_transform_panels(page: Page):
+def circular_transform_panels(page: Page, rng=None):
+    rng = get_rng(rng)
+
     for panel in page.children:
         if panel.non_rect or panel.sliced:
             continue
 
-        panel.circular = np.random.random() < cfg.circular_panel_probability
+        panel.circular = rng.random() < cfg.circular_panel_probability
 
     return page
 
 
-def add_transforms(page: Page):
+def add_transforms(page: Page, rng=None):
     """Adds panel boundary transformations
     to the page
 
@@ -953,10 +973,16 @@ def add_transforms(page: Page):
 
     :type page: Page
 
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
+
     :return: Page with transformed panels
 
     :rtype: Page
     """
+    rng = get_rng(rng)
     # Transform types
 
     # Allow choosing multiple
@@ -964,32 +990,32 @@ def add_transforms(page: Page):
 
     # Slicing panels into multiple panels
     # Works best with large panels
-    if "slice" in transform_choice and np.random.random() < cfg.slice_transform_chance:
+    if "slice" in transform_choice and rng.random() < cfg.slice_transform_chance:
         transform_choice.pop(2)
-        page = single_slice_panels(page)
+        page = single_slice_panels(page, rng=rng)
 
         # Makes v cuts happen more often 1/4 chance
-        if np.random.random() < cfg.double_slice_chance:
-            page = single_slice_panels(page)
+        if rng.random() < cfg.double_slice_chance:
+            page = single_slice_panels(page, rng=rng)
         
         return page
 
-    if "box" in transform_choice and np.random.random() < cfg.box_transform_chance:
+    if "box" in transform_choice and rng.random() < cfg.box_transform_chance:
         if len(transform_choice) > 2:
             transform_choice.pop(2)
 
-        if np.random.random() < cfg.box_transform_panel_chance:
-            page = box_transform_panels(page)
+        if rng.random() < cfg.box_transform_panel_chance:
+            page = box_transform_panels(page, rng=rng)
 
-        page = box_transform_page(page)
+        page = box_transform_page(page, rng=rng)
 
     if "circular" in transform_choice:
-        page = circular_transform_panels(page)
+        page = circular_transform_panels(page, rng=rng)
 
     return page
 
 
-def shrink_panels(page):
+def shrink_panels(page, rng=None):
     """
     A function that uses the pyclipper library]
     to reduce the size of the panel polygon
@@ -999,10 +1025,16 @@ def shrink_panels(page):
 
     :type page: Page
 
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
+
     :return: Page with shrunk panels
 
     :rtype: Page
     """
+    rng = get_rng(rng)
 
     panels = []
     if len(page.leaf_children) < 1:
@@ -1011,7 +1043,7 @@ def shrink_panels(page):
     else:
         panels = page.leaf_children
 
-    panel_shrink_amount = np.random.randint(
+    panel_shrink_amount = rng.integers(
         cfg.panel_shrink_amount_min, cfg.panel_shrink_amount_max)
 
     # For each panel
@@ -1046,7 +1078,7 @@ def shrink_panels(page):
     return page
 
 
-def remove_panel(page):
+def remove_panel(page, rng=None):
     """
     This function randomly removes
     a panel from pages which have
@@ -1056,17 +1088,23 @@ def remove_panel(page):
 
     :type page: Page
 
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
+
     :return: Page with panels removed
 
     :rtype: Page
     """
+    rng = get_rng(rng)
 
     # If page has > n+1 children so there's
     # at least 1 panel left
     if page.num_panels > cfg.panel_removal_max + 1:
 
         # Remove 1 to n panels
-        remove_number = np.random.choice([1, cfg.panel_removal_max])
+        remove_number = rng.choice([1, cfg.panel_removal_max])
 
         # Remove panel
         for i in range(remove_number):
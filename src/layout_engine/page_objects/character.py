@@ -5,6 +5,9 @@ from PIL import Image, ImageOps
 
 from src.layout_engine.page_objects.speech_bubble import SpeechBubble
 from src import config_file as cfg
+from src.layout_engine.helpers import boxes_overlap, get_rng
+from src.layout_engine.tracing import span
+from src.layout_engine.image_cache import load_image
 
 
 class Character(object):
@@ -62,8 +65,26 @@ class Character(object):
     is written left to right ot top to bottom
 
     :type text_orientation: str, optional
+
+    :param rng: Random number generator used to pick the
+    transformations, defaults to None for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
     """
 
+    __slots__ = (
+        "object_image",
+        "resize_to",
+        "width",
+        "height",
+        "location",
+        "composite_location",
+        "panel_center_coords",
+        "transform_metadata",
+        "transforms",
+        "speech_bubbles",
+    )
+
     def __init__(self,
                  object_image,
                  width,
@@ -74,6 +95,7 @@ class Character(object):
                  resize_to=None,
                  transforms=None,
                  transform_metadata=None,
+                 rng=None,
                  ):
         """
         Constructor method
@@ -103,21 +125,22 @@ class Character(object):
             self.transform_metadata = transform_metadata
 
         if transforms is None:
+            rng = get_rng(rng)
             possible_transforms = [
                 # "flip horizontal",
                 "flip vertical",
                 "rotate",
             ]
             # 1 in 50 chance of no transformation
-            if np.random.rand() < 0.98:
-                self.transforms = list(np.random.choice(
+            if rng.random() < 0.98:
+                self.transforms = list(rng.choice(
                     possible_transforms,
                     2,
                     replace=False
                 ))
 
                 if "rotate" in self.transforms:
-                    rotation = np.random.randint(5, 15)
+                    rotation = rng.integers(5, 15)
                     self.transform_metadata["rotation_amount"] = rotation
 
             else:
@@ -127,7 +150,7 @@ class Character(object):
 
         self.speech_bubbles = []
 
-    def place_randomly(self, panel):
+    def place_randomly(self, panel, rng=None):
         """
         A method to place the character in a random location
         inside the panel.
@@ -136,14 +159,21 @@ class Character(object):
         be placed
 
         :type  panel: Panel
+
+        :param rng: Random number generator, defaults to None
+        for an unseeded one
+
+        :type rng: numpy.random.Generator, optional
         """
+        rng = get_rng(rng)
+
         # resize to < 40% of panel area
         max_area = panel.area*cfg.object_to_panel_area_max_ratio
-        new_area = np.random.random()*(max_area*0.75)  # TODO: Parametrize
+        new_area = rng.random()*(max_area*0.75)  # TODO: Parametrize
         new_area = max_area - new_area
         self.resize_to = new_area
 
-        x_choice, y_choice = panel.get_random_coords()
+        x_choice, y_choice = panel.get_random_coords(rng)
 
         self.location = [
             x_choice,
@@ -162,25 +192,22 @@ class Character(object):
         :return: Whether the Character overlaps.
         :rtype: bool
         """
-        self_x1, self_y1 = self.location
-        self_x1 /= 2
-        self_y1 /= 2
-        other_x1, other_y1 = other.location
-        other_x1 /= 2
-        other_y1 /= 2
-
-        self_height, self_width = self.get_resized()
-        other_height, other_width = other.get_resized()
+        return boxes_overlap(self.get_overlap_box(), other.get_overlap_box())
 
-        self_x2 = self_x1 + self_width
-        self_y2 = self_y1 + self_height
-        other_x2 = other_x1 + other_width
-        other_y2 = other_y1 + other_height
+    def get_overlap_box(self):
+        """
+        The box used to check whether this Character overlaps
+        with other objects
 
-        x_inter = max(0, min(self_x2, other_x2) - max(self_x1, other_x1))
-        y_inter = max(0, min(self_y2, other_y2) - max(self_y1, other_y1))
+        :return: x1, y1, x2, y2 of the box
+        :rtype: tuple
+        """
+        x1, y1 = self.location
+        x1 /= 2
+        y1 /= 2
+        height, width = self.get_resized()
 
-        return x_inter > cfg.overlap_offset and y_inter > cfg.overlap_offset
+        return x1, y1, x1 + width, y1 + height
 
     def get_resized(self):
         if "stretch_x_factor" in self.transform_metadata:
@@ -199,15 +226,16 @@ class Character(object):
         new_width = round(new_height * aspect_ratio)
         return new_height, new_width
 
-    def get_random_coords(self):
+    def get_random_coords(self, rng=None):
+        rng = get_rng(rng)
         # x1, y1 = self.location
         x1, y1 = 0, 0
         x2, y2 = x1 + self.width, y1 + self.height
-        if np.random.random() < 0.5:
-            x = np.random.randint(x1, x2 // 5)
+        if rng.random() < 0.5:
+            x = rng.integers(x1, x2 // 5)
         else:
-            x = np.random.randint(x2 * 4 // 5, x2)
-        y = np.random.randint(y1, y2)
+            x = rng.integers(x2 * 4 // 5, x2)
+        y = rng.integers(y1, y2)
         return int(x), int(y)
 
     def get_center(self):
@@ -388,46 +416,60 @@ class Character(object):
         """
         A function to render this character
 
-        :return: The character itself, its mask and its location
-        on the page
+        :param get_segmentations: Whether to also render the
+        character and each of its speech bubbles on their own,
+        defaults to False
+
+        :type get_segmentations: bool, optional
+
+        :return: The character with its speech bubbles, its mask,
+        which is a list of the images of the character and of each
+        bubble on their own if get_segmentations is set, and its
+        location on the page
         :rtype: tuple
         """
 
         composite_image = Image.new("RGBA", (self.width, self.height))
-        object_image = Image.open(self.object_image).convert("RGBA")
-        composite_image, object_image, _, _ = self.apply_prerendering_transforms(
-            composite_image, object_image)
-        composite_images = [composite_image]
+        with span("Character.load", self.object_image):
+            object_image = load_image(self.object_image, "RGBA")
+        with span("Character.transforms", self.object_image):
+            composite_image, object_image, _, _ = self.apply_prerendering_transforms(
+                composite_image, object_image)
+        segmentation_images = []
 
         if get_segmentations:
-            composite_images += [composite_image.copy()
-                                 for _ in range(len(self.speech_bubbles))]
+            segmentation_images = [composite_image.copy()
+                                   for _ in range(len(self.speech_bubbles) + 1)]
+            segmentation_images[0].paste(
+                object_image, self.composite_location, object_image)
 
-        composite_images[0].paste(
+        composite_image.paste(
             object_image, self.composite_location, object_image)
 
         for i, speech_bubble in enumerate(self.speech_bubbles):
-            speech_bubble_image, speech_bubble_mask, location = speech_bubble.render()
+            with span("SpeechBubble.render", speech_bubble.speech_bubble):
+                speech_bubble_image, speech_bubble_mask, location = speech_bubble.render()
             # TODO: There's a bug that cuts panels above the caracter, solve it
             # This is a temporal fix
             x, y = location
             x = max(0, x); y = max(0, y)
 
-            if not get_segmentations:
-                composite_images[0].paste(speech_bubble_image,
+            composite_image.paste(speech_bubble_image,
+                                  (x, y), speech_bubble_mask)
+            if get_segmentations:
+                segmentation_images[i+1].paste(speech_bubble_image,
                                     (x, y), speech_bubble_mask)
-            else:
-                composite_images[i+1].paste(speech_bubble_image,
-                                    (x, y), speech_bubble_mask)
-
-        composite_images = [
-            self.apply_resizing(ci) for ci in composite_images
-        ]
 
-        if "rotate" in self.transforms:
+        with span("Character.resize", self.object_image):
             composite_images = [
-            self.apply_rotation(ci) for ci in composite_images
-        ]
+                self.apply_resizing(ci)
+                for ci in [composite_image] + segmentation_images
+            ]
+
+            if "rotate" in self.transforms:
+                composite_images = [
+                self.apply_rotation(ci) for ci in composite_images
+            ]
 
         x1, y1 = self.prevent_bleeding(composite_images[0])
         self.location = (x1, y1)
@@ -435,5 +477,5 @@ class Character(object):
         if not get_segmentations:
             return composite_images[0], composite_images[0], self.location
         else:
-            return composite_images, composite_images, self.location
+            return composite_images[0], composite_images[1:], self.location
 
@@ -1,35 +1,44 @@
 import os
 import numpy as np
 
-from PIL import Image
+from src.asset_index import AssetIndex
+from src.layout_engine.helpers import get_rng
+from src.layout_engine.tracing import span
 from src.layout_engine.page_objects import Character, Panel
 
 
 class CharacterFactory:
     def __init__(self,
         foregrounds_dir: list,
-        foregrounds_dir_path: str
+        foregrounds_dir_path: str,
+        asset_index: AssetIndex = None
     ) -> None:
         self.foregrounds_dir = foregrounds_dir
         self.foregrounds_dir_path = foregrounds_dir_path
 
-    def create(self, panel: Panel) -> Character:
+        if asset_index is None:
+            asset_index = AssetIndex()
+        self.asset_index = asset_index
+
+    def create(self, panel: Panel, rng: np.random.Generator = None) -> Character:
+        rng = get_rng(rng)
         foregrounds_len = len(self.foregrounds_dir)
-        foreground_file_idx = np.random.randint(
+        foreground_file_idx = rng.integers(
             0,
             foregrounds_len
         )
         character_file = os.path.join(
             self.foregrounds_dir_path, self.foregrounds_dir[foreground_file_idx])
 
-        character_img = Image.open(character_file)
-        width, height = character_img.size
+        with span("CharacterFactory.get_size", character_file):
+            width, height = self.asset_index.get_size(character_file)
 
         character = Character(
             character_file,
             width,
             height,
             panel_center_coords=panel.get_center(),
+            rng=rng,
         )
 
         return character
@@ -1,16 +1,43 @@
-import random
 import numpy as np
 import json
 import uuid
 
 from PIL import Image, ImageDraw, ImageEnhance
-from src.layout_engine.helpers import (add_noise, blank_image,
-                      crop_image_only_outside, get_leaf_panels, get_segmentation)
+from src.layout_engine.helpers import (noise_levels,
+                      get_leaf_panels, get_segmentation,
+                      get_rng, to_builtin)
 from src import config_file as cfg
+from src.layout_engine.tracing import span
+from src.layout_engine.image_cache import load_image
+from src.layout_engine.page_compositor import get_page_compositor
 from .panel import Panel
 from .speech_bubble import SpeechBubble
 
 
+# Key of the stream derived from the page's seed that rendering
+# draws from, so that it doesn't repeat the draws of the layout
+RENDER_STREAM = 1
+
+
+def iter_leaf_data(data):
+    """
+    Walk the dumped tree of panels of a page or panel
+
+    :param data: The dumped page or panel
+
+    :type data: dict
+
+    :return: The data of each leaf panel in the same order
+    as get_leaf_panels
+    :rtype: generator
+    """
+    for child in data['children']:
+        if len(child['children']) > 0:
+            yield from iter_leaf_data(child)
+        else:
+            yield child
+
+
 class Page(Panel):
     """
     A class that represents a full page consiting of multiple child panels
@@ -31,8 +58,30 @@ class Page(Panel):
     :param children: List of direct child panels of this page
 
     :type children: list, optional:
+
+    :param seed: Seed the page was created with, which rendering
+    derives its random draws from, defaults to None
+
+    :type seed: int, optional
+
+    :param rng: Random number generator, defaults to None
+    for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
     """
 
+    __slots__ = (
+        "num_panels",
+        "page_type",
+        "seed",
+        "background",
+        "leaf_children",
+        "page_size",
+        "placement_stats",
+        "transform_noise",
+        "transform_rotation",
+    )
+
     def __init__(self,
                  coords=[],
                  page_type="",
@@ -41,10 +90,14 @@ class Page(Panel):
                  name=None,
                  transform_noise=None,
                  transform_rotation=None,
+                 seed=None,
+                 rng=None,
                  ):
         """
         Constructor method
         """
+        if transform_noise is None or transform_rotation is None:
+            rng = get_rng(rng)
 
         if len(coords) < 1:
             topleft = (0.0, 0.0)
@@ -64,13 +117,13 @@ class Page(Panel):
             self.name = name
 
         if transform_noise is None:
-            self.transform_noise = np.random.randint(2, 25)
+            self.transform_noise = rng.integers(2, 25)
         else:
             self.transform_noise = transform_noise
 
         if transform_rotation is None:
-            if np.random.random() < 0.5:
-                self.transform_rotation = np.random.randint(-15, 15)
+            if rng.random() < 0.5:
+                self.transform_rotation = rng.integers(-15, 15)
             else:
                 self.transform_rotation = 0
         else:
@@ -86,6 +139,7 @@ class Page(Panel):
 
         self.num_panels = num_panels
         self.page_type = page_type
+        self.seed = seed
 
         # Whether this page needs to be rendered with a background
         self.background = None
@@ -97,7 +151,11 @@ class Page(Panel):
         # Size of the page
         self.page_size = cfg.page_size
 
-    def dump_data(self, dataset_path, dry=True):
+        # How many characters and speech bubbles were asked to be
+        # placed on the page, how many were and the positions tried
+        self.placement_stats = dict(requested=0, placed=0, attempts=0)
+
+    def dump_data(self, dataset_path, dry=True, store=None):
         """
         A method to take all the Page's relevant data
         and create a dictionary out of it so it can be
@@ -112,8 +170,33 @@ class Page(Panel):
 
         :type dry: bool, optional
 
-        :return: Optional return when running dry of a json data dump
-        :rtype: str
+        :param store: Metadata store to write the page to instead
+        of a JSON file, defaults to None
+
+        :type store: MetadataStore, optional
+
+        :return: Optional return when running dry of a json data dump,
+        or the shard entry of the page when writing to a store
+        :rtype: str or tuple
+        """
+        data = self.get_data()
+
+        if not dry and store is not None:
+            return store.write(self.name, data)
+        elif not dry:
+            with open(dataset_path+self.name+".json", "w+") as json_file:
+                json.dump(data, json_file, default=to_builtin)
+        else:
+            return json.dumps(data, default=to_builtin)
+
+    def get_data(self):
+        """
+        Take all the Page's relevant data and create a
+        dictionary out of it. The dictionary shares lists
+        and dictionaries with the page's objects.
+
+        :return: The page's metadata
+        :rtype: dict
         """
 
         # Recursively dump children
@@ -133,56 +216,156 @@ class Page(Panel):
             speech_bubbles=speech_bubbles,
             transform_noise=self.transform_noise,
             transform_rotation=self.transform_rotation,
+            seed=self.seed,
         )
 
-        if not dry:
-            with open(dataset_path+self.name+".json", "w+") as json_file:
-                json.dump(data, json_file)
-        else:
-            return json.dumps(data)
+        return data
 
-    def load_data(self, filename):
+    def load_data(self, filename, store=None, leaves_only=False):
         """
         This method reverses the dump_data function and
         load's the metadata of the page from the JSON
         file that has been loaded.
 
-        :param filename: JSON filename to load
+        :param filename: JSON filename to load or the name
+        of the page if it's loaded from a store
 
         :type filename: str
+
+        :param store: Metadata store to read the page from,
+        defaults to None
+
+        :type store: MetadataStore, optional
+
+        :param leaves_only: Whether to only load the panels
+        that are rendered, defaults to False
+
+        :type leaves_only: bool, optional
+        """
+        if store is not None:
+            data = store.get(filename)
+        else:
+            with open(filename, "rb") as json_file:
+                data = json.load(json_file)
+
+        self.load_dict(data, leaves_only)
+
+    def load_dict(self, data, leaves_only=False):
+        """
+        Load the metadata of the page from a dictionary
+        made by the dump_data function
+
+        :param data: The page's metadata
+
+        :type data: dict
+
+        :param leaves_only: Whether to only load the panels that
+        are rendered. They're put in leaf_children with the page
+        as their parent and the rest of the tree isn't built,
+        which is enough to render and annotate the page.
+        Defaults to False
+
+        :type leaves_only: bool, optional
         """
-        with open(filename, "rb") as json_file:
-
-            data = json.load(json_file)
-
-            self.name = data['name']
-            self.num_panels = int(data['num_panels'])
-            self.page_type = data['page_type']
-            self.background = data['background']
-            self.transform_noise = data['transform_noise']
-            self.transform_rotation = data['transform_rotation']
-
-            if len(data['speech_bubbles']) > 0:
-                for speech_bubble_data in data['speech_bubbles']:
-                    bubble = SpeechBubble.load_data(speech_bubble_data)
-                    self.speech_bubbles.append(bubble)
-
-            # Recursively load children
-            if len(data['children']) > 0:
-                for child in data['children']:
-                    panel = Panel(
-                        coords=child['coordinates'],
-                        name=child['name'],
-                        parent=self,
-                        orientation=child['orientation'],
-                        non_rect=child['non_rect']
-                    )
-                    panel.load_data(child)
-                    self.children.append(panel)
-
-    def create_coco_annotations(self, image_id: int):
+        self.name = data['name']
+        self.num_panels = int(data['num_panels'])
+        self.page_type = data['page_type']
+        self.background = data['background']
+        self.transform_noise = data['transform_noise']
+        self.transform_rotation = data['transform_rotation']
+        self.seed = data.get('seed')
+
+        if len(data['speech_bubbles']) > 0:
+            for speech_bubble_data in data['speech_bubbles']:
+                bubble = SpeechBubble.load_data(speech_bubble_data)
+                self.speech_bubbles.append(bubble)
+
+        if leaves_only:
+            for child in iter_leaf_data(data):
+                panel = Panel(
+                    coords=child['coordinates'],
+                    name=child['name'],
+                    parent=self,
+                    orientation=child['orientation'],
+                    non_rect=child['non_rect']
+                )
+                panel.load_data(child)
+                self.leaf_children.append(panel)
+
+            return
+
+        # Recursively load children
+        if len(data['children']) > 0:
+            for child in data['children']:
+                panel = Panel(
+                    coords=child['coordinates'],
+                    name=child['name'],
+                    parent=self,
+                    orientation=child['orientation'],
+                    non_rect=child['non_rect']
+                )
+                panel.load_data(child)
+                self.children.append(panel)
+
+    def render_panel_objects(self, panel, get_segmentations=False):
+        """
+        Render the characters and speech bubbles of a panel
+
+        :param panel: The panel
+
+        :type panel: Panel
+
+        :param get_segmentations: Whether to also render each
+        character and its speech bubbles on their own,
+        defaults to False
+
+        :type get_segmentations: bool, optional
+
+        :return: The images, masks and locations on the page of
+        the characters and of the speech bubbles of the panel
+        :rtype: tuple
+        """
+        characters = []
+        for ch in panel.characters:
+            with span("Character.render", ch.object_image):
+                characters.append(ch.render(get_segmentations))
+
+        speech_bubbles = []
+        for sb in panel.speech_bubbles:
+            with span("SpeechBubble.render", sb.speech_bubble):
+                bubble, mask, location = sb.render()
+            # Slightly shift mask so that you get outline for bubbles
+            new_mask_width = mask.size[0]+cfg.bubble_mask_x_increase
+            new_mask_height = mask.size[1]+cfg.bubble_mask_y_increase
+            bubble_mask = mask.resize((new_mask_width, new_mask_height))
+
+            w, h = bubble.size
+            crop_dims = (
+                5, 5,
+                5+w, 5+h,
+            )
+            # Uses a mask so that the "L" type bubble is cropped
+            bubble_mask = bubble_mask.crop(crop_dims)
+            speech_bubbles.append((bubble, bubble_mask, location))
+
+        return characters, speech_bubbles
+
+    def create_coco_annotations(self, image_id: int, panel_objects=None):
         """
         A function to create the coco annotations of this page
+
+        :param image_id: ID of the page's COCO image
+
+        :type image_id: int
+
+        :param panel_objects: The characters and speech bubbles of
+        each leaf panel as rendered by render_panel_objects with
+        their segmentations, defaults to None to render them
+
+        :type panel_objects: list, optional
+
+        :return: The COCO image of the page and its annotations
+        :rtype: tuple
         """
         leaf_children = []
         # Get all the panels to be rendered
@@ -191,6 +374,13 @@ class Page(Panel):
         else:
             leaf_children = self.leaf_children
 
+        if panel_objects is None:
+            panel_objects = [
+                self.render_panel_objects(panel, get_segmentations=True)
+                if not panel.no_render else ([], [])
+                for panel in leaf_children
+            ]
+
         image = {
             "id": image_id,
             "file_name": self.name + cfg.output_format,
@@ -202,7 +392,8 @@ class Page(Panel):
 
         annotations = []
 
-        for panel in leaf_children:
+        for panel, (characters, speech_bubbles) in zip(leaf_children,
+                                                        panel_objects):
             if panel.no_render:
                 continue
 
@@ -220,12 +411,10 @@ class Page(Panel):
             else:
                 draw_rect.polygon(rect, fill=255)
 
-            for ch in panel.characters:
-                character_images, character_masks, location = ch.render(get_segmentations=True)
-                
-                for i, (ci, cm) in enumerate(zip(character_images, character_masks)):
+            for _, character_masks, location in characters:
+                for i, cm in enumerate(character_masks):
                     instance_segmentation = Image.new(
-                        '1', (ci.width, ci.height), "white")
+                        '1', (cm.width, cm.height), "white")
                     # Paste to panel segmentation mask
                     page_mask.paste(instance_segmentation, location, cm)
                     # Create character and bubble segmentation masks and annotations
@@ -237,20 +426,7 @@ class Page(Panel):
                     else:
                         bubble_segms.append(object_segm)
 
-            for sb in panel.speech_bubbles:
-                bubble, mask, location = sb.render()
-                # Slightly shift mask so that you get outline for bubbles
-                new_mask_width = mask.size[0]+cfg.bubble_mask_x_increase
-                new_mask_height = mask.size[1]+cfg.bubble_mask_y_increase
-                bubble_mask = mask.resize((new_mask_width, new_mask_height))
-
-                w, h = bubble.size
-                crop_dims = (
-                    5, 5,
-                    5+w, 5+h,
-                )
-                # Uses a mask so that the "L" type bubble is cropped
-                bubble_mask = bubble_mask.crop(crop_dims)
+            for bubble, bubble_mask, location in speech_bubbles:
                 instance_segmentation = Image.new(
                     '1', (bubble.width, bubble.height), "white")
                 # Paste to panel segmentation mask
@@ -317,14 +493,45 @@ class Page(Panel):
         image["height"] = int(self.height)
         return image, annotations
 
-    def render(self, show=False):
+    def get_render_rng(self):
+        """
+        Get the random number generator to render this page with.
+        Pages with a seed always render the same way.
+
+        :return: The generator
+        :rtype: numpy.random.Generator
+        """
+        if self.seed is None:
+            return get_rng()
+
+        seed = np.random.SeedSequence(self.seed, spawn_key=(RENDER_STREAM,))
+        return np.random.default_rng(seed)
+
+    def render(self, show=False, rng=None, image_id=None):
         """
         A function to render this page to an image
 
         :param show: Whether to return this image or to show it
 
         :type show: bool, optional
+
+        :param rng: Random number generator, defaults to None
+        for the one derived from the page's seed
+
+        :type rng: numpy.random.Generator, optional
+
+        :param image_id: ID of the page's COCO image, to also create
+        its annotations from the same renders of the characters and
+        speech bubbles, defaults to None
+
+        :type image_id: int, optional
+
+        :return: The image, and the COCO image and annotations of
+        the page if image_id is set
+        :rtype: PIL.Image or tuple
         """
+        if rng is None:
+            rng = self.get_render_rng()
 
         leaf_children = []
         # if self.num_panels > 1:
@@ -337,95 +544,98 @@ class Page(Panel):
         W = cfg.page_width
         H = cfg.page_height
 
-        boundary_width = np.random.randint(
+        boundary_width = rng.integers(
             cfg.boundary_width_min, cfg.boundary_width_max)
-        boundary_color = (np.random.randint(0, 10), np.random.randint(
-                    0, 10), np.random.randint(0, 10))
+        boundary_color = (rng.integers(0, 10), rng.integers(
+                    0, 10), rng.integers(0, 10))
 
         # Create a new blank image
-        page_img = Image.new(size=(W, H), mode="RGBA")
+        compositor = get_page_compositor()
+        compositor.new_page(W, H)
 
         # Render panels
         for panel in leaf_children:
             if panel.no_render:
                 continue
 
-            panel_img, panel_mask = panel.render(boundary_width, boundary_color)
-            page_img.paste(panel_img, (0, 0), panel_mask)
-
-        # Render characters
-        for panel in leaf_children:
-            if len(panel.characters) < 1 or panel.no_render:
-                continue
-            # For each character
-            for po in panel.characters:
-                image, mask, location = po.render()
-                page_img.paste(image, location, mask)
-
-        # Render bubbles
-        for panel in leaf_children:
-            if len(panel.speech_bubbles) < 1 or panel.no_render:
-                continue
-            # For each bubble
-            for sb in panel.speech_bubbles:
-                bubble, mask, location = sb.render()
-                # Slightly shift mask so that you get outline for bubbles
-                new_mask_width = mask.size[0]+cfg.bubble_mask_x_increase
-                new_mask_height = mask.size[1]+cfg.bubble_mask_y_increase
-                bubble_mask = mask.resize((new_mask_width, new_mask_height))
-
-                w, h = bubble.size
-                crop_dims = (
-                    5, 5,
-                    5+w, 5+h,
-                )
-                # Uses a mask so that the "L" type bubble is cropped
-                bubble_mask = bubble_mask.crop(crop_dims)
-                page_img.paste(bubble, location, bubble_mask)
+            with span("Panel.render", panel.image):
+                panel_img, panel_mask, location = panel.render(
+                    boundary_width, boundary_color, rng)
+            with span("Page.paste_panel"):
+                compositor.paste(panel_img, location, panel_mask)
+
+        # Render the characters and bubbles once for both the page
+        # and its annotations
+        get_segmentations = image_id is not None
+        panel_objects = [
+            self.render_panel_objects(panel, get_segmentations)
+            if not panel.no_render else ([], [])
+            for panel in leaf_children
+        ]
+
+        # Paste characters
+        for characters, _ in panel_objects:
+            for character, _, location in characters:
+                compositor.paste(character, location, character)
+
+        # Paste bubbles
+        for _, speech_bubbles in panel_objects:
+            for bubble, bubble_mask, location in speech_bubbles:
+                compositor.paste(bubble, location, bubble_mask)
+
+        if get_segmentations:
+            with span("Page.create_coco_annotations"):
+                image, annotations = self.create_coco_annotations(
+                    image_id, panel_objects)
 
         if self.transform_rotation is not None and self.transform_rotation != 0:
-            page_img = page_img.rotate(self.transform_rotation, expand=True)
-            self.width, self.height = page_img.size
+            compositor.rotate(self.transform_rotation)
+            self.width, self.height = compositor.size
 
-        W, H = page_img.size
+        W, H = compositor.size
 
         # Set background if needed
         if self.background is not None:
             if self.background == "#color":
                 # TODO: Parameterize
-                bg = np.zeros([H, W, 3], dtype=np.uint8)
-                if np.random.random() < cfg.background_add_chance:
-                    bg[:, :, :] = (np.random.randint(0, 255), np.random.randint(
-                        0, 255), np.random.randint(0, 255))
+                if rng.random() < cfg.background_add_chance:
+                    bg = (rng.integers(0, 255), rng.integers(
+                        0, 255), rng.integers(0, 255))
                 else:
-                    bg[:, :, :] = (np.random.randint(245, 255), np.random.randint(
-                        245, 255), np.random.randint(245, 255))
-                crop_array = bg
+                    bg = (rng.integers(245, 255), rng.integers(
+                        245, 255), rng.integers(245, 255))
             else:
-                bg = Image.open(self.background).convert("RGB")
-                crop_array = crop_image_only_outside(bg)
+                with span("Page.load_background", self.background):
+                    bg = load_image(self.background, "RGB", crop=True,
+                                    draft_size=cfg.page_size)
 
-            bg = Image.fromarray(crop_array)
-            bg = bg.resize((W, H))
-            bg.paste(page_img, (0, 0), page_img)
-            page_img = bg
+            with span("Page.background", self.background):
+                if isinstance(bg, Image.Image):
+                    bg = bg.resize((W, H))
+                compositor.put_on_background(bg)
 
         # Add noise
-        noise = add_noise(blank_image(
-                    W, H), sigma=self.transform_noise)
-        page_img_arr = np.multiply(np.asarray(page_img), noise/255.0)
-        page_img = Image.fromarray(page_img_arr.astype(np.uint8))
+        with span("Page.noise"):
+            compositor.multiply(noise_levels(
+                        W, H, sigma=self.transform_noise, rng=rng))
         
         # Add texture
-        if np.random.rand() < cfg.texture_probability:
-            texture_path = random.choice(cfg.texture_images)
-            texture = Image.open(texture_path).convert("RGBA")
-            # texture = texture.rotate(np.random.randint(-15, 15))
-            texture = texture.resize((W, H))
-            texture_mask = Image.new(mode="L", size=(W, H), color=np.random.randint(125, 245))
-            page_img = Image.composite(page_img, texture, texture_mask)
-
+        if rng.random() < cfg.texture_probability:
+            texture_path = rng.choice(cfg.texture_images)
+            with span("Page.texture", str(texture_path)):
+                # Textures are kept at the page size by the image cache,
+                # and only rotated pages need them resized again
+                texture = load_image(str(texture_path), compositor.mode,
+                                     size=cfg.page_size)
+                # texture = texture.rotate(np.random.randint(-15, 15))
+                if texture.size != (W, H):
+                    texture = texture.resize((W, H))
+                compositor.blend(texture, int(rng.integers(125, 245)))
+
+        page_img = compositor.get_image()
         if show:
             page_img.show()
+        elif get_segmentations:
+            return page_img, image, annotations
         else:
             return page_img
@@ -6,11 +6,80 @@ import skimage
 from PIL import Image, ImageDraw
 from scipy import ndimage
 from src.layout_engine.page_objects.character import Character
-from src.layout_engine.helpers import crop_image_only_outside
+from src.layout_engine.helpers import get_rng
+from src.layout_engine.tracing import span
+from src.layout_engine.image_cache import load_image
 from ... import config_file as cfg
 from .speech_bubble import SpeechBubble
 
 
+class DrawableArea(object):
+    """
+    The points of a panel where objects can be placed. They're either
+    every point of a rectangle or a subset of them given by their
+    flat indices within the rectangle.
+
+    :param x: x coordinate of the rectangle's top left corner
+
+    :type x: int
+
+    :param y: y coordinate of the rectangle's top left corner
+
+    :type y: int
+
+    :param width: Width of the rectangle
+
+    :type width: int
+
+    :param height: Height of the rectangle
+
+    :type height: int
+
+    :param indices: Flat indices of the points within the rectangle,
+    defaults to None which means all of them
+
+    :type indices: numpy.ndarray, optional
+    """
+
+    __slots__ = ("x", "y", "width", "height", "indices")
+
+    def __init__(self, x, y, width, height, indices=None):
+        """
+        Constructor method
+        """
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.indices = indices
+
+    def __len__(self):
+        if self.indices is None:
+            return self.width * self.height
+
+        return len(self.indices)
+
+    def sample(self, rng=None):
+        """
+        Pick a random point of the area
+
+        :param rng: Random number generator, defaults to None
+        for an unseeded one
+
+        :type rng: numpy.random.Generator, optional
+
+        :return: x and y coordinates of the point
+        :rtype: tuple
+        """
+        idx = get_rng(rng).integers(0, len(self))
+
+        if self.indices is not None:
+            idx = self.indices[idx]
+
+        row, col = divmod(int(idx), self.width)
+        return self.x + col, self.y + row
+
+
 class Panel(object):
     """
     A class to encapsulate a panel of the manga page.
@@ -45,6 +114,30 @@ class Panel(object):
     :type non_rect: bool, optional
     """
 
+    __slots__ = (
+        "x1y1",
+        "x2y2",
+        "x3y3",
+        "x4y4",
+        "name",
+        "parent",
+        "coords",
+        "non_rect",
+        "circular",
+        "width",
+        "height",
+        "area",
+        "area_proportion",
+        "children",
+        "orientation",
+        "sliced",
+        "no_render",
+        "image",
+        "speech_bubbles",
+        "characters",
+        "drawable_area",
+    )
+
     next_panel_id: int = 0
 
     def __init__(self,
@@ -66,13 +159,6 @@ class Panel(object):
         self.x3y3 = coords[2]
         self.x4y4 = coords[3]
 
-        self.lines = [
-            (self.x1y1, self.x2y2),
-            (self.x2y2, self.x3y3),
-            (self.x3y3, self.x4y4),
-            (self.x4y4, self.x1y1)
-        ]
-
         self.name = name
         self.parent = parent
 
@@ -173,24 +259,76 @@ class Panel(object):
         ]
         self.refresh_size()
 
+    def is_axis_aligned_rect(self) -> bool:
+        """
+        Whether the panel's polygon is a rectangle whose sides
+        are parallel to the page's
+
+        :return: If the panel is an axis aligned rectangle
+        :rtype: bool
+        """
+        corners = set(tuple(coord) for coord in self.coords)
+        xs = set(x for x, _ in corners)
+        ys = set(y for _, y in corners)
+        return len(corners) == 4 and len(xs) == 2 and len(ys) == 2
+
     def refresh_drawable_area(self):
+        """
+        Compute the area of the panel where objects can be placed.
+        It's the panel's polygon eroded by a fifth of the panel's
+        height and width. Rectangles are eroded analytically,
+        other polygons are rasterized within their bounding box.
+        """
         c, r = zip(*self.coords)
         c = [e-1 for e in c]; r = [e-1 for e in r]
-        rr, cc = skimage.draw.polygon(r, c)
-        img = np.zeros((cfg.page_height, cfg.page_width), np.uint8)
+        r_structure = max(int(self.height//5), 1)
+        c_structure = max(int(self.width//5), 1)
+
+        if self.is_axis_aligned_rect():
+            row_min = max(int(np.ceil(min(r))), 0)
+            row_max = min(int(np.floor(max(r))), cfg.page_height - 1)
+            col_min = max(int(np.ceil(min(c))), 0)
+            col_max = min(int(np.floor(max(c))), cfg.page_width - 1)
+
+            # Eroding a rectangle only moves its sides inwards
+            row_min += r_structure//2
+            row_max -= (r_structure - 1) - r_structure//2
+            col_min += c_structure//2
+            col_max -= (c_structure - 1) - c_structure//2
+
+            self.drawable_area = DrawableArea(
+                col_min,
+                row_min,
+                max(col_max - col_min + 1, 0),
+                max(row_max - row_min + 1, 0)
+            )
+            return
+
+        row_min = max(int(np.floor(min(r))), 0)
+        row_max = min(int(np.ceil(max(r))), cfg.page_height - 1)
+        col_min = max(int(np.floor(min(c))), 0)
+        col_max = min(int(np.ceil(max(c))), cfg.page_width - 1)
+        shape = (max(row_max - row_min + 1, 0), max(col_max - col_min + 1, 0))
+
+        rr, cc = skimage.draw.polygon(np.array(r) - row_min,
+                                      np.array(c) - col_min,
+                                      shape=shape)
+        img = np.zeros(shape, np.uint8)
         img[rr, cc] = 1
-        r_structure = (max(int(self.height//5), 1), 1)
-        c_structure = (1, max(int(self.width//5), 1))
         img = ndimage.binary_erosion(
-            ndimage.binary_erosion(img, structure=np.ones(r_structure)),
-            structure=np.ones(c_structure))
-        self.drawable_area = np.where(img == 1)
+            ndimage.binary_erosion(img, structure=np.ones((r_structure, 1))),
+            structure=np.ones((1, c_structure)))
+
+        self.drawable_area = DrawableArea(
+            col_min,
+            row_min,
+            shape[1],
+            shape[0],
+            np.flatnonzero(img).astype(np.int32)
+        )
 
-    def get_random_coords(self):
-        rr, cc = self.drawable_area
-        random_index = np.random.choice(list(range(len(rr))))
-        random_point = (rr[random_index], cc[random_index])
-        return int(random_point[1]), int(random_point[0])
+    def get_random_coords(self, rng=None):
+        return self.drawable_area.sample(rng)
 
     def get_center(self):
         r, c = zip(*self.coords)
@@ -327,21 +465,77 @@ class Panel(object):
 
         self.children = children
 
-    def render(self, boundary_width, boundary_color):
-        # Panel coords
-        rect = self.get_polygon()
+    def get_render_box(self, boundary_width):
+        """
+        Get the area of the page the panel is drawn in,
+        its bounding box with room for its outline, cut
+        to the page
+
+        :param boundary_width: Width of the panel's outline
+
+        :type boundary_width: int
+
+        :return: The area's top left corner and its size
+        :rtype: tuple
+        """
+        points = list(self.get_polygon()) + [self.x1y1, self.x3y3]
+        bounding_box = self.get_bounding_box()
+        xs = [p[0] for p in points] + [bounding_box[0], bounding_box[2]]
+        ys = [p[1] for p in points] + [bounding_box[1], bounding_box[3]]
+
+        margin = int(boundary_width) + 2
+        x1 = max(int(np.floor(min(xs))) - margin, 0)
+        y1 = max(int(np.floor(min(ys))) - margin, 0)
+        x2 = min(int(np.ceil(max(xs))) + margin, cfg.page_width)
+        y2 = min(int(np.ceil(max(ys))) + margin, cfg.page_height)
+
+        return (x1, y1), (max(x2 - x1, 1), max(y2 - y1, 1))
+
+    def render(self, boundary_width, boundary_color, rng=None):
+        """
+        A function to render this panel. It's drawn in an
+        image the size of its area of the page instead of
+        the whole page.
+
+        :param boundary_width: Width of the panel's outline
+
+        :type boundary_width: int
+
+        :param boundary_color: Color of the panel's outline
+
+        :type boundary_color: tuple
+
+        :param rng: Random number generator, defaults to None
+        for an unseeded one
+
+        :type rng: numpy.random.Generator, optional
+
+        :return: The panel, its mask and its location on the page
+        :rtype: tuple
+        """
+        rng = get_rng(rng)
+
+        # Panel coords relative to the area it's drawn in
+        location, size = self.get_render_box(boundary_width)
+        x_offset, y_offset = location
+        rect = tuple((x - x_offset, y - y_offset)
+                     for x, y in self.get_polygon())
+        ellipse = (self.x3y3[0] - x_offset, self.x3y3[1] - y_offset,
+                   self.x1y1[0] - x_offset, self.x1y1[1] - y_offset)
 
         # Open the illustration to put within panel
         if self.image is not None:
-            img = Image.open(self.image).convert("RGB")
-            # Clean it up by cropping the black areas
-            crop_array = crop_image_only_outside(img)
-            img = Image.fromarray(crop_array)
+            with span("Panel.load", self.image):
+                # Cleaned up by cropping the black areas
+                img = load_image(self.image, "RGB", crop=True,
+                                 draft_size=cfg.page_size)
         else:
             img = Image.new("RGBA", cfg.page_size, (0,0,0,0))
 
-        bounding_box = self.get_bounding_box()
-        composite_img = Image.new("RGBA", cfg.page_size, (0, 0, 0, 0))
+        xmin, ymin, xmax, ymax = self.get_bounding_box()
+        bounding_box = (xmin - x_offset, ymin - y_offset,
+                        xmax - x_offset, ymax - y_offset)
+        composite_img = Image.new("RGBA", size, (0, 0, 0, 0))
         image_h = int(self.height)
 
         # reisize panel
@@ -355,47 +549,51 @@ class Panel(object):
             new_width = round(new_height * aspect_ratio)
 
             if new_width > self.width:
-                crop_width = np.random.randint(0, new_width - int(self.width))
+                crop_width = rng.integers(0, new_width - int(self.width))
         else:
             new_width = int(self.width)
             new_height = round(new_width / aspect_ratio)
 
             if new_height > image_h:
-                crop_heigth = np.random.randint(0, new_height - image_h)
-
-        img = img.resize((new_width, new_height))
-        img = img.crop((
-            crop_width,
-            crop_heigth,
-            int(self.width) + crop_width,
-            image_h + crop_heigth
-        ))
-
-        composite_img.paste(img, tuple(bounding_box))
+                crop_heigth = rng.integers(0, new_height - image_h)
+
+        with span("Panel.resize", self.image):
+            # Only the part of the image shown in the panel
+            # is resized
+            x_scale = new_width / w
+            y_scale = new_height / h
+            img = img.resize((int(self.width), image_h), box=(
+                crop_width / x_scale,
+                crop_heigth / y_scale,
+                min((int(self.width) + crop_width) / x_scale, w),
+                min((image_h + crop_heigth) / y_scale, h)
+            ))
+
+            composite_img.paste(img, tuple(bounding_box))
 
         # Create a mask for the panel illustration
-        mask = Image.new("L", cfg.page_size, 0)
+        mask = Image.new("L", size, 0)
         draw_mask = ImageDraw.Draw(mask)
 
         # On the mask draw and therefore cut out the panel's
         # area so that the illustration can be fit into
         # the page itself
         if self.circular:
-            draw_mask.ellipse((*self.x3y3, *self.x1y1), fill=255)
+            draw_mask.ellipse(ellipse, fill=255)
         else:
             draw_mask.polygon(rect, fill=255)
 
-        if np.random.random() < 0.9:
+        if rng.random() < 0.9:
             # Draw outline
             line_rect = list(rect) + [rect[0]]
             draw_img = ImageDraw.Draw(composite_img)
 
             if self.circular:
-                draw_img.ellipse((*self.x3y3, *self.x1y1),
+                draw_img.ellipse(ellipse,
                                  outline=boundary_color,
                                  width=boundary_width
                                  )
-                draw_mask.ellipse((*self.x3y3, *self.x1y1),
+                draw_mask.ellipse(ellipse,
                                   outline=255,
                                   width=boundary_width
                                   )
@@ -411,6 +609,6 @@ class Panel(object):
                                joint="curve"
                                )
 
-        final_mask = Image.new("RGBA", cfg.page_size, (0, 0, 0, 0))
+        final_mask = Image.new("RGBA", size, (0, 0, 0, 0))
         final_mask.paste(composite_img, mask=mask)
-        return composite_img, final_mask
+        return composite_img, final_mask, location
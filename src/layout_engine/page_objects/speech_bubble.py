@@ -1,8 +1,127 @@
+import re
+import functools
 import numpy as np
 import cjkwrap
 
 from PIL import Image, ImageDraw, ImageFont, ImageOps
 from ... import config_file as cfg
+from ..helpers import boxes_overlap, get_rng
+from ..tracing import span
+from ..image_cache import load_image
+
+
+# The last character of a word followed by whitespace
+WORD_END = re.compile(r"\S\s")
+
+
+@functools.lru_cache(maxsize=cfg.font_cache_size)
+def load_font(font_path, font_size):
+    """
+    Load a font at a size. Each worker keeps the most recently
+    used ones, since font files are parsed when loaded and the
+    same fonts are used by many bubbles.
+
+    :param font_path: Path of the font file
+
+    :type font_path: str
+
+    :param font_size: Size of the font
+
+    :type font_size: int
+
+    :return: The font
+    :rtype: PIL.ImageFont.FreeTypeFont
+    """
+    return ImageFont.truetype(font_path, font_size)
+
+
+class GlyphMetrics(object):
+    """
+    Measures text by adding up the advance widths of its glyphs
+    and taking the tallest of them, measuring each glyph of a font
+    at a size only once. Kerning is left out, so lines come out
+    at most a few pixels wider or narrower than Pillow measures.
+
+    :param font: The font at the size to measure with
+
+    :type font: PIL.ImageFont.FreeTypeFont
+    """
+
+    def __init__(self, font):
+        """
+        Constructor method
+        """
+        self.font = font
+        self.glyphs = {}
+
+    def get_glyph(self, char):
+        glyph = self.glyphs.get(char)
+        if glyph is None:
+            glyph = (self.font.getlength(char), self.font.getbbox(char)[3])
+            self.glyphs[char] = glyph
+
+        return glyph
+
+    def get_size(self, text):
+        """
+        :return: The width and height of a line of text
+        :rtype: tuple
+        """
+        width = 0
+        height = 0
+        for char in text:
+            advance, bottom = self.get_glyph(char)
+            width += advance
+            height = max(height, bottom)
+
+        return width, height
+
+
+@functools.lru_cache(maxsize=cfg.font_cache_size)
+def get_glyph_metrics(font_path, font_size):
+    """
+    :return: The glyph measurements of a font at a size,
+    shared by every bubble of this worker
+    :rtype: GlyphMetrics
+    """
+    return GlyphMetrics(load_font(font_path, font_size))
+
+
+def wrap_text(text, width, max_lines):
+    """
+    Wrap text into lines of at most width characters with
+    cjkwrap, only wrapping as much of it as it takes to get
+    one line more than max_lines. Since lines are filled
+    greedily, cutting the text between two words leaves all
+    but its last line as they are in the whole text.
+
+    :param text: Text to wrap
+
+    :type text: str
+
+    :param width: Maximum number of characters in a line
+
+    :type width: int
+
+    :param max_lines: Number of lines which are needed
+
+    :type max_lines: int
+
+    :return: The first max_lines lines of the text, followed by
+    more lines if it has more
+    :rtype: list
+    """
+    length = (max_lines + 1)*(width + 1)
+    while True:
+        word_end = WORD_END.search(text, max(0, length - 1))
+        if word_end is None:
+            return cjkwrap.wrap(text, width=width)
+
+        lines = cjkwrap.wrap(text[:word_end.start() + 1], width=width)
+        if len(lines) > max_lines:
+            return lines
+
+        length *= 2
 
 
 class SpeechBubble(object):
@@ -65,8 +184,37 @@ class SpeechBubble(object):
     is written left to right ot top to bottom
 
     :type text_orientation: str, optional
+
+    :param font_size: Size of the font of the text, defaults to
+    None to pick one at random
+
+    :type font_size: int, optional
+
+    :param rng: Random number generator used to pick the
+    transformations and font size, defaults to None for
+    an unseeded one
+
+    :type rng: numpy.random.Generator, optional
     """
 
+    __slots__ = (
+        "texts",
+        "text_indices",
+        "font",
+        "font_size",
+        "speech_bubble",
+        "writing_areas",
+        "resize_to",
+        "width",
+        "height",
+        "orientation",
+        "location",
+        "parent_center_coords",
+        "transform_metadata",
+        "transforms",
+        "text_orientation",
+    )
+
     def __init__(self,
                  texts,
                  text_indices,
@@ -81,10 +229,14 @@ class SpeechBubble(object):
                  resize_to=None,
                  transforms=None,
                  transform_metadata=None,
-                 text_orientation=None):
+                 text_orientation=None,
+                 font_size=None,
+                 rng=None):
         """
         Constructor method
         """
+        if transforms is None or text_orientation is None or font_size is None:
+            rng = get_rng(rng)
 
         self.texts = texts
         # Index of dataframe for the text
@@ -125,28 +277,28 @@ class SpeechBubble(object):
                 ]
 
             # 1 in 50 chance of no transformation
-            if np.random.rand() < 0.98:
-                self.transforms = list(np.random.choice(
+            if rng.random() < 0.98:
+                self.transforms = list(rng.choice(
                     possible_transforms,
                     2,
                     replace=False
                 ))
 
                 # 1 in 20 chance of inversion
-                if np.random.rand() < 0.05:
+                if rng.random() < 0.05:
                     self.transforms.append("invert")
 
                 # TODO: Parametrize stretching
                 if "stretch x" in self.transforms:
                     # Up to 30% stretching
-                    factor = np.random.random()*0.3
+                    factor = rng.random()*0.3
                     self.transform_metadata["stretch_x_factor"] = factor
                 if "stretch y" in self.transforms:
-                    factor = np.random.random()*0.3
+                    factor = rng.random()*0.3
                     self.transform_metadata["stretch_y_factor"] = factor
 
                 if "rotate" in self.transforms:
-                    rotation = np.random.randint(5, 15)
+                    rotation = rng.integers(5, 15)
                     self.transform_metadata["rotation_amount"] = rotation
 
             else:
@@ -156,21 +308,24 @@ class SpeechBubble(object):
 
         if text_orientation is None:
             # 1 in 100 chance
-            if np.random.random() < 1.0:  # 0.01
+            if rng.random() < 1.0:  # 0.01
                 self.text_orientation = "ltr"
             else:
                 self.text_orientation = "ttb"
         else:
             self.text_orientation = text_orientation
 
-        min_font_size = cfg.min_font_size
-        max_font_size = cfg.max_font_size
-        # Change this, make it dynamic
-        self.font_size = np.random.randint(min_font_size,
-                                           max_font_size
-                                           )
+        if font_size is None:
+            min_font_size = cfg.min_font_size
+            max_font_size = cfg.max_font_size
+            # Change this, make it dynamic
+            self.font_size = rng.integers(min_font_size,
+                                          max_font_size
+                                          )
+        else:
+            self.font_size = font_size
 
-    def place_randomly(self, parent, min_ratio: float = 0.3, max_ratio: float = 1.0):
+    def place_randomly(self, parent, min_ratio: float = 0.3, max_ratio: float = 1.0, rng=None):
         """
         A method to place the SpeechBubble in a random location
         inside the parent.
@@ -179,11 +334,17 @@ class SpeechBubble(object):
         be placed
 
         :type  panel: Panel
+
+        :param rng: Random number generator, defaults to None
+        for an unseeded one
+
+        :type rng: numpy.random.Generator, optional
         """
-        new_area = parent.get_area() * (np.random.random() * (max_ratio-min_ratio) + min_ratio )
+        rng = get_rng(rng)
+        new_area = parent.get_area() * (rng.random() * (max_ratio-min_ratio) + min_ratio )
         self.resize_to = new_area
 
-        x_choice, y_choice = parent.get_random_coords()
+        x_choice, y_choice = parent.get_random_coords(rng)
 
         self.location = [
             x_choice,
@@ -202,25 +363,22 @@ class SpeechBubble(object):
         :return: Whether the SpeechBubbles overlap.
         :rtype: bool
         """
-        self_x1, self_y1 = self.location
-        self_x1 /= 2
-        self_y1 /= 2
-        other_x1, other_y1 = other.location
-        other_x1 /= 2
-        other_y1 /= 2
-
-        self_height, self_width = self.get_resized()
-        other_height, other_width = other.get_resized()
+        return boxes_overlap(self.get_overlap_box(), other.get_overlap_box())
 
-        self_x2 = self_x1 + self_width
-        self_y2 = self_y1 + self_height
-        other_x2 = other_x1 + other_width
-        other_y2 = other_y1 + other_height
+    def get_overlap_box(self):
+        """
+        The box used to check whether this SpeechBubble overlaps
+        with other objects
 
-        x_inter = max(0, min(self_x2, other_x2) - max(self_x1, other_x1))
-        y_inter = max(0, min(self_y2, other_y2) - max(self_y1, other_y1))
+        :return: x1, y1, x2, y2 of the box
+        :rtype: tuple
+        """
+        x1, y1 = self.location
+        x1 /= 2
+        y1 /= 2
+        height, width = self.get_resized()
 
-        return x_inter > cfg.overlap_offset and y_inter > cfg.overlap_offset
+        return x1, y1, x1 + width, y1 + height
 
     def get_resized(self):
         if "stretch_x_factor" in self.transform_metadata:
@@ -286,9 +444,29 @@ class SpeechBubble(object):
             orientation=data['orientation'],
             transforms=data['transforms'],
             transform_metadata=data['transform_metadata'],
-            text_orientation=data['text_orientation']
+            text_orientation=data['text_orientation'],
+            font_size=data.get('font_size')
         )
 
+    def get_template_flips(self):
+        """
+        Flips which come before any stretching can be applied to
+        the template itself, so that flipped templates are cached
+
+        :return: Pillow transpose methods of the flips
+        :rtype: tuple
+        """
+        flips = []
+        for transform in self.transforms:
+            if transform == "flip horizontal":
+                flips.append(Image.FLIP_TOP_BOTTOM)
+            elif transform == "flip vertical":
+                flips.append(Image.FLIP_LEFT_RIGHT)
+            elif transform in ("stretch x", "stretch y"):
+                break
+
+        return tuple(flips)
+
     def apply_prerendering_transforms(self, bubble, mask):
         # Center of bubble
         w, h = bubble.size
@@ -297,6 +475,7 @@ class SpeechBubble(object):
         # States is used to indicate whether this bubble is
         # inverted or not to the page render function
         states = []
+        stretched = False
 
         # Pre-rendering transforms
         for transform in self.transforms:
@@ -312,6 +491,7 @@ class SpeechBubble(object):
                 w, h = new_size
                 bubble = bubble.resize(new_size)
                 mask = mask.resize(new_size)
+                stretched = True
 
                 new_writing_areas = []
                 for area in self.writing_areas:
@@ -335,6 +515,7 @@ class SpeechBubble(object):
                 w, h = new_size
                 bubble = bubble.resize(new_size)
                 mask = mask.resize(new_size)
+                stretched = True
 
                 new_writing_areas = []
                 for area in self.writing_areas:
@@ -351,8 +532,10 @@ class SpeechBubble(object):
                 states.append("ystretch")
 
             elif transform == "flip horizontal":
-                bubble = ImageOps.flip(bubble)
-                mask = ImageOps.flip(mask)
+                # Flips before any stretching come with the template
+                if stretched:
+                    bubble = ImageOps.flip(bubble)
+                    mask = ImageOps.flip(mask)
                 # TODO: vertically flip box coordinates
                 new_writing_areas = []
                 for area in self.writing_areas:
@@ -372,8 +555,9 @@ class SpeechBubble(object):
                 states.append("vflip")
 
             elif transform == "flip vertical":
-                bubble = ImageOps.mirror(bubble)
-                mask = ImageOps.mirror(mask)
+                if stretched:
+                    bubble = ImageOps.mirror(bubble)
+                    mask = ImageOps.mirror(mask)
                 new_writing_areas = []
                 for area in self.writing_areas:
                     og_width = area['original_width']
@@ -394,12 +578,92 @@ class SpeechBubble(object):
 
         return bubble, mask, (w, h), states
 
+    def fit_text(self, text, font_size, min_font_size,
+                 wrap_length, stack_length):
+        """
+        Find the largest font size, from min_font_size up to
+        font_size, at which the text wrapped into lines of
+        wrap_length pixels fits in stack_length pixels. Sizes are
+        searched by bisection. When the text doesn't fit even at
+        the smallest size, the lines which don't fit are dropped.
+
+        :param text: Text to fit
+
+        :type text: str
+
+        :param font_size: Largest font size to try
+
+        :type font_size: int
+
+        :param min_font_size: Smallest font size to shrink to
+
+        :type min_font_size: int
+
+        :param wrap_length: Length of the lines in pixels
+
+        :type wrap_length: float
+
+        :param stack_length: Length the lines are stacked
+        along in pixels
+
+        :type stack_length: float
+
+        :return: The font size, the lines of text and the size
+        of the whole text at that font size
+        :rtype: tuple
+        """
+        wrapped = {}
+
+        def wrap_at(size):
+            if size not in wrapped:
+                metrics = get_glyph_metrics(self.font, size)
+                text_size = metrics.get_size(text)
+
+                max_lines = len(text)
+                if text_size[1] > 0:
+                    max_lines = int(stack_length // text_size[1])
+
+                lines = [text]
+                avg_length = text_size[0]/len(text)
+                max_chars = int(wrap_length // avg_length)
+                if text_size[0] > wrap_length and max_chars > 1:
+                    lines = wrap_text(text, max_chars, max_lines)
+
+                wrapped[size] = (len(lines)*text_size[1] <= stack_length,
+                                 lines, text_size, max_lines)
+
+            return wrapped[size]
+
+        fits, lines, text_size, _ = wrap_at(font_size)
+        if fits:
+            return font_size, lines, text_size
+
+        # Largest size below font_size which fits
+        low, high = min_font_size, font_size - 1
+        best_size = None
+        while low <= high:
+            middle = (low + high) // 2
+            if wrap_at(middle)[0]:
+                best_size = middle
+                low = middle + 1
+            else:
+                high = middle - 1
+
+        if best_size is not None:
+            _, lines, text_size, _ = wrap_at(best_size)
+            return best_size, lines, text_size
+
+        # Nothing fits, so keep as many lines as there's room
+        # for at the smallest size
+        size = min(font_size, min_font_size)
+        _, lines, text_size, max_lines = wrap_at(size)
+
+        return size, lines[:max_lines], text_size
+
     def write_text_to_bubble(self, bubble, states):
         # Set variable font size
-        min_font_size = cfg.max_font_size
-        max_font_size = cfg.max_font_size
-        current_font_size = self.font_size
-        font = ImageFont.truetype(self.font, current_font_size)
+        min_font_size = cfg.min_font_size
+        current_font_size = int(self.font_size)
 
         # Write text into bubble
         write = ImageDraw.Draw(bubble)
@@ -423,88 +687,26 @@ class SpeechBubble(object):
             # write.rectangle(at, outline="black")
 
             # Padded
-            x = og_x + 20
             y = og_y + 20
 
-            # More padding
-            max_x = px_width - 20
-            max_y = px_height - 20
-
             text = self.texts[i]['English']  # ['Japanese']
+            if len(text) < 1:
+                continue
             text = text+text+text+text+text
-            text_segments = [text]
-            size = font.getsize(text)
 
+            # Vertical text is wrapped along the height of the
+            # area and its lines stacked along the width
             if self.text_orientation == "ttb":
-
-                # Setup vertical wrapping
-                avg_height = size[0]/len(text)
-
-                # Maximum chars in line
-                max_chars = int((px_height//avg_height))
-                if size[0] > px_height:
-                    # Using specialized wrapping library
-                    if max_chars > 1:
-                        text_segments = cjkwrap.wrap(text, width=max_chars)
-
+                current_font_size, text_segments, size = self.fit_text(
+                    text, current_font_size, min_font_size,
+                    px_height, px_width)
                 text_max_w = len(text_segments)*size[1]
-
-                is_fit = False
-
-                # Horizontal wrapping
-                # Reduce font or remove words till text fits
-                while not is_fit:
-                    if text_max_w > px_width:
-                        if current_font_size > min_font_size:
-                            current_font_size -= 1
-                            font = ImageFont.truetype(self.font,
-                                                      current_font_size)
-                            size = font.getsize(text)
-                            avg_height = size[0]/len(text)
-                            max_chars = int((max_y//avg_height))
-                            if max_chars > 1:
-                                text_segments = cjkwrap.wrap(text,
-                                                             width=max_chars)
-
-                            text_max_w = len(text_segments)*size[1]
-                        else:
-                            text_segments.pop()
-                            text_max_w = len(text_segments)*size[1]
-                    else:
-                        is_fit = True
-
-            # if text left to right
             else:
-                pass
-                # Setup horizontal wrapping
-                avg_width = size[0]/len(text)
-                max_chars = int((px_width//avg_width))
-                if size[0] > px_width:
-                    # Using specialized wrapping library
-                    if max_chars > 1:
-                        text_segments = cjkwrap.wrap(text, width=max_chars)
-
-                # Setup vertical wrapping
-                text_max_h = len(text_segments)*size[1]
-                is_fit = False
-                while not is_fit:
-                    if text_max_h > px_height:
-                        if current_font_size > min_font_size:
-                            current_font_size -= 1
-                            font = ImageFont.truetype(self.font,
-                                                      current_font_size)
-                            size = font.getsize(text)
-                            avg_width = size[0]/len(text)
-                            max_chars = int((px_width//avg_width))
-                            if max_chars > 1:
-                                text_segments = cjkwrap.wrap(text,
-                                                             width=max_chars)
-                            text_max_h = len(text_segments)*size[1]
-                        else:
-                            text_segments.pop()
-                            text_max_h = len(text_segments)*size[1]
-                    else:
-                        is_fit = True
+                current_font_size, text_segments, size = self.fit_text(
+                    text, current_font_size, min_font_size,
+                    px_width, px_height)
+
+            font = load_font(self.font, current_font_size)
 
             # Center bubble x axis
             cbx = og_x + (px_width/2)
@@ -518,8 +720,10 @@ class SpeechBubble(object):
 
                     ry = y
                 else:
-                    seg_size = font.getsize(text)
-                    rx = cbx - seg_size[0]/2
+                    # The few lines written are measured by Pillow, with
+                    # kerning, to place them where getsize did
+                    seg_width = font.getbbox(text)[2]
+                    rx = cbx - seg_width/2
                     ry = ((cby + (len(text_segments)*size[1])/2) -
                           ((len(text_segments) - i)*size[1]))
 
@@ -542,18 +746,25 @@ class SpeechBubble(object):
         :rtype: tuple
         """
 
-        bubble = Image.open(self.speech_bubble).convert("L")
-        mask = bubble.copy()
-        bubble, mask, new_size, states = self.apply_prerendering_transforms(bubble, mask)
-        self.write_text_to_bubble(bubble, states)        
+        with span("SpeechBubble.load", self.speech_bubble):
+            # The template is shared through the image cache, so the
+            # text is written on a copy of it
+            mask = load_image(self.speech_bubble, "L",
+                              transpose=self.get_template_flips())
+            bubble = mask.copy()
+        with span("SpeechBubble.transforms", self.speech_bubble):
+            bubble, mask, new_size, states = self.apply_prerendering_transforms(bubble, mask)
+        with span("SpeechBubble.text", self.font):
+            self.write_text_to_bubble(bubble, states)        
 
         # reisize bubble
         w, h = new_size
         aspect_ratio = w/h
         new_height = max(1, round(np.sqrt(self.resize_to/aspect_ratio)))
         new_width = max(1, round(new_height * aspect_ratio))
-        bubble = bubble.resize((new_width, new_height))
-        mask = mask.resize((new_width, new_height))
+        with span("SpeechBubble.resize", self.speech_bubble):
+            bubble = bubble.resize((new_width, new_height))
+            mask = mask.resize((new_width, new_height))
 
         # perform rotation if it was in transforms
         if "rotate" in self.transforms:
@@ -2,49 +2,135 @@ import pandas
 import numpy as np
 import json
 
-from PIL import Image
+from src.asset_index import AssetIndex
+from src.layout_engine.helpers import get_rng
+from src.layout_engine.tracing import span
 from src.layout_engine.page_objects import SpeechBubble
+from src.layout_engine.text_corpus import TextSampler, as_text_corpus
+
+
+# Fields of a writing area label kept for rendering text
+WRITING_AREA_FIELDS = [
+    "x",
+    "y",
+    "width",
+    "height",
+    "rotation",
+    "original_width",
+    "original_height",
+]
+WRITING_AREA_DTYPE = np.dtype([(field, np.float64)
+                               for field in WRITING_AREA_FIELDS])
 
 
 class SpeechBubbleFactory:
     def __init__(self,
         speech_bubbles_dataset: pandas.DataFrame,
         font_files: list,
-        text_dataset: pandas.DataFrame,
+        text_dataset,
+        asset_index: AssetIndex = None,
     ) -> None:
-        speech_bubble_tags_noriented_index = speech_bubbles_dataset["orientation"].isna()
-        self.speech_bubble_tags_noriented = speech_bubbles_dataset[speech_bubble_tags_noriented_index]
-        speech_bubble_tags_oriented_index = speech_bubbles_dataset["orientation"].apply(isinstance, args=(str,))
-        self.speech_bubble_tags_oriented = speech_bubbles_dataset[speech_bubble_tags_oriented_index]
         self.font_files = font_files
-        self.text_dataset = text_dataset
+        self.text_dataset = as_text_corpus(text_dataset)
+
+        if asset_index is None:
+            asset_index = AssetIndex()
+        self.asset_index = asset_index
+
+        self.compile_templates(speech_bubbles_dataset)
+
+    def compile_templates(self, speech_bubbles_dataset: pandas.DataFrame):
+        """
+        Turn the speech bubble templates into arrays indexed by
+        template id so that creating a bubble doesn't go through
+        pandas or parse JSON
+
+        :param speech_bubbles_dataset: Speech bubble files with their
+        writing area labels and orientation
+
+        :type speech_bubbles_dataset: pandas.DataFrame
+        """
+        self.template_files = list(speech_bubbles_dataset["imagename"])
+        self.template_orientations = speech_bubbles_dataset["orientation"].to_numpy()
+
+        noriented = speech_bubbles_dataset["orientation"].isna().to_numpy()
+        oriented = speech_bubbles_dataset["orientation"].apply(
+            isinstance, args=(str,)).to_numpy()
+        self.noriented_ids = np.flatnonzero(noriented)
+        self.oriented_ids = np.flatnonzero(oriented)
+
+        # Writing areas of all templates in one structured array,
+        # those of template i are in offsets[i]:offsets[i+1]
+        writing_areas = []
+        self.writing_area_offsets = np.zeros(len(self.template_files) + 1,
+                                             dtype=np.int64)
+
+        for i, label in enumerate(speech_bubbles_dataset["label"]):
+            areas = []
+            if isinstance(label, str):
+                areas = json.loads(label)
+
+            for area in areas:
+                writing_areas.append(tuple(float(area.get(field, 0))
+                                           for field in WRITING_AREA_FIELDS))
+
+            self.writing_area_offsets[i+1] = len(writing_areas)
+
+        self.writing_areas = np.array(writing_areas, dtype=WRITING_AREA_DTYPE)
+        self.template_sizes = np.full((len(self.template_files), 2), -1,
+                                      dtype=np.int32)
+
+    def get_template_size(self, template_id: int):
+        if self.template_sizes[template_id, 0] < 0:
+            template_file = self.template_files[template_id]
+            with span("SpeechBubbleFactory.get_size", template_file):
+                self.template_sizes[template_id] = self.asset_index.get_size(
+                    template_file)
+
+        w, h = self.template_sizes[template_id]
+        return int(w), int(h)
+
+    def get_writing_areas(self, template_id: int) -> list:
+        start = self.writing_area_offsets[template_id]
+        stop = self.writing_area_offsets[template_id+1]
+
+        # Fresh dictionaries since rendering modifies them
+        return [dict(zip(WRITING_AREA_FIELDS, area))
+                for area in self.writing_areas[start:stop].tolist()]
+
+    def create_text_sampler(self, rng: np.random.Generator = None):
+        """
+        :return: A sampler of the texts of the speech bubbles of a
+        page, which draws their rows from the page's generator
+        :rtype: TextSampler
+        """
+        return TextSampler(self.text_dataset, get_rng(rng))
+
+    def create(self, template_id: int, parent, rng: np.random.Generator = None,
+               text_sampler: TextSampler = None):
+        rng = get_rng(rng)
 
-    def create(self, sb_sample: pandas.DataFrame, parent):
         # Select a font
         font_dataset_len = len(self.font_files)
-        font_idx = np.random.randint(0, font_dataset_len)
+        font_idx = rng.integers(0, font_dataset_len)
         font = self.font_files[font_idx]
 
-        speech_bubble_file = sb_sample["imagename"].values[0]
+        speech_bubble_file = self.template_files[template_id]
 
-        speech_bubble_writing_area = sb_sample['label'].values[0]
-        assert speech_bubble_writing_area is not None
-        speech_bubble_writing_area = json.loads(speech_bubble_writing_area)
-        speech_orientation = sb_sample['orientation'].values[0]
+        speech_bubble_writing_area = self.get_writing_areas(template_id)
+        speech_orientation = self.template_orientations[template_id]
 
-        # Select text for writing areas
-        text_dataset_len = len(self.text_dataset)
-        texts = []
-        text_indices = []
-        for _ in range(len(speech_bubble_writing_area)):
-            text_idx = np.random.randint(0, text_dataset_len)
-            text_indices.append(text_idx)
-            text = self.text_dataset.iloc[text_idx].to_dict()
-            texts.append(text)
+        # Select text for writing areas. Without the sampler of
+        # a page, the rows of this bubble are looked up on their own.
+        if text_sampler is None:
+            text_sampler = TextSampler(self.text_dataset, rng,
+                                       len(speech_bubble_writing_area))
+        with span("TextSampler.sample"):
+            text_indices, texts = text_sampler.sample(
+                len(speech_bubble_writing_area))
 
         assert speech_bubble_file is not None
-        speech_bubble_img = Image.open(speech_bubble_file)
-        w, h = speech_bubble_img.size
+        w, h = self.get_template_size(template_id)
         # Create speech bubble
         speech_bubble = SpeechBubble(texts=texts,
                                     text_indices=text_indices,
@@ -55,18 +141,21 @@ class SpeechBubbleFactory:
                                     height=h,
                                     orientation=speech_orientation,
                                     parent_center_coords=parent.get_center(),
+                                    rng=rng,
                                     )
 
         return speech_bubble
 
-    def create_with_no_orientation(self, parent):
-        sb_sample = self.speech_bubble_tags_noriented.sample()
-        return self.create(sb_sample, parent)
-    
-    def create_with_orientation(self, parent):
-        sb_sample = self.speech_bubble_tags_oriented.sample()
-        return self.create(sb_sample, parent)
-
-        
+    def create_with_no_orientation(self, parent, rng: np.random.Generator = None,
+                                   text_sampler: TextSampler = None):
+        rng = get_rng(rng)
+        template_id = self.noriented_ids[
+            rng.integers(0, len(self.noriented_ids))]
+        return self.create(template_id, parent, rng, text_sampler)
 
-    
\ No newline at end of file
+    def create_with_orientation(self, parent, rng: np.random.Generator = None,
+                                text_sampler: TextSampler = None):
+        rng = get_rng(rng)
+        template_id = self.oriented_ids[
+            rng.integers(0, len(self.oriented_ids))]
+        return self.create(template_id, parent, rng, text_sampler)
@@ -4,49 +4,105 @@ import json
 from tqdm import tqdm
 
 from .page_objects.page import Page
+from .metadata_store import MetadataStore
+from .run_manifest import RunManifest
+from .task_scheduler import run_in_window
+from .tracing import span, flush_traces, init_tracing, get_trace_dir
 from .. import config_file as cfg
 
 
 def create_single_page(data):
     """
-    This function is used to render a single page from a metadata json file
+    This function is used to render a single page from its metadata
     to a target location.
 
-    :param paths:  a tuple of the page metadata and output path
+    :param data: a tuple of the page metadata
     as well as whether or not to save the rendered file i.e. dry run or
     wet run
 
-    :type paths: tuple
+    :type data: tuple
     """
-    metadata = os.path.join(cfg.METADATA_DIR, data[0])
+    metadata = data[0]
     dry = data[1]
 
-    page = Page()
-    page.load_data(metadata)
+    with span("Page.load_dict"):
+        page = Page()
+        page.load_dict(metadata, leaves_only=True)
     image_filename = os.path.join(cfg.IMAGES_DIR, page.name+cfg.output_format)
 
-    if not os.path.isfile(image_filename) and not dry:
-        img = page.render()
-        img.save(image_filename)
+    if not dry:
+        with span("Page.render"):
+            img = page.render()
+        with span("Page.save"):
+            img.save(image_filename)
 
 
-def render_pages(dry=False):
+def render_page_batch(data):
+    """
+    Render a batch of pages of a metadata shard
+
+    :param data: a tuple of the shard, the manifest entries of
+    the pages and whether it's a dry run
+
+    :type data: tuple
+
+    :return: Indices of the pages which were rendered and
+    number of pages of the batch
+    :rtype: tuple
     """
-    Takes metadata json files and renders page images
+    shard, entries, dry = data
+    store = MetadataStore(cfg.METADATA_DIR)
+    rendered = []
+
+    records = store.read_records(store.get_shard_path(shard),
+                                 [entry[1:] for entry in entries])
+    for entry, metadata in zip(entries, records):
+        try:
+            create_single_page((metadata, dry))
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt()
+        except Exception:
+            print(f"ERROR: Could not render page {entry[1]}. Continuing...")
+            continue
 
-    :param metadata_dir: A directory containing all the metadata json files
+        rendered.append(entry[0])
 
-    :type metadata_dir: str
+    flush_traces()
 
-    :param images_dir: The output directory for the rendered pages
+    return rendered, len(entries)
 
-    :type images_dir: str
+
+def render_pages(dry=False):
+    """
+    Renders the pages of the metadata store which the run
+    manifest doesn't list as rendered from their current
+    metadata
+
+    :param dry: Whether to skip saving the rendered pages
+
+    :type dry: bool, optional
     """
+    manifest = RunManifest(cfg.MANIFEST_PATH)
+    manifest.import_json_pages(cfg.METADATA_DIR)
+    n_pages = manifest.count_pending("rendered")
+    failed = 0
+    batches = ((shard, entries, dry) for shard, entries
+               in manifest.iter_pending("rendered", cfg.METADATA_BATCH_SIZE))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=cfg.CONCURRENT_MAX_WORKERS,
+                                                initializer=init_tracing,
+                                                initargs=(get_trace_dir(),)) as executor:
+        with tqdm(total=n_pages) as pbar:
+            for rendered, batch_size in run_in_window(executor,
+                                                      render_page_batch,
+                                                      batches,
+                                                      cfg.MAX_IN_FLIGHT_TASKS):
+                if not dry:
+                    manifest.set_rendered(rendered)
+                failed += batch_size - len(rendered)
+                pbar.update(batch_size)
 
-    filenames = [(filename, dry, )
-                 for filename in os.listdir(cfg.METADATA_DIR)
-                 if filename.endswith(".json")]
+    manifest.close()
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=cfg.CONCURRENT_MAX_WORKERS) as executor:
-        results = list(tqdm(executor.map(create_single_page, filenames),
-                            total=len(filenames)))
+    if failed > 0:
+        print(f"Could not render {failed} out of {n_pages} pages")
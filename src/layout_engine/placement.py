@@ -0,0 +1,163 @@
+from collections import defaultdict
+
+import src.config_file as cfg
+from src.layout_engine.helpers import boxes_overlap
+
+
+class UniformGrid(object):
+    """
+    A spatial index of boxes which buckets them by the
+    cells of a uniform grid they touch
+
+    :param cell_size: Width and height of a grid cell
+
+    :type cell_size: int
+    """
+
+    def __init__(self, cell_size):
+        """
+        Constructor method
+        """
+        self.cell_size = cell_size
+        self.boxes = []
+        self.cells = defaultdict(list)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def get_cells(self, box):
+        x1, y1, x2, y2 = box
+        for cx in range(int(x1 // self.cell_size),
+                        int(x2 // self.cell_size) + 1):
+            for cy in range(int(y1 // self.cell_size),
+                            int(y2 // self.cell_size) + 1):
+                yield cx, cy
+
+    def insert(self, box):
+        """
+        Add a box to the index
+
+        :param box: x1, y1, x2, y2 of the box
+
+        :type box: tuple
+        """
+        box_id = len(self.boxes)
+        self.boxes.append(box)
+        for cell in self.get_cells(box):
+            self.cells[cell].append(box_id)
+
+    def query(self, box):
+        """
+        Get the boxes which share a cell with a box
+
+        :param box: x1, y1, x2, y2 of the box
+
+        :type box: tuple
+
+        :return: Candidate boxes which may intersect the box
+        :rtype: list
+        """
+        box_ids = set()
+        for cell in self.get_cells(box):
+            box_ids.update(self.cells.get(cell, ()))
+
+        return [self.boxes[box_id] for box_id in box_ids]
+
+
+class PlacementEngine(object):
+    """
+    Places the characters and speech bubbles of a panel so
+    they don't overlap. When a placement collides with an
+    object already placed or is too small, a new position
+    and size are tried until the attempts run out.
+
+    :param max_attempts: Number of positions to try per object,
+    defaults to cfg.placement_max_attempts
+
+    :type max_attempts: int, optional
+    """
+
+    def __init__(self, max_attempts=None):
+        """
+        Constructor method
+        """
+        if max_attempts is None:
+            max_attempts = cfg.placement_max_attempts
+
+        self.max_attempts = max_attempts
+        self.grid = UniformGrid(cfg.placement_grid_cell_size)
+
+        # Objects asked to be placed, objects placed
+        # and positions tried
+        self.requested = 0
+        self.placed = 0
+        self.attempts = 0
+
+    def overlaps(self, box):
+        """
+        Whether a box overlaps any box placed so far
+
+        :param box: x1, y1, x2, y2 of the box
+
+        :type box: tuple
+
+        :return: If the box overlaps a placed box
+        :rtype: bool
+        """
+        for other in self.grid.query(box):
+            if boxes_overlap(box, other):
+                return True
+
+        return False
+
+    def place(self, page_object, place_randomly, min_size):
+        """
+        Try to place an object
+
+        :param page_object: A Character or SpeechBubble
+
+        :type page_object: Character or SpeechBubble
+
+        :param place_randomly: Function that gives the object
+        a new random position and size
+
+        :type place_randomly: callable
+
+        :param min_size: Minimum height and width of the object
+
+        :type min_size: int
+
+        :return: Whether the object was placed
+        :rtype: bool
+        """
+        self.requested += 1
+
+        for _ in range(self.max_attempts):
+            self.attempts += 1
+            place_randomly()
+
+            hr, wr = page_object.get_resized()
+            if hr < min_size or wr < min_size:
+                continue
+
+            box = page_object.get_overlap_box()
+            if self.overlaps(box):
+                continue
+
+            self.grid.insert(box)
+            self.placed += 1
+            return True
+
+        return False
+
+    def get_stats(self):
+        """
+        :return: Number of objects requested, placed and
+        of positions tried
+        :rtype: dict
+        """
+        return dict(
+            requested=self.requested,
+            placed=self.placed,
+            attempts=self.attempts
+        )
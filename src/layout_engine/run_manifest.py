@@ -0,0 +1,315 @@
+import os
+import json
+import sqlite3
+from itertools import groupby
+
+import numpy as np
+
+from src.layout_engine.helpers import to_builtin
+from src.layout_engine.metadata_store import MetadataStore
+
+
+STAGES = ("rendered", "annotated")
+
+
+class RunManifest(object):
+    """
+    Keeps track of which pages of the dataset have been created,
+    rendered and annotated in an SQLite database, so that every
+    stage only works on the pages that are missing or whose
+    metadata changed since, and can resume after a crash.
+
+    Pages are numbered by their index in the dataset, which
+    also gives their seed and their COCO image id. A page's
+    metadata version is where its record is in the metadata
+    store, and a stage is done for a page if it was done for
+    the current version.
+
+    :param path: Path of the database
+
+    :type path: str
+    """
+
+    def __init__(self, path):
+        """
+        Constructor method
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                page_index INTEGER PRIMARY KEY,
+                name TEXT,
+                shard TEXT,
+                offset INTEGER,
+                length INTEGER,
+                rendered TEXT,
+                annotated TEXT,
+                image TEXT,
+                annotations TEXT
+            );
+            CREATE TABLE IF NOT EXISTS failed_pages (
+                page_index INTEGER PRIMARY KEY,
+                attempts INTEGER
+            );
+        """)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def get_base_seed(self):
+        """
+        Get the seed the pages are created from, choosing
+        one the first time
+
+        :return: The seed
+        :rtype: int
+        """
+        row = self.connection.execute(
+            "SELECT value FROM settings WHERE key = 'base_seed'").fetchone()
+
+        if row is not None:
+            return int(row[0])
+
+        base_seed = int(np.random.SeedSequence().generate_state(1)[0])
+        self.connection.execute(
+            "INSERT INTO settings VALUES ('base_seed', ?)", (str(base_seed),))
+        self.connection.commit()
+
+        return base_seed
+
+    def get_missing_pages(self, n_pages):
+        """
+        :param n_pages: Number of pages the dataset should have
+
+        :type n_pages: int
+
+        :return: Indices of the first n_pages pages that weren't created
+        :rtype: list
+        """
+        created = set(row[0] for row in self.connection.execute(
+            "SELECT page_index FROM pages WHERE page_index < ?", (n_pages,)))
+
+        return [i for i in range(n_pages) if i not in created]
+
+    def get_attempts(self, page_indices):
+        """
+        :param page_indices: Indices of pages
+
+        :type page_indices: list
+
+        :return: How many times creating each page failed before
+        :rtype: list
+        """
+        failed = dict(self.connection.execute(
+            "SELECT page_index, attempts FROM failed_pages"))
+
+        return [failed.get(i, 0) for i in page_indices]
+
+    def add_failed_pages(self, page_indices):
+        """
+        Record pages which couldn't be created, so that they're
+        tried with another seed the next time
+
+        :param page_indices: Indices of the pages
+
+        :type page_indices: list
+        """
+        self.connection.executemany(
+            "INSERT INTO failed_pages VALUES (?, 1) ON CONFLICT (page_index) "
+            "DO UPDATE SET attempts = attempts + 1",
+            [(i,) for i in page_indices])
+        self.connection.commit()
+
+    def add_pages(self, statuses):
+        """
+        Record pages which were created
+
+        :param statuses: Status records of the pages with their
+        index, name and metadata shard entry, and their COCO
+        image and annotations if they were annotated too
+
+        :type statuses: list
+        """
+        rows = []
+        for status in statuses:
+            shard = offset = length = None
+            if status.get("metadata") is not None:
+                shard, offset, length = status["metadata"]
+
+            # Pages rendered and annotated along with their creation
+            version = get_version(shard, offset)
+            rendered = version if status.get("rendered") else None
+            annotated = image = annotations = None
+            if status.get("annotations") is not None:
+                annotated = version
+                image = json.dumps(status["image"], default=to_builtin)
+                annotations = json.dumps(status["annotations"],
+                                         default=to_builtin)
+
+            rows.append((status["index"], status["name"], shard, offset,
+                         length, rendered, annotated, image, annotations))
+
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows)
+        self.connection.commit()
+
+    def import_json_pages(self, metadata_dir):
+        """
+        Move the metadata of pages written as one JSON file each,
+        as it was before there was a metadata store, into the store
+        in the same folder and record them as created, so that the
+        other stages pick them up. They're given the indices after
+        the last page and the files are removed once they're in.
+
+        :param metadata_dir: Folder of the metadata store
+
+        :type metadata_dir: str
+
+        :return: Number of pages imported
+        :rtype: int
+        """
+        if not os.path.isdir(metadata_dir):
+            return 0
+
+        filenames = sorted(filename for filename in os.listdir(metadata_dir)
+                           if filename.endswith(".json"))
+        if len(filenames) < 1:
+            return 0
+
+        print(f"Importing the metadata of {len(filenames)} pages "
+              f"from JSON files into the metadata store")
+
+        # Pages of an import that was cut short after they were
+        # recorded are only left to be removed
+        names = set(row[0] for row in self.connection.execute(
+            "SELECT name FROM pages"))
+        next_index = self.connection.execute(
+            "SELECT COALESCE(MAX(page_index) + 1, 0) FROM pages").fetchone()[0]
+
+        store = MetadataStore(metadata_dir)
+        statuses = []
+        for filename in filenames:
+            with open(os.path.join(metadata_dir, filename), "rb") as json_file:
+                data = json.load(json_file)
+
+            if data["name"] in names:
+                continue
+
+            statuses.append(dict(index=next_index + len(statuses),
+                                 name=data["name"],
+                                 metadata=store.write(data["name"], data)))
+        store.close()
+
+        self.add_pages(statuses)
+        for filename in filenames:
+            os.remove(os.path.join(metadata_dir, filename))
+
+        return len(statuses)
+
+    def iter_pending(self, stage, batch_size):
+        """
+        Stream the stored pages a stage hasn't been done for
+        in batches of pages of the same shard
+
+        :param stage: "rendered" or "annotated"
+
+        :type stage: str
+
+        :param batch_size: Maximum number of pages in a batch
+
+        :type batch_size: int
+
+        :return: A shard and the page index, name, offset and
+        length of a batch of its pages
+        :rtype: generator
+        """
+        assert stage in STAGES
+
+        cursor = self.connection.execute(f"""
+            SELECT shard, page_index, name, offset, length FROM pages
+            WHERE shard IS NOT NULL
+            AND ({stage} IS NULL OR {stage} != shard || ':' || offset)
+            ORDER BY shard, offset
+        """)
+        # Read it all so the manifest can be written to meanwhile
+        rows = cursor.fetchall()
+
+        for shard, shard_rows in groupby(rows, key=lambda row: row[0]):
+            entries = [row[1:] for row in shard_rows]
+            for start in range(0, len(entries), batch_size):
+                yield shard, entries[start:start+batch_size]
+
+    def count_pending(self, stage):
+        assert stage in STAGES
+
+        return self.connection.execute(f"""
+            SELECT COUNT(*) FROM pages
+            WHERE shard IS NOT NULL
+            AND ({stage} IS NULL OR {stage} != shard || ':' || offset)
+        """).fetchone()[0]
+
+    def set_rendered(self, page_indices):
+        """
+        Record pages which were rendered from their
+        current metadata
+
+        :param page_indices: Indices of the pages
+
+        :type page_indices: list
+        """
+        self.connection.executemany(
+            "UPDATE pages SET rendered = shard || ':' || offset "
+            "WHERE page_index = ?",
+            [(i,) for i in page_indices])
+        self.connection.commit()
+
+    def set_annotated(self, results):
+        """
+        Record the COCO annotations of pages which were
+        annotated from their current metadata
+
+        :param results: The page index, COCO image and
+        annotations of each page
+
+        :type results: list
+        """
+        self.connection.executemany(
+            "UPDATE pages SET annotated = shard || ':' || offset, "
+            "image = ?, annotations = ? WHERE page_index = ?",
+            [(json.dumps(image, default=to_builtin),
+              json.dumps(annotations, default=to_builtin),
+              page_index)
+             for page_index, image, annotations in results])
+        self.connection.commit()
+
+    def get_annotations(self):
+        """
+        :return: The COCO image and annotations of
+        every annotated page
+        :rtype: list
+        """
+        return [(json.loads(image), json.loads(annotations))
+                for image, annotations in self.connection.execute(
+                    "SELECT image, annotations FROM pages "
+                    "WHERE annotated IS NOT NULL ORDER BY page_index")]
+
+
+def get_version(shard, offset):
+    """
+    :return: The metadata version of a page stored at an offset
+    of a shard, or an empty string if its metadata wasn't stored
+    :rtype: str
+    """
+    if shard is None:
+        return ""
+
+    return f"{shard}:{offset}"
@@ -0,0 +1,72 @@
+import concurrent.futures
+
+
+def batch_range(n_items: int, batch_size: int):
+    """
+    Split a range of items into consecutive batches
+
+    :param n_items: Number of items
+
+    :type n_items: int
+
+    :param batch_size: Maximum number of items per batch
+
+    :type batch_size: int
+
+    :return: Generator of (start, stop) index pairs
+    :rtype: generator
+    """
+    for start in range(0, n_items, batch_size):
+        yield start, min(start + batch_size, n_items)
+
+
+def run_in_window(executor, fn, tasks, max_in_flight: int):
+    """
+    Run tasks on an executor keeping at most max_in_flight of them
+    submitted at any time. A new task is submitted as soon as
+    one completes so that the workers never run dry, while
+    the parent doesn't queue up the whole task list at once.
+
+    :param executor: Executor to run the tasks on
+
+    :type executor: concurrent.futures.Executor
+
+    :param fn: Function to call with each task
+
+    :type fn: callable
+
+    :param tasks: Iterable of task arguments, it's consumed lazily
+
+    :type tasks: iterable
+
+    :param max_in_flight: Maximum number of submitted tasks
+    which haven't completed yet
+
+    :type max_in_flight: int
+
+    :return: Generator of task results in order of completion
+    :rtype: generator
+    """
+    tasks = iter(tasks)
+    in_flight = set()
+
+    def submit_next():
+        for task in tasks:
+            in_flight.add(executor.submit(fn, task))
+            return
+
+    for _ in range(max_in_flight):
+        submit_next()
+
+    while in_flight:
+        done, _ = concurrent.futures.wait(
+            in_flight,
+            return_when=concurrent.futures.FIRST_COMPLETED
+        )
+
+        for job in done:
+            in_flight.remove(job)
+            submit_next()
+
+        for job in done:
+            yield job.result()
@@ -0,0 +1,237 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import src.config_file as cfg
+
+
+# Corpora opened by this process keyed by their Arrow file path so
+# that every task a worker runs shares the same memory map
+_open_corpora = {}
+
+
+class TextCorpus(object):
+    """
+    A read-only view of the text dataset backed by an Arrow table.
+    When opened from an Arrow IPC file the table is memory-mapped,
+    so its rows are read straight from the page cache and pickling
+    the corpus only sends its path to the worker processes.
+
+    :param table: Arrow table with one column per language
+
+    :type table: pyarrow.Table
+
+    :param path: Path of the Arrow IPC file the table is mapped from,
+    defaults to None for in-memory tables
+
+    :type path: str, optional
+    """
+
+    def __init__(self, table, path=None):
+        """
+        Constructor method
+        """
+        self.table = table
+        self.path = path
+        self.columns = [column for column in cfg.text_dataset_columns
+                        if column in table.column_names]
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __reduce__(self):
+        # Memory-mapped corpora are re-opened by path on the other side
+        # instead of having their whole table pickled
+        if self.path is not None:
+            return (TextCorpus.open, (self.path,))
+
+        return (TextCorpus, (self.table,))
+
+    def get_row(self, idx):
+        """
+        Get a row of the corpus as a dictionary of column to text
+
+        :param idx: Index of the row
+
+        :type idx: int
+
+        :return: The row's texts keyed by column name
+        :rtype: dict
+        """
+        return {column: self.table.column(column)[idx].as_py()
+                for column in self.columns}
+
+    def take(self, indices):
+        """
+        Get several rows of the corpus at once
+
+        :param indices: Indices of the rows
+
+        :type indices: numpy.ndarray
+
+        :return: A list of the rows' texts for each column
+        :rtype: dict
+        """
+        rows = self.table.take(pa.array(indices))
+        return {column: rows.column(column).to_pylist()
+                for column in self.columns}
+
+    @classmethod
+    def open(cls, path):
+        """
+        Memory-map an Arrow IPC file, reusing the mapping if
+        this process already opened it
+
+        :param path: Path to the Arrow IPC file
+
+        :type path: str
+
+        :return: The memory-mapped corpus
+        :rtype: TextCorpus
+        """
+        if path not in _open_corpora:
+            source = pa.memory_map(path, "r")
+            table = pa.ipc.open_file(source).read_all()
+            _open_corpora[path] = cls(table, path)
+
+        return _open_corpora[path]
+
+    @classmethod
+    def from_dataframe(cls, dataframe):
+        """
+        Wrap an in-memory pandas DataFrame of the text dataset
+
+        :param dataframe: The text dataset
+
+        :type dataframe: pandas.DataFrame
+
+        :return: A corpus holding a copy of the DataFrame
+        :rtype: TextCorpus
+        """
+        table = pa.Table.from_pandas(dataframe, preserve_index=False)
+        return cls(table)
+
+    @classmethod
+    def from_parquet(cls, parquet_path, arrow_path):
+        """
+        Open the text dataset as a memory-mapped corpus, converting
+        the Parquet archive to an uncompressed Arrow IPC file first
+        if it doesn't exist or is older than the archive
+
+        :param parquet_path: Path to the Parquet archive of the dataset
+
+        :type parquet_path: str
+
+        :param arrow_path: Where the Arrow IPC file is kept
+
+        :type arrow_path: str
+
+        :return: The memory-mapped corpus
+        :rtype: TextCorpus
+        """
+        if (not os.path.isfile(arrow_path) or
+                os.path.getmtime(arrow_path) < os.path.getmtime(parquet_path)):
+            table = pq.read_table(parquet_path,
+                                  columns=cfg.text_dataset_columns)
+            tmp_path = arrow_path + ".tmp"
+            with pa.OSFile(tmp_path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, arrow_path)
+
+        return cls.open(arrow_path)
+
+
+class TextSampler(object):
+    """
+    Samples random rows of a text corpus for the speech bubbles
+    of a page. Row indices are drawn from the page's random
+    number generator in batches and their texts are read from
+    the Arrow columns in one go, so that a page usually takes
+    a single lookup and each sample is just a slice of a buffer.
+
+    :param corpus: The corpus to sample from
+
+    :type corpus: TextCorpus
+
+    :param rng: Random number generator to draw the rows
+    from, defaults to None for an unseeded one
+
+    :type rng: numpy.random.Generator, optional
+
+    :param batch_size: How many rows to draw at once, defaults
+    to cfg.text_sample_batch_size
+
+    :type batch_size: int, optional
+    """
+
+    def __init__(self, corpus, rng=None, batch_size=None):
+        """
+        Constructor method
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        if batch_size is None:
+            batch_size = cfg.text_sample_batch_size
+
+        self.corpus = corpus
+        self.rng = rng
+        self.batch_size = batch_size
+        self.indices = []
+        self.texts = []
+        self.position = 0
+
+    def refill(self):
+        indices = self.rng.integers(0, len(self.corpus), self.batch_size)
+        columns = self.corpus.take(indices)
+
+        self.indices = indices.tolist()
+        self.texts = [dict(zip(columns.keys(), row))
+                      for row in zip(*columns.values())]
+        self.position = 0
+
+    def sample(self, n):
+        """
+        Sample random rows of the corpus
+
+        :param n: Number of rows
+
+        :type n: int
+
+        :return: The indices of the rows and their texts
+        keyed by column name
+        :rtype: tuple
+        """
+        indices = []
+        texts = []
+
+        while len(indices) < n:
+            if self.position >= len(self.indices):
+                self.refill()
+
+            stop = min(self.position + n - len(indices), len(self.indices))
+            indices += self.indices[self.position:stop]
+            texts += self.texts[self.position:stop]
+            self.position = stop
+
+        return indices, texts
+
+
+def as_text_corpus(text_dataset):
+    """
+    Make sure the text dataset is a TextCorpus, wrapping
+    pandas DataFrames if needed
+
+    :param text_dataset: The text dataset
+
+    :type text_dataset: TextCorpus or pandas.DataFrame
+
+    :return: The text dataset as a corpus
+    :rtype: TextCorpus
+    """
+    if isinstance(text_dataset, pd.DataFrame):
+        return TextCorpus.from_dataframe(text_dataset)
+
+    return text_dataset
@@ -0,0 +1,306 @@
+import os
+import glob
+import json
+import time
+import uuid
+import atexit
+import contextlib
+import pandas as pd
+
+import src.config_file as cfg
+
+
+TRACE_EXTENSION = ".trace"
+
+
+class Tracer(object):
+    """
+    Collects the timing spans of a process and appends them
+    to its own trace file as JSON lines, so that workers never
+    write to the same file
+
+    :param trace_dir: Folder of the trace files
+
+    :type trace_dir: str
+    """
+
+    def __init__(self, trace_dir):
+        """
+        Constructor method
+        """
+        self.pid = os.getpid()
+        self.path = os.path.join(
+            trace_dir, f"{self.pid}-{uuid.uuid4().hex}{TRACE_EXTENSION}")
+        self.spans = []
+
+    def record(self, stage, asset, start, duration):
+        self.spans.append((stage, asset, start, duration))
+
+        if len(self.spans) >= cfg.trace_buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Append the spans recorded since the last flush
+        to the trace file
+        """
+        if len(self.spans) < 1:
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a") as trace_file:
+            for stage, asset, start, duration in self.spans:
+                trace_file.write(json.dumps(dict(
+                    stage=stage,
+                    asset=asset,
+                    start=start,
+                    duration=duration,
+                )) + "\n")
+
+        self.spans = []
+
+
+class Span(object):
+    """
+    Times a block of code and records it to the tracer
+    of this process
+    """
+    __slots__ = ("tracer", "stage", "asset", "start")
+
+    def __init__(self, tracer, stage, asset):
+        self.tracer = tracer
+        self.stage = stage
+        self.asset = asset
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(self.stage, self.asset, self.start,
+                           time.perf_counter() - self.start)
+
+
+# The tracer of this process, created on its first span.
+# Forked workers start their own.
+_tracer = None
+_NULL_SPAN = contextlib.nullcontext()
+# Folder of the trace files of this run, set by init_tracing.
+# Without one, spans are written to TRACE_DIR.
+_trace_dir = None
+
+
+def get_tracer():
+    """
+    :return: The tracer of this process, or None if
+    tracing is off
+    :rtype: Tracer
+    """
+    global _tracer
+
+    if not cfg.trace_spans:
+        return None
+
+    if _tracer is None or _tracer.pid != os.getpid():
+        _tracer = Tracer(_trace_dir or cfg.TRACE_DIR)
+
+    return _tracer
+
+
+def start_trace_run(trace_dir):
+    """
+    Turn tracing on for this run, giving it a folder of its
+    own so that reports don't mix its spans with those of
+    earlier runs
+
+    :param trace_dir: Folder of the trace folders of the runs
+
+    :type trace_dir: str
+
+    :return: The folder of this run
+    :rtype: str
+    """
+    run_dir = os.path.join(
+        trace_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+    init_tracing(run_dir)
+
+    return run_dir
+
+
+def init_tracing(trace_dir):
+    """
+    Process pool initializer which turns tracing on in a worker
+    when the run is traced. Workers which aren't forked import
+    the config again, so they wouldn't know otherwise.
+
+    :param trace_dir: Folder of the trace files of the run,
+    or None if it isn't traced
+
+    :type trace_dir: str
+    """
+    global _trace_dir
+
+    if trace_dir is None:
+        return
+
+    cfg.trace_spans = True
+    _trace_dir = trace_dir
+
+
+def get_trace_dir():
+    """
+    :return: The folder of the trace files of this run, to
+    pass to init_tracing in the workers, or None if tracing
+    is off
+    :rtype: str
+    """
+    if not cfg.trace_spans:
+        return None
+
+    return _trace_dir or cfg.TRACE_DIR
+
+
+def get_last_trace_run(trace_dir):
+    """
+    :param trace_dir: Folder of the trace folders of the runs
+
+    :type trace_dir: str
+
+    :return: The folder of the last traced run, or trace_dir
+    if no run has a folder of its own
+    :rtype: str
+    """
+    runs = []
+    if os.path.isdir(trace_dir):
+        runs = sorted(entry.path for entry in os.scandir(trace_dir)
+                      if entry.is_dir())
+
+    if len(runs) < 1:
+        return trace_dir
+
+    return runs[-1]
+
+
+def span(stage, asset=None):
+    """
+    Time a stage of the page generation. It does nothing
+    when tracing is off.
+
+    :param stage: Name of the stage
+
+    :type stage: str
+
+    :param asset: Path of the asset the stage works on,
+    defaults to None
+
+    :type asset: str, optional
+
+    :return: A context manager timing the stage
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        return _NULL_SPAN
+
+    return Span(tracer, stage, asset)
+
+
+def flush_traces():
+    """
+    Write the spans this process has recorded so far. Pool
+    workers don't run exit handlers, so tasks call it when
+    they finish.
+    """
+    if _tracer is not None and _tracer.pid == os.getpid():
+        _tracer.flush()
+
+
+atexit.register(flush_traces)
+
+
+def load_traces(trace_dir):
+    """
+    Read the spans of all the trace files of a folder
+
+    :param trace_dir: Folder of the trace files
+
+    :type trace_dir: str
+
+    :return: A span per row with its stage, asset, start
+    and duration
+    :rtype: pandas.DataFrame
+    """
+    spans = []
+    for trace_path in sorted(glob.glob(os.path.join(trace_dir,
+                                                    "*" + TRACE_EXTENSION))):
+        with open(trace_path) as trace_file:
+            for line in trace_file:
+                # A line without its newline was cut short
+                if line.endswith("\n"):
+                    spans.append(json.loads(line))
+
+    return pd.DataFrame(spans, columns=["stage", "asset", "start", "duration"])
+
+
+def summarize(spans, keys):
+    summary = spans.groupby(keys, sort=False)["duration"].agg(
+        count="count",
+        total="sum",
+        mean="mean",
+        p95=lambda durations: durations.quantile(0.95),
+        max="max",
+    )
+
+    return summary.reset_index()
+
+
+def create_trace_report(trace_dir, top=20):
+    """
+    Aggregate the trace files into the stages which took the
+    most time overall and the assets which were slowest to go
+    through a stage
+
+    :param trace_dir: Folder of the trace files
+
+    :type trace_dir: str
+
+    :param top: Number of assets to report, defaults to 20
+
+    :type top: int, optional
+
+    :return: The time taken per stage and per stage and asset
+    :rtype: tuple
+    """
+    spans = load_traces(trace_dir)
+
+    stages = summarize(spans, ["stage"])
+    stages = stages.sort_values("total", ascending=False)
+
+    assets = summarize(spans.dropna(subset=["asset"]), ["stage", "asset"])
+    assets = assets.sort_values("mean", ascending=False).head(top)
+
+    return stages, assets
+
+
+def print_trace_report(trace_dir, top=20):
+    """
+    Print the slowest stages and assets of the trace files
+
+    :param trace_dir: Folder of the trace files
+
+    :type trace_dir: str
+
+    :param top: Number of assets to report, defaults to 20
+
+    :type top: int, optional
+    """
+    stages, assets = create_trace_report(trace_dir, top)
+
+    if len(stages) < 1:
+        print(f"There are no traces in {trace_dir}")
+        return
+
+    print("Stages by total time (seconds)")
+    print(stages.to_string(index=False))
+    print()
+    print(f"Slowest {top} assets by mean time (seconds)")
+    print(assets.to_string(index=False))
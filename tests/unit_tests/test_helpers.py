@@ -1,10 +1,18 @@
 import pytest
 import math
+import time
+import threading
+import concurrent.futures
+import os
+import numpy as np
+from PIL import Image
 from src.layout_engine.helpers import (
+                        crop_image_only_outside,
                         get_min_area_panels,
                         move_child_to_line,
                         move_children_to_line,
-                        invert_for_next
+                        invert_for_next,
+                        noise_levels
 )
 
 from src.layout_engine.page_metadata_transforms import (
@@ -17,6 +25,13 @@ from src.layout_engine.page_metadata_draw import (
 )
 
 from src.layout_engine.page_objects import Page
+from src.layout_engine.task_scheduler import batch_range, run_in_window
+from src.layout_engine.placement import PlacementEngine
+from src.benchmarks import run_benchmarks
+from src.layout_engine import tracing
+from src.layout_engine.image_cache import ImageCache
+from src.convert_images import get_capped_size, downscale_assets
+import src.config_file as cfg
 
 @pytest.mark.parametrize(
     "min_area",
@@ -215,3 +230,273 @@ def test_move_children_to_line(horizontal_vertical, line_direction, change):
 
         # float comparison
         assert diff < 1e-12
+
+
+def test_run_in_window():
+    """
+    This function tests whether the task scheduler runs
+    every task while never having more than the window
+    of tasks in flight
+    """
+    in_flight = []
+    max_in_flight = []
+    lock = threading.Lock()
+
+    def task(batch):
+        with lock:
+            in_flight.append(batch)
+            max_in_flight.append(len(in_flight))
+        time.sleep(0.001)
+        with lock:
+            in_flight.remove(batch)
+        return list(range(*batch))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(run_in_window(executor, task, batch_range(50, 4), 3))
+
+    assert sorted(i for batch in results for i in batch) == list(range(50))
+    assert max(max_in_flight) <= 3
+
+
+class FakeObject(object):
+    """
+    A page object with a fixed size which is placed
+    at a list of given positions
+    """
+
+    def __init__(self, size, positions):
+        self.size = size
+        self.positions = list(positions)
+        self.location = None
+
+    def place_randomly(self):
+        self.location = self.positions.pop(0)
+
+    def get_resized(self):
+        return self.size, self.size
+
+    def get_overlap_box(self):
+        x, y = self.location
+        return x, y, x + self.size, y + self.size
+
+
+def test_placement_engine_retries():
+    """
+    This function tests whether the placement engine retries
+    colliding objects at new positions and gives up once
+    its attempts run out
+    """
+    engine = PlacementEngine(max_attempts=3)
+
+    first = FakeObject(100, [(0, 0)])
+    assert engine.place(first, first.place_randomly, 8)
+
+    # Collides twice and then fits
+    second = FakeObject(100, [(10, 10), (50, 50), (300, 300)])
+    assert engine.place(second, second.place_randomly, 8)
+    assert second.location == (300, 300)
+
+    # Never fits
+    third = FakeObject(100, [(0, 0), (300, 300), (20, 20)])
+    assert not engine.place(third, third.place_randomly, 8)
+
+    # Too small
+    fourth = FakeObject(4, [(600, 600)] * 3)
+    assert not engine.place(fourth, fourth.place_randomly, 8)
+
+    assert engine.get_stats() == dict(requested=4, placed=2, attempts=10)
+
+
+def test_run_benchmarks():
+    """
+    This tests whether the benchmarks run on their synthetic
+    assets and leave the config as it was
+    """
+    backgrounds_dir_path = cfg.backgrounds_dir_path
+    names = ["get_base_panels", "shrink_panels", "Character.render"]
+    results = run_benchmarks(repeat=2, names=names, font_path="font.ttf")
+
+    assert [result["name"] for result in results] == names
+    for result in results:
+        assert result["repeat"] == 2
+        assert 0 <= result["min"] <= result["median"] <= result["max"]
+
+    assert cfg.backgrounds_dir_path == backgrounds_dir_path
+
+
+def test_trace_report(tmp_path, monkeypatch):
+    """
+    This tests whether timing spans are written to the trace
+    file of the process and aggregated by stage and asset, and
+    that nothing is recorded when tracing is off
+    """
+    monkeypatch.setattr(cfg, "TRACE_DIR", str(tmp_path))
+    monkeypatch.setattr(tracing, "_tracer", None)
+
+    with tracing.span("Panel.render", "a.png"):
+        pass
+    assert tracing._tracer is None
+
+    monkeypatch.setattr(cfg, "trace_spans", True)
+    for asset, duration in [("a.png", 0.01), ("b.png", 0.03), ("b.png", 0.05)]:
+        with tracing.span("Panel.render", asset):
+            time.sleep(duration)
+    with tracing.span("Page.noise"):
+        pass
+    tracing.flush_traces()
+
+    stages, assets = tracing.create_trace_report(str(tmp_path), top=1)
+    assert list(stages["stage"]) == ["Panel.render", "Page.noise"]
+    assert list(stages["count"]) == [3, 1]
+    assert list(assets["asset"]) == ["b.png"]
+    assert assets["count"].iloc[0] == 2
+
+
+def test_trace_runs(tmp_path, monkeypatch):
+    """
+    This tests whether each traced run writes to a folder of its
+    own, which workers that import the config again trace to
+    once they're initialized, and which the report reads
+    """
+    monkeypatch.setattr(cfg, "TRACE_DIR", str(tmp_path))
+    monkeypatch.setattr(cfg, "trace_spans", False)
+    monkeypatch.setattr(tracing, "_tracer", None)
+    monkeypatch.setattr(tracing, "_trace_dir", None)
+
+    assert tracing.get_trace_dir() is None
+    assert tracing.get_last_trace_run(str(tmp_path)) == str(tmp_path)
+
+    os.makedirs(tmp_path / "20000101-000000-1")
+    run_dir = tracing.start_trace_run(str(tmp_path))
+    assert tracing.get_trace_dir() == run_dir
+
+    # A worker which imported the config again
+    monkeypatch.setattr(cfg, "trace_spans", False)
+    monkeypatch.setattr(tracing, "_trace_dir", None)
+    tracing.init_tracing(tracing.get_trace_dir())
+    assert tracing.get_trace_dir() is None
+
+    tracing.init_tracing(run_dir)
+    with tracing.span("Page.noise"):
+        pass
+    tracing.flush_traces()
+
+    assert tracing.get_last_trace_run(str(tmp_path)) == run_dir
+    stages, _ = tracing.create_trace_report(run_dir)
+    assert list(stages["stage"]) == ["Page.noise"]
+
+
+def test_image_cache(tmp_path):
+    """
+    This tests whether the image cache crops images like
+    crop_image_only_outside, evicts the least recently used
+    ones past its budget, reuses its on-disk copies and
+    resizes and flips images
+    """
+    paths = []
+    for i in range(3):
+        image = np.zeros((40, 50, 3), np.uint8)
+        image[5:30, 10:40] = 50 + i
+        paths.append(str(tmp_path / f"image_{i}.png"))
+        Image.fromarray(image).save(paths[-1])
+
+    # Room for two cropped 25x30 RGB images
+    cache = ImageCache(2 * 25 * 30 * 3, str(tmp_path / "cache"))
+    image = cache.get(paths[0], "RGB", crop=True)
+    expected = crop_image_only_outside(Image.open(paths[0]).convert("RGB"))
+    assert np.array_equal(np.asarray(image), expected)
+    assert cache.get(paths[0], "RGB", crop=True) is image
+
+    cache.get(paths[1], "RGB", crop=True)
+    cache.get(paths[0], "RGB", crop=True)
+    cache.get(paths[2], "RGB", crop=True)
+    assert len(cache) == 2
+    assert (paths[1], "RGB", True, None, None, ()) not in cache.images
+    assert cache.hits == 2 and cache.misses == 3
+
+    # A new cache loads the cropped images from disk
+    assert len(os.listdir(tmp_path / "cache")) == 3
+    cache = ImageCache(0, str(tmp_path / "cache"))
+    cache_path = cache.get_cache_path(paths[2], "RGB")
+    np.save(cache_path, np.full((2, 3, 3), 7, np.uint8))
+    image = cache.get(paths[2], "RGB", crop=True)
+    assert np.array_equal(np.asarray(image), np.full((2, 3, 3), 7, np.uint8))
+    assert len(cache) == 0
+
+    # Only the resized and flipped image is cached
+    cache = ImageCache(10**6)
+    image = cache.get(paths[0], "L", size=(25, 20),
+                      transpose=(Image.FLIP_LEFT_RIGHT,))
+    expected = Image.open(paths[0]).convert("L").resize((25, 20))
+    assert np.array_equal(np.asarray(image), np.fliplr(np.asarray(expected)))
+    assert len(cache) == 1 and cache.misses == 1
+
+
+@pytest.mark.parametrize("tile_bank", [False, True])
+def test_noise_levels(tile_bank, monkeypatch):
+    """
+    This tests whether the noise drawn for a page and the noise
+    taken from the tile bank are around the blank page's level
+    and reproducible
+    """
+    monkeypatch.setattr(cfg, "noise_tile_bank", tile_bank)
+
+    levels = noise_levels(300, 500, sigma=10, rng=np.random.default_rng(0))
+    assert levels.shape == (500, 300) and levels.dtype == np.uint8
+    assert abs(levels.mean() - 248) < 1 and 7 < levels.std() < 8.5
+
+    same_levels = noise_levels(300, 500, sigma=10,
+                               rng=np.random.default_rng(0))
+    assert np.array_equal(levels, same_levels)
+
+
+def test_downscale_assets(tmp_path, monkeypatch):
+    """
+    This tests whether copies of backgrounds are cropped and
+    scaled down to cover the page, foregrounds to the page's
+    area, images which already fit are copied as they are, and
+    the downloaded images are left alone
+    """
+    page_w, page_h = cfg.page_size
+    assert get_capped_size((page_w * 2, page_h * 4), True) == (page_w, page_h * 2)
+    assert get_capped_size((page_w * 4, page_h * 4), False) == (page_w, page_h)
+    assert get_capped_size((10, 20), True) == (10, 20)
+
+    backgrounds_dir = tmp_path / "backgrounds"
+    foregrounds_dir = tmp_path / "foregrounds"
+    backgrounds_dir.mkdir()
+    foregrounds_dir.mkdir()
+
+    background = np.full((page_h * 3 + 20, page_w * 3, 3), 200, np.uint8)
+    background[:20] = 0
+    background_path = str(backgrounds_dir / "background.jpg")
+    Image.fromarray(background).save(background_path)
+
+    foreground_path = str(foregrounds_dir / "foreground.png")
+    Image.new("RGBA", (100, 100), (255, 0, 0, 255)).save(foreground_path)
+
+    output_dir = tmp_path / "downscaled"
+    monkeypatch.setattr(cfg, "backgrounds_source_dir_path", str(backgrounds_dir))
+    monkeypatch.setattr(cfg, "foregrounds_source_dir_path", str(foregrounds_dir))
+    monkeypatch.setattr(cfg, "downscaled_assets_dir_path", str(output_dir))
+    monkeypatch.setattr(cfg, "backgrounds_dir_path", str(backgrounds_dir))
+    monkeypatch.setattr(cfg, "foregrounds_dir_path", str(foregrounds_dir))
+    monkeypatch.setattr(cfg, "CONCURRENT_MAX_WORKERS", 1)
+
+    # Running it again starts from the downloaded images
+    for _ in range(2):
+        downscale_assets()
+
+    assert os.path.samefile(cfg.backgrounds_dir_path,
+                            output_dir / "backgrounds")
+    with Image.open(output_dir / "backgrounds" / "background.jpg") as image:
+        assert image.format == "JPEG"
+        assert image.size == (page_w, page_h)
+    with open(output_dir / "foregrounds" / "foreground.png", "rb") as copy:
+        with open(foreground_path, "rb") as original:
+            assert copy.read() == original.read()
+
+    with Image.open(background_path) as image:
+        assert image.size == (page_w * 3, page_h * 3 + 20)
+    assert sorted(os.listdir(tmp_path)) == ["backgrounds", "downscaled",
+                                            "foregrounds"]
@@ -2,13 +2,37 @@ import pytest
 import json
 import pandas as pd
 import os
+import pickle
+import numpy as np
+import skimage.draw
+import cjkwrap
+from scipy import ndimage
 from src.layout_engine.page_metadata_transforms import shrink_panels
+from src.layout_engine.text_corpus import TextCorpus, TextSampler
+from src.layout_engine.metadata_store import MetadataStore, INDEX_EXTENSION
+from src.layout_engine.run_manifest import RunManifest
+from src.layout_engine.page_objects.speech_bubble import (
+    load_font,
+    get_glyph_metrics,
+    wrap_text
+)
+from src.benchmarks import find_system_font
+from src.layout_engine.helpers import get_leaf_panels
+from src.layout_engine import page_generator, page_metadata_creator
+from src.layout_engine.page_compositor import (
+    PillowCompositor,
+    NumpyCompositor
+)
+from src.layout_engine.generation_context import GenerationContext
+from src.asset_index import AssetIndex, describe_image
+from src.layout_engine.page_objects.speech_bubble_factory import SpeechBubbleFactory
+from PIL import Image, ImageDraw
 
 from src.layout_engine.page_objects import (
-    Page
+    Page, Panel, SpeechBubble
 )
 from src.layout_engine.page_metadata_creator import (
-    get_base_panels, populate_panels
+    get_base_panels, populate_panels, create_page_metadata, get_page_seed
 )
 import src.config_file as cfg
 
@@ -34,12 +58,12 @@ def data_files():
             if viable == "True":
                 viable_font_files.append(path)
 
-    return (backgrounds_dir,
-            foregrounds_dir,
-            viable_font_files,
-            text_dataset,
-            speech_bubble_tags
-            )
+    return GenerationContext(backgrounds_dir,
+                             foregrounds_dir,
+                             viable_font_files,
+                             text_dataset,
+                             speech_bubble_tags
+                             )
 
 
 def test_panel_get_polygons():
@@ -74,12 +98,12 @@ def test_speech_bubble_dumping(data_files):
     :param data_files: File names and information used to populate the
     speech bubble
 
-    :type data_files: tuple
+    :type data_files: GenerationContext
     """
 
     page = get_base_panels(num_panels=1)
     page = shrink_panels(page)
-    page = populate_panels(page, *data_files, minimum_speech_bubbles=1, no_characters=True)
+    page = populate_panels(page, data_files, minimum_speech_bubbles=1, no_characters=True)
     bubble = page.leaf_children[0].speech_bubbles[0]
     data = bubble.dump_data()
     data_keys = data.keys()
@@ -168,11 +192,11 @@ def test_speech_bubble_rendering(inverted,
     :param data_files: File names and information used to populate the
     speech bubble
 
-    :type data_files: tuple
+    :type data_files: GenerationContext
     """
     page = get_base_panels(num_panels=1)
     page = shrink_panels(page)
-    page = populate_panels(page, *data_files, minimum_speech_bubbles=1, no_characters=True)
+    page = populate_panels(page, data_files, minimum_speech_bubbles=1, no_characters=True)
     bubble = page.leaf_children[0].speech_bubbles[0]
     bubble.transforms = transforms
 
@@ -190,6 +214,372 @@ def test_speech_bubble_rendering(inverted,
     bubble.render()
 
 
+def test_font_cache():
+    """
+    This tests whether fonts are loaded once per file and size
+    """
+    font_path = find_system_font()
+    load_font.cache_clear()
+
+    font = load_font(font_path, 30)
+    assert load_font(font_path, 30) is font
+    assert load_font(font_path, 31) is not font
+    assert font.size == 30
+    assert load_font.cache_info().hits == 1
+
+
+@pytest.mark.parametrize("width", [2, 7, 15, 40])
+def test_wrap_text(width):
+    """
+    This tests whether wrapping only the start of a text gives
+    the same first lines as wrapping all of it
+    """
+    rng = np.random.default_rng(0)
+    words = ["a", "to", "well-known", "AVATAR", "supercalifragilistic",
+             "end.", "  ", "テキスト"]
+
+    for _ in range(50):
+        text = " ".join(rng.choice(words, rng.integers(1, 60)))
+        for max_lines in [0, 1, 3, 10]:
+            lines = wrap_text(text, width, max_lines)
+            all_lines = cjkwrap.wrap(text, width=width)
+
+            assert lines[:max_lines] == all_lines[:max_lines]
+            assert (len(lines) > max_lines) == (len(all_lines) > max_lines)
+
+
+def test_fit_text():
+    """
+    This tests whether the font size found by bisection is the
+    one found by shrinking the font one size at a time
+    """
+    font_path = find_system_font()
+    bubble = SpeechBubble([], [], font_path, None, [], 100, 100, 0.0, None,
+                          transforms=[], text_orientation="ltr",
+                          font_size=40)
+    text = "hello world, how are you doing today? " * 5
+
+    for wrap_length, stack_length in [(400, 300), (200, 150), (100, 60),
+                                      (80, 20)]:
+        def fits(size):
+            metrics = get_glyph_metrics(font_path, size)
+            width, height = metrics.get_size(text)
+            max_chars = int(wrap_length // (width/len(text)))
+            lines = [text]
+            if width > wrap_length and max_chars > 1:
+                lines = cjkwrap.wrap(text, width=max_chars)
+            return len(lines)*height <= stack_length
+
+        # Shrinking one size at a time down to 10
+        expected_size = next((size for size in range(40, 10, -1)
+                              if fits(size)), 10)
+        size, lines, text_size = bubble.fit_text(text, 40, 10,
+                                                 wrap_length, stack_length)
+
+        assert size == expected_size
+        assert len(lines)*text_size[1] <= stack_length
+
+
+@pytest.mark.parametrize(
+    "coords",
+    [
+        [(10, 10), (526, 10), (526, 318), (10, 318), (10, 10)],
+        [(0, 0), (800, 0), (800, 1200), (0, 1200), (0, 0)],
+        [(33.5, 242), (33.5, 207), (152, 207), (33.5, 242)],
+        [(100, 500), (700, 420), (650, 1100), (120, 1000), (100, 500)],
+    ]
+)
+def test_panel_drawable_area(coords):
+    """
+    This tests whether the drawable area of a panel has
+    the same points as eroding the panel's polygon drawn
+    on the whole page and whether the points sampled
+    from it are in it
+
+    :param coords: Coordinates of the panel
+
+    :type coords: list
+    """
+    panel = Panel(coords=coords, name="panel", parent=None, orientation="h")
+    panel.refresh_drawable_area()
+
+    c, r = zip(*coords)
+    rr, cc = skimage.draw.polygon([e-1 for e in r], [e-1 for e in c],
+                                  shape=(cfg.page_height, cfg.page_width))
+    img = np.zeros((cfg.page_height, cfg.page_width), np.uint8)
+    img[rr, cc] = 1
+    img = ndimage.binary_erosion(
+        ndimage.binary_erosion(
+            img, structure=np.ones((max(int(panel.height//5), 1), 1))),
+        structure=np.ones((1, max(int(panel.width//5), 1))))
+
+    assert len(panel.drawable_area) == img.sum()
+
+    for _ in range(20):
+        x, y = panel.get_random_coords()
+        assert img[y, x]
+
+
+@pytest.mark.parametrize(
+    "coords",
+    [
+        [(10, 10), (526, 10), (526, 318), (10, 318), (10, 10)],
+        [(0, 0), (800, 0), (800, 1200), (0, 1200), (0, 0)],
+        [(33.5, 242), (33.5, 207), (152, 207), (33.5, 242)],
+        [(100, 500), (700, 420), (650, 1100), (120, 1000), (100, 500)],
+    ]
+)
+def test_panel_rendering_in_its_box(coords, tmp_path):
+    """
+    This tests whether a panel is rendered in an image
+    which holds all of the panel and its outline, and
+    only them once pasted on the page
+
+    :param coords: Coordinates of the panel
+
+    :type coords: list
+    """
+    image_path = str(tmp_path / "background.png")
+    Image.fromarray(np.full((600, 400, 3), 128, np.uint8)).save(image_path)
+
+    panel = Panel(coords=coords, name="panel", parent=None, orientation="h")
+    panel.refresh_size()
+    panel.image = image_path
+    boundary_width = 6
+
+    panel_img, panel_mask, location = panel.render(
+        boundary_width, (0, 0, 0), np.random.default_rng(0))
+    assert panel_img.size == panel_mask.size
+
+    page_mask = Image.new("L", cfg.page_size, 0)
+    page_mask.paste(panel_mask.getchannel("A"), location)
+    page_mask = np.asarray(page_mask) > 0
+
+    # The panel with its outline drawn on the whole page
+    polygon = list(panel.get_polygon())
+    outlined = Image.new("L", cfg.page_size, 0)
+    draw = ImageDraw.Draw(outlined)
+    draw.polygon(polygon, fill=255)
+    draw.line(polygon + [polygon[0]], fill=255, width=boundary_width,
+              joint="curve")
+    outlined = np.asarray(outlined) > 0
+
+    x, y = location
+    w, h = panel_img.size
+    inside = np.zeros_like(outlined)
+    inside[y:y+h, x:x+w] = True
+
+    assert page_mask.any()
+    assert not (page_mask & ~outlined).any()
+    assert not (outlined & ~inside).any()
+
+
+def test_text_corpus_pickling(tmp_path):
+    """
+    This tests whether a memory-mapped text corpus is
+    sent to workers by path and reads the same rows back
+    """
+    dataframe = pd.DataFrame({
+        "English": ["Hello", "Goodbye"],
+        "Japanese": ["こんにちは", "さようなら"],
+    })
+    parquet_path = str(tmp_path / "dialogues.parquet")
+    dataframe.to_parquet(parquet_path)
+
+    corpus = TextCorpus.from_parquet(parquet_path,
+                                     str(tmp_path / "dialogues.arrow"))
+    pickled = pickle.dumps(corpus)
+
+    assert len(pickled) < 1024
+    assert len(pickle.loads(pickled)) == 2
+    assert pickle.loads(pickled).get_row(1) == {
+        "English": "Goodbye",
+        "Japanese": "さようなら"
+    }
+
+
+def test_text_sampler():
+    """
+    This tests whether the text sampler gives the rows
+    matching the indices it samples across refills, and
+    the same rows for the same random number generator
+    """
+    dataframe = pd.DataFrame({
+        "English": [str(i) for i in range(10)],
+        "Japanese": [str(-i) for i in range(10)],
+    })
+    corpus = TextCorpus.from_dataframe(dataframe)
+    sampler = TextSampler(corpus, np.random.default_rng(0), batch_size=3)
+
+    indices, texts = sampler.sample(7)
+
+    assert len(indices) == 7
+    assert texts == [{"English": str(i), "Japanese": str(-i)}
+                     for i in indices]
+    assert all(type(i) is int for i in indices)
+
+    same_sampler = TextSampler(corpus, np.random.default_rng(0),
+                               batch_size=3)
+    assert same_sampler.sample(7)[0] == indices
+
+
+def test_asset_index_sizes(tmp_path):
+    """
+    This tests whether the asset index gives the
+    sizes of indexed and unindexed images
+    """
+    indexed_path = str(tmp_path / "indexed.png")
+    missing_path = str(tmp_path / "missing.png")
+    Image.new("RGBA", (30, 20)).save(indexed_path)
+    Image.new("RGB", (5, 7)).save(missing_path)
+
+    record = describe_image(indexed_path)
+    pd.DataFrame([record]).to_parquet(str(tmp_path / "index.parquet"))
+    asset_index = AssetIndex.load(str(tmp_path / "index.parquet"))
+
+    assert record["mode"] == "RGBA"
+    # The image is fully transparent
+    assert (record["alpha_x1"], record["alpha_y1"],
+            record["alpha_x2"], record["alpha_y2"]) == (0, 0, 0, 0)
+    assert describe_image(missing_path)["alpha_x2"] == 5
+    assert len(asset_index) == 1
+    assert asset_index.get_size(indexed_path) == (30, 20)
+    assert asset_index.get_size(missing_path) == (5, 7)
+
+
+def test_speech_bubble_factory_templates(tmp_path):
+    """
+    This tests whether the speech bubble factory picks templates
+    by orientation and gives each bubble its own writing areas
+    """
+    bubble_path = str(tmp_path / "bubble.png")
+    Image.new("L", (40, 30)).save(bubble_path)
+    label = json.dumps([{"x": 10, "y": 20, "width": 50, "height": 40,
+                         "original_width": 40, "original_height": 30}])
+    speech_bubble_tags = pd.DataFrame({
+        "imagename": [bubble_path, bubble_path],
+        "label": [label, label],
+        "orientation": [None, "tl"],
+    })
+    text_dataset = pd.DataFrame({"English": ["Hi"], "Japanese": ["やあ"]})
+    factory = SpeechBubbleFactory(speech_bubble_tags, ["font.ttf"],
+                                  text_dataset)
+
+    page = Page()
+    bubble = factory.create_with_no_orientation(page)
+    oriented_bubble = factory.create_with_orientation(page)
+    bubble.writing_areas[0]["x"] = 0
+
+    assert type(bubble.orientation) is float
+    assert oriented_bubble.orientation == "tl"
+    assert oriented_bubble.writing_areas[0]["x"] == 10
+    assert (bubble.width, bubble.height) == (40, 30)
+    assert bubble.texts == [{"English": "Hi", "Japanese": "やあ"}]
+
+
+def test_page_metadata_reproducibility(data_files):
+    """
+    This tests whether pages created with generators
+    seeded the same way are the same
+    """
+    dumps = []
+    for _ in range(2):
+        page = create_page_metadata(data_files, np.random.default_rng(42))
+        page_json = page.dump_data("./", dry=True)
+        dumps.append(page_json.replace(page.name, ""))
+
+    assert dumps[0] == dumps[1]
+
+
+def test_generate_page(data_files, monkeypatch):
+    """
+    This tests whether a page can be created and annotated
+    in one go without writing its metadata
+    """
+    monkeypatch.setattr(page_metadata_creator, "_worker_context",
+                        data_files)
+
+    status = page_generator.generate_page((0, 42, True, False))
+
+    assert status["name"] is not None
+    assert status["image"]["id"] == 1
+    assert status["image"]["file_name"] == status["name"] + cfg.output_format
+    assert all(ann["image_id"] == 1 for ann in status["annotations"])
+
+
+def test_page_render_reproducibility():
+    """
+    This tests whether a page with a seed renders
+    the same image every time it's loaded
+    """
+    page = get_base_panels(3, "v", rng=np.random.default_rng(0))
+    page.seed = 1234
+    page.background = "#color"
+    page_json = json.loads(page.dump_data("./", dry=True))
+
+    images = []
+    for _ in range(2):
+        loaded = Page()
+        loaded.load_dict(page_json)
+        images.append(np.asarray(loaded.render()))
+
+    assert loaded.seed == 1234
+    assert np.array_equal(images[0], images[1])
+
+
+@pytest.mark.parametrize("rotation", [0, 7])
+def test_page_compositors(rotation):
+    """
+    This tests whether the NumPy compositor builds the
+    same page as the Pillow one, layer soft edges, layers
+    partly off the page and rotation included
+
+    :param rotation: Angle to rotate the page by
+
+    :type rotation: int
+    """
+    rng = np.random.default_rng(0)
+    layers = []
+    for location in [(-30, -20), (60, 40), (150, 120)]:
+        layer = Image.fromarray(rng.integers(0, 256, (90, 120, 3),
+                                             dtype=np.uint8))
+        mask = Image.new("L", layer.size, 0)
+        ImageDraw.Draw(mask).ellipse((5, 5, 115, 85), fill=255)
+        mask = mask.resize((60, 45)).resize(layer.size)
+        layers.append((layer, location, mask))
+
+    # Rotated pages grow, so these cover them
+    levels = rng.integers(200, 256, (300, 300), dtype=np.uint8)
+    texture = Image.fromarray(rng.integers(0, 256, (300, 300, 3),
+                                           dtype=np.uint8))
+
+    pages = []
+    for compositor in [PillowCompositor(), NumpyCompositor()]:
+        # Twice, so that the NumPy compositor reuses its buffers
+        for _ in range(2):
+            compositor.new_page(240, 200)
+            for layer, location, mask in layers:
+                compositor.paste(layer, location, mask)
+            compositor.rotate(rotation)
+            compositor.put_on_background((250, 240, 230))
+
+            width, height = compositor.size
+            compositor.multiply(levels[:height, :width].copy())
+            compositor.blend(texture.crop((0, 0, width, height)), 180)
+            pages.append(np.asarray(compositor.get_image()))
+
+    assert all(np.array_equal(pages[0], page) for page in pages[1:])
+
+    # Pages without a background stay RGBA, and they mustn't
+    # change when the compositor starts the next page
+    compositor = NumpyCompositor()
+    compositor.new_page(240, 200)
+    compositor.paste(*layers[1])
+    image = compositor.get_image()
+    compositor.new_page(240, 200)
+    assert image.getbbox() is not None
+
+
 def test_page_dumping():
     """
     This tests checks whether
@@ -222,6 +612,150 @@ def test_page_loading():
     page.load_data("tests/unit_tests/test_files/test.json")
 
 
+def test_page_loading_leaves_only():
+    """
+    This tests whether loading only the leaf panels
+    of a page gives the panels of the full tree
+    """
+    page = Page()
+    page.load_data("tests/unit_tests/test_files/test.json")
+    leaf_children = []
+    get_leaf_panels(page, leaf_children)
+
+    leaves_page = Page()
+    leaves_page.load_data("tests/unit_tests/test_files/test.json",
+                          leaves_only=True)
+
+    assert leaves_page.children == []
+    assert ([panel.name for panel in leaves_page.leaf_children] ==
+            [panel.name for panel in leaf_children])
+    assert ([panel.coords for panel in leaves_page.leaf_children] ==
+            [panel.coords for panel in leaf_children])
+    assert ([len(panel.characters) for panel in leaves_page.leaf_children] ==
+            [len(panel.characters) for panel in leaf_children])
+
+
+def test_page_objects_have_no_dict():
+    """
+    This tests whether the page objects only keep
+    their slots
+    """
+    page = Page()
+    page.load_data("tests/unit_tests/test_files/test.json")
+
+    assert not hasattr(page, "__dict__")
+    assert not hasattr(page.children[0], "__dict__")
+
+
+def test_metadata_store(tmp_path, monkeypatch):
+    """
+    This tests whether pages written to the metadata store
+    can be read back by name and by streaming the shards,
+    and that a cut short index entry is ignored
+    """
+    monkeypatch.setattr(cfg, "METADATA_SHARD_SIZE", 2)
+    with open("tests/unit_tests/test_files/test.json") as json_file:
+        data = json.load(json_file)
+
+    store = MetadataStore(str(tmp_path))
+    for i in range(3):
+        store.write(f"page-{i}", dict(data, name=f"page-{i}"))
+    store.close()
+
+    shards = store.get_shards()
+    assert len(shards) == 2
+
+    with open(shards[0] + INDEX_EXTENSION, "a") as index_file:
+        index_file.write("page-3\t0")
+
+    store = MetadataStore(str(tmp_path))
+    assert len(store) == 3
+    assert sorted(page["name"] for page in store) == ["page-0", "page-1", "page-2"]
+    assert sum(len(entries) for _, entries in store.iter_batches(1)) == 3
+
+    page = Page()
+    page.load_data("page-1", store=store)
+    assert page.name == "page-1"
+    assert len(page.children) == len(data["children"])
+
+
+def test_run_manifest(tmp_path):
+    """
+    This tests whether the run manifest keeps track of the
+    pages each stage still has to do across reopening it,
+    and whether rewriting a page's metadata makes it stale
+    """
+    store = MetadataStore(str(tmp_path))
+    path = str(tmp_path / "manifest.sqlite")
+    manifest = RunManifest(path)
+    base_seed = manifest.get_base_seed()
+
+    statuses = [dict(index=i, name=f"page-{i}",
+                     metadata=store.write(f"page-{i}", dict(name=f"page-{i}")))
+                for i in manifest.get_missing_pages(3)]
+    manifest.add_pages(statuses)
+    manifest.close()
+
+    manifest = RunManifest(path)
+    assert manifest.get_base_seed() == base_seed
+    assert manifest.get_missing_pages(4) == [3]
+
+    batches = list(manifest.iter_pending("rendered", 2))
+    assert [len(entries) for _, entries in batches] == [2, 1]
+    shard, entries = batches[0]
+    records = store.read_records(store.get_shard_path(shard),
+                                 [entry[1:] for entry in entries])
+    assert [page["name"] for page in records] == ["page-0", "page-1"]
+
+    manifest.set_rendered([0, 1])
+    manifest.set_annotated([(2, dict(id=3), [])])
+    assert manifest.count_pending("rendered") == 1
+    assert manifest.count_pending("annotated") == 2
+    assert manifest.get_annotations() == [(dict(id=3), [])]
+
+    statuses[0]["metadata"] = store.write("page-0", dict(name="page-0"))
+    manifest.add_pages(statuses[:1])
+    assert manifest.count_pending("rendered") == 2
+
+    manifest.add_failed_pages([3, 4])
+    manifest.add_failed_pages([4])
+    assert manifest.get_attempts([2, 3, 4]) == [0, 1, 2]
+    seeds = [get_page_seed(base_seed, 4, attempt) for attempt in range(3)]
+    assert seeds[0] == get_page_seed(base_seed, 4)
+    assert len(set(seeds)) == 3
+    manifest.close()
+
+
+def test_import_json_pages(tmp_path):
+    """
+    This tests whether pages written as JSON files are moved
+    into the metadata store after the pages of the manifest
+    """
+    with open("tests/unit_tests/test_files/test.json") as json_file:
+        data = json.load(json_file)
+
+    metadata_dir = str(tmp_path / "metadata")
+    os.makedirs(metadata_dir)
+    for i in range(2):
+        with open(os.path.join(metadata_dir, f"page-{i}.json"), "w") as json_file:
+            json.dump(dict(data, name=f"page-{i}"), json_file)
+
+    manifest = RunManifest(str(tmp_path / "manifest.sqlite"))
+    manifest.add_pages([dict(index=0, name="page-a", metadata=None)])
+
+    assert manifest.import_json_pages(metadata_dir) == 2
+    assert manifest.import_json_pages(metadata_dir) == 0
+    assert not any(filename.endswith(".json")
+                   for filename in os.listdir(metadata_dir))
+    assert manifest.count_pending("rendered") == 2
+
+    store = MetadataStore(metadata_dir)
+    _, entries = next(manifest.iter_pending("rendered", 2))
+    assert [entry[:2] for entry in entries] == [(1, "page-0"), (2, "page-1")]
+    assert store.get("page-1")["children"] == data["children"]
+    manifest.close()
+
+
 @pytest.mark.parametrize(
     "num_panels, speech_bubbles",
     [
@@ -259,12 +793,12 @@ def test_page_rendering(num_panels, speech_bubbles, data_files):
     :param data_files: File names and information used to populate the
     speech bubble
 
-    :type data_files: tuple
+    :type data_files: GenerationContext
     """
 
     page = get_base_panels(num_panels=num_panels)
 
     if speech_bubbles:
-        page = populate_panels(page, *data_files)
+        page = populate_panels(page, data_files)
 
     page.render(show=False)